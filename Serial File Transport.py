@@ -1,10 +1,25 @@
 import serial
 import time
 import os
-import base64
+import binascii
+import re
 import struct
 import secrets
 import sys
+import threading
+import queue
+import hashlib
+import hmac
+import json
+import sqlite3
+import argparse
+import signal
+import contextlib
+import io
+from collections import OrderedDict, deque
+
+from transport_common import (parse_capabilities, parse_metrics, stream_metrics, format_metrics,
+                              compare_files, format_chunk_ranges)
 
 BaudRate = 115200
 CHUNK_SIZE = 1024
@@ -12,8 +27,902 @@ default_input = "input.txt"
 default_ciphertext = "encrypted.bin"
 default_output = "output.txt"
 
+TX_QUEUE_SIZE = 4            # 写线程发送队列深度（块）
+RX_BUFFER_SIZE = 64 * 1024   # 读线程预分配接收缓冲区大小（字节）
+RX_QUEUE_SIZE = 64           # 读线程接收队列深度（行/数据块）
+LINK_POLL_INTERVAL = 0.05    # 读写线程检查停止标志的间隔（秒）
+STREAM_EVENT_TIMEOUT = 60    # 流式阶段没有任何进展的最长时间（秒；已校准时MCU是否还在由保活ping判断）
+SUMMARY_TIMEOUT = 5          # STREAM_COMPLETE之后等待SUMMARY的超时（秒，未校准时）
+REPLY_TIMEOUT = 10           # 握手阶段等待应答的超时（秒，未校准时）
+OPTIONS_TIMEOUT = 2          # 等待协议选项应答的超时（秒），旧固件不应答
+NAK_RETRY_INTERVAL = 0.5     # 请求MCU重传输出帧后未收到时重新请求的间隔（秒）
+RETX_WINDOW = 8              # MCU为重传保留的已发送输出帧数
+READ_AHEAD_CHUNKS = 8        # 读线程预读的输入块数
+WRITE_BATCH_SIZE = 64 * 1024 # 写线程每次写入的批大小（字节）
+WRITE_BEHIND_BATCHES = 16    # 等待写入的批数上限（磁盘跟不上时串口线程才会等待）
+FOLLOW_LATENCY = 0.5         # 跟随模式：块未满时最多等待这么久就发送（秒）
+FOLLOW_POLL_INTERVAL = 0.1   # 跟随模式：文件没有新数据时的检查间隔（秒）
+
+# 会话协议选项（'o' 命令 + 4字节位掩码，MCU应答 OPTIONS:<接受的位掩码>）
+OPT_FRAME_CRC = 0x01         # 数据帧带序号和CRC32，损坏的帧通过NAK单独重传
+OPT_CREDITS = 0x02           # MCU用 CREDIT:<n> 通告空闲接收缓冲区，主机只按额度发送
+OPT_KEY_SLOTS = 0x04         # 支持板上密钥槽（'k' 命令装入，操作码 'E'/'D' + 槽号引用）
+KEY_SLOTS = 8                # 板上密钥槽数量
+KEY_SLOT_TIMEOUT = 2         # 等待密钥槽装入应答的超时（秒）
+OPT_AAD_CACHE = 0x08         # 支持板上AAD槽（'a' 命令登记，会话中按槽号引用）
+AAD_SLOTS = 4                # 板上AAD槽数量（主机端LRU与之一致）
+AAD_SLOT_SIZE = 4096         # 每个AAD槽的最大长度（字节）
+AAD_CACHE_MIN = 64           # AAD至少这么长才值得登记（字节）
+AAD_REF_FLAG = 0x80000000    # AAD长度字段的最高位：低8位是已登记的AAD槽号
+OPT_CHUNK_INDEX = 0x10       # 数据块前带4字节块序号，可以只发送部分块（跳过缓存命中的块）
+OPT_DECLARED_LENGTH = 0x20   # 数据阶段先声明总长度：块不带长度头，按额度连续发送，不需要结束标记
+OPT_ROUND_TRIP = 0x40        # 支持往返校验操作 'r'（同一会话中加密块的结果立即发回解密）
+OPT_TAG_VERIFY = 0x80        # 支持只校验标签的操作 'v'（MCU不返回明文，只返回通过/失败位图）
+OPT_RECORDS = 0x100          # 记录模式：每个数据块是一批记录（2字节长度+数据），每条记录单独派生Nonce、带标签
+OPT_ABORT = 0x200            # 能力位：MCU收到UART break时在块边界中止会话，应答 ABORTED: chunks=<n>
+OPT_PING = 0x400             # 能力位：'p' 校准命令和数据阶段的保活ping（MCU应答 PONG）
+OPT_BENCH = 0x800            # 能力位：分阶段测试命令（链路回显 'x'、只加密 'y'，见 benchmark.py）
+OPTION_NAMES = {
+    OPT_FRAME_CRC: "frame_crc",
+    OPT_CREDITS: "credits",
+    OPT_KEY_SLOTS: "key_slots",
+    OPT_AAD_CACHE: "aad_cache",
+    OPT_CHUNK_INDEX: "chunk_index",
+    OPT_DECLARED_LENGTH: "declared_length",
+    OPT_ROUND_TRIP: "round_trip",
+    OPT_TAG_VERIFY: "tag_verify",
+    OPT_RECORDS: "records",
+    OPT_ABORT: "abort",
+    OPT_PING: "ping",
+    OPT_BENCH: "bench",
+}
+
+# 能力查询（'c' 命令，MCU应答 CAPS: key=value ...，旧固件不应答）
+CAPS_TIMEOUT = 1
+
+# 双模式固件的加密引擎切换（'g' 命令 + 1字节引擎号，MCU应答 ENGINE:<名称>），
+# CAPS 中的 engines=... 列出固件包含的引擎
+ENGINE_IDS = {"hw_aes": 0, "sw_aes": 1, "sw_ascon": 2}
+ENGINE_TIMEOUT = 1
+
+# 增量更新清单（加密文件旁的 <文件名>.manifest.json）
+MANIFEST_SUFFIX = ".manifest.json"
+CHUNK_INDEX_BITS = 24        # OPT_CHUNK_INDEX 块序号的低24位是块位置，高8位是更新代数
+MAX_GENERATION = 255         # 最多增量更新次数（之后需要用新的Nonce重新加密整个文件）
+
+# 密文块缓存
+CHUNK_CACHE_PATH = "chunk_cache.sqlite3"
+CHUNK_CACHE_MAX_BYTES = 256 * 1024 * 1024
+NAK_MARKER = 0xFFFFFFFF      # 帧头长度字段为此值时表示请求MCU重传输出帧
+PING_MARKER = 0xFFFFFFFD     # 块头（或帧头）长度字段为此值时是保活ping
+
+# 链路校准与自适应超时（OPT_PING）
+CALIBRATION_BYTES = 256      # 校准时每个方向传输的字节数
+CALIBRATION_TIMEOUT = 1      # 等待校准应答的超时（秒）
+TIMEOUT_MARGIN = 3           # 超时 = 期望的传输和计算时间 × 余量 + 下限
+TIMEOUT_FLOOR = 0.2          # 线程调度和USB转串口延迟（秒）
+ASSUMED_CRYPTO_RATE = 50000  # MCU不报告 crypto_rate 时假设的加解密速度（字节/秒，偏保守）
+KEEPALIVE_INTERVAL = 10      # 数据阶段没有待处理的块时每隔这么久发送保活ping（秒，小于MCU的接收超时）
+UNPINGED_MARGIN = 10         # 不能发送ping时（声明长度且没有帧校验）等待输出的超时再放宽的倍数
+
+# 记录模式（OPT_RECORDS）
+MAX_RECORD_SIZE = CHUNK_SIZE - 2  # 单条明文记录的最大长度（一批至少能装下一条）
+RECORD_FAILED = 0xFFFF       # 解密结果中标签错误的记录：长度字段为此值，没有数据
+RECORD_QUEUE_SIZE = 1024     # 等待发送/等待取走的记录数上限
+
+# 中止（UART break）
+ABORT_BREAK_TIME = 0.01      # break持续时间（秒）
+ABORT_TIMEOUT = 1            # 发送break后等待 ABORTED 应答的超时（秒）
+READY_PROBE_TIMEOUT = 2.5    # 会话开始时等待READY这么久仍没有收到，就发送break让MCU回到空闲状态（秒）
+READY_TIMEOUT = 15
+
+_B64_INVALID = re.compile(rb'[^A-Za-z0-9+/=]')
+
+
+def option_names(mask):
+    return [name for bit, name in OPTION_NAMES.items() if mask & bit]
+
+
+def send_uart_break(ser, duration=ABORT_BREAK_TIME):
+    """发送UART break（线路保持低电平duration秒），MCU把它作为中止信号"""
+    ser.break_condition = True
+    time.sleep(duration)
+    ser.break_condition = False
+
+
+def decode_b64_payload(data):
+    """直接从字节数据（bytes/memoryview）解码Base64，失败返回None"""
+    try:
+        # a2b_base64会忽略非Base64字符（如行尾的\r）
+        return binascii.a2b_base64(data)
+    except binascii.Error:
+        pass
+    # 填充缺失时补齐后重试
+    cleaned = _B64_INVALID.sub(b'', bytes(data))
+    cleaned += b'=' * (-len(cleaned) % 4)
+    if len(cleaned) < 4:
+        return None
+    try:
+        return binascii.a2b_base64(cleaned)
+    except binascii.Error:
+        return None
+
+
+class RxRingBuffer:
+    """预分配的接收缓冲区：串口数据直接追加到固定的bytearray中，
+    用memoryview切出完整的行，不产生中间的bytes/str副本"""
+
+    def __init__(self, size=RX_BUFFER_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0  # 未消费数据的起点
+        self.end = 0    # 已写入数据的终点
+        self._scan = 0  # 下一次查找换行的起点
+
+    def feed(self, data):
+        """追加收到的数据（空间不足时把未消费的部分移到缓冲区开头）"""
+        n = len(data)
+        if self.end + n > len(self.buf):
+            pending = self.end - self.start
+            if pending + n > len(self.buf):
+                # 单行超过缓冲区大小（不应发生），扩大缓冲区
+                self.view.release()
+                self.buf = self.buf[self.start:self.end] + bytearray(max(len(self.buf), pending + n))
+                self.view = memoryview(self.buf)
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+            self._scan -= self.start
+            self.start, self.end = 0, pending
+        self.view[self.end:self.end + n] = data
+        self.end += n
+
+    def pop_line(self):
+        """取出下一行（不含行尾\r\n）的memoryview；没有完整的行时返回None。
+        返回的视图在下一次feed()之前有效"""
+        idx = self.buf.find(b'\n', self._scan, self.end)
+        if idx < 0:
+            self._scan = self.end
+            return None
+        line_end = idx
+        if line_end > self.start and self.buf[line_end - 1] == 0x0D:
+            line_end -= 1
+        line = self.view[self.start:line_end]
+        self.start = self._scan = idx + 1
+        return line
+
+
+class SerialLink:
+    """全双工串口链路：写线程从有界发送队列取数据写入串口，
+    读线程把MCU输出拆分成行，B64数据在读线程中解码后放入接收队列"""
+
+    BREAK = object()  # 发送队列中的UART break
+
+    def __init__(self, ser, tx_queue_size=TX_QUEUE_SIZE, rx_queue_size=RX_QUEUE_SIZE):
+        self.ser = ser
+        self.tx_queue = queue.Queue(maxsize=tx_queue_size)
+        self.rx_queue = queue.Queue(maxsize=rx_queue_size)
+        self.error = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._saved_timeout = None
+
+    def start(self):
+        """启动读写线程"""
+        # 读线程用短超时阻塞读取，以便及时响应停止请求
+        self._saved_timeout = self.ser.timeout
+        self.ser.timeout = LINK_POLL_INTERVAL
+        self._threads = [
+            threading.Thread(target=self._writer_loop, name="serial-writer", daemon=True),
+            threading.Thread(target=self._reader_loop, name="serial-reader", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """停止读写线程（写线程先发送完队列中剩余的数据）"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self.ser.timeout = self._saved_timeout
+
+    def send(self, data):
+        """放入发送队列，队列满时阻塞（背压）"""
+        while self.error is None:
+            try:
+                self.tx_queue.put(data, timeout=LINK_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                if self._stop.is_set():
+                    break
+        return False
+
+    def abort(self):
+        """丢弃发送队列中尚未写出的数据，写线程写完当前数据后发送UART break"""
+        while True:
+            try:
+                self.tx_queue.get_nowait()
+            except queue.Empty:
+                break
+        return self.send(self.BREAK)
+
+    def wake(self):
+        """唤醒等待接收事件的协调器（例如数据来源有了新数据）"""
+        self._put(('WAKE', None))
+
+    def get(self, timeout):
+        """从接收队列取一个事件：('LINE', 文本)、('B64', 解码数据或None)、
+        ('B64F', (序号, 数据))、('ERROR', 信息)、('WAKE', None)"""
+        try:
+            return self.rx_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _put(self, event):
+        while not self._stop.is_set():
+            try:
+                self.rx_queue.put(event, timeout=LINK_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _writer_loop(self):
+        try:
+            while not (self._stop.is_set() and self.tx_queue.empty()):
+                try:
+                    data = self.tx_queue.get(timeout=LINK_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if data is self.BREAK:
+                    send_uart_break(self.ser)
+                    continue
+                self.ser.write(data)
+                if self.tx_queue.empty():
+                    self.ser.flush()
+        except Exception as e:
+            self.error = e
+            self._put(('ERROR', f"write failed: {e}"))
+
+    @staticmethod
+    def parse_frame_line(line):
+        """解析 B64F:<序号>:<CRC32>:<Base64> 行，返回 (序号, 数据)；
+        CRC错误时数据为None，无法解析序号时两者都为None"""
+        prefix = bytes(line[5:32])
+        first = prefix.find(b':')
+        second = prefix.find(b':', first + 1) if first > 0 else -1
+        # 先确认两个分隔符都在、字段只含数字，再转换（帧头损坏时按损坏的帧丢弃，由缺帧检测重传）
+        if second < 0 or not prefix[:first].isdigit():
+            return None, None
+        seq_field, crc_field = prefix[:first], prefix[first + 1:second]
+        if not 0 < len(crc_field) <= 8 or crc_field.strip(b'0123456789abcdefABCDEF'):
+            return None, None
+        try:
+            seq, crc = int(seq_field), int(crc_field, 16)
+            header = struct.pack('>I', seq)
+        except (ValueError, struct.error):
+            return None, None
+        data = decode_b64_payload(line[5 + second + 1:])
+        if data is None or binascii.crc32(header + data) != crc:
+            return seq, None
+        return seq, data
+
+    @staticmethod
+    def parse_line(line):
+        """把一行MCU输出（memoryview）转换为接收事件，空行返回None"""
+        if line[:4] == b'B64:':
+            return ('B64', decode_b64_payload(line[4:]))
+        if line[:5] == b'B64F:':
+            return ('B64F', SerialLink.parse_frame_line(line))
+        text = str(line, 'utf-8', errors='ignore').strip()
+        return ('LINE', text) if text else None
+
+    def _reader_loop(self):
+        ring = RxRingBuffer()
+        try:
+            while not self._stop.is_set():
+                data = self.ser.read(self.ser.in_waiting or 1)
+                if not data:
+                    continue
+                ring.feed(data)
+                while True:
+                    line = ring.pop_line()
+                    if line is None:
+                        break
+                    event = self.parse_line(line)
+                    if event is not None:
+                        self._put(event)
+        except Exception as e:
+            self.error = e
+            self._put(('ERROR', f"read failed: {e}"))
+
+
+class KeyHandle:
+    """板上密钥槽的句柄：密钥在第一次使用时装入槽中（只经过串口一次），
+    之后的会话只发送槽号，MCU直接使用已扩展的密钥"""
+
+    def __init__(self, key, slot=0):
+        if len(key) != 16:
+            raise ValueError("Key must be 16 bytes")
+        if not 0 <= slot < KEY_SLOTS:
+            raise ValueError(f"Key slot must be 0..{KEY_SLOTS - 1}")
+        self.key = bytes(key)
+        self.slot = slot
+        self.loaded_ports = set()  # 已装入该密钥的端口
+
+    def __repr__(self):
+        return f"KeyHandle(slot={self.slot})"
+
+
+class LinkTiming:
+    """由校准测得的往返时间和吞吐量推算超时：期望的传输和计算时间 × TIMEOUT_MARGIN +
+    TIMEOUT_FLOOR。数据阶段再用实际的出块间隔（与TCP重传超时相同的平滑估计）放宽"""
+
+    def __init__(self, rtt, bytes_per_s, crypto_rate=None):
+        self.rtt = rtt
+        self.bytes_per_s = bytes_per_s
+        self.crypto_rate = crypto_rate or ASSUMED_CRYPTO_RATE
+        self.srtt = None  # 平滑的出块间隔
+        self.rttvar = None
+
+    def __repr__(self):
+        return (f"LinkTiming(rtt={self.rtt * 1000:.1f}ms, {self.bytes_per_s:.0f} B/s, "
+                f"crypto {self.crypto_rate} B/s)")
+
+    def deadline(self, sent=0, received=0, compute=0):
+        """发送sent字节、MCU处理compute字节、收到received字节的应答的超时（秒）"""
+        expected = self.rtt + (sent + received) / self.bytes_per_s + compute / self.crypto_rate
+        return TIMEOUT_MARGIN * expected + TIMEOUT_FLOOR
+
+    def chunk_deadline(self, chunk_size):
+        """等待下一块输出的超时：一块的发送、计算和Base64返回"""
+        deadline = self.deadline(chunk_size, chunk_size * 4 // 3 + 64, chunk_size)
+        if self.srtt is not None:
+            deadline = max(deadline, self.srtt + 4 * self.rttvar + TIMEOUT_FLOOR)
+        return deadline
+
+    def observe(self, interval):
+        """记录一次实际的出块间隔"""
+        if self.srtt is None:
+            self.srtt, self.rttvar = interval, interval / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - interval)
+            self.srtt = 0.875 * self.srtt + 0.125 * interval
+
+
+class AadCache:
+    """主机端的AAD槽LRU，与MCU上的AAD槽一一对应：
+    未命中时优先使用空闲槽，没有空闲槽时淘汰最久未用的槽号并重新登记到该槽"""
+
+    def __init__(self, capacity=AAD_SLOTS):
+        self.capacity = capacity
+        self.slots = OrderedDict()  # AAD的SHA-256 -> 槽号
+        self.free = list(range(capacity))  # 未映射到任何AAD的槽号
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, aad):
+        """返回 (槽号, 是否已登记)；未登记时调用方必须把AAD装入返回的槽号，
+        登记成功后调用 store，失败时调用 release 归还槽号"""
+        digest = hashlib.sha256(aad).digest()
+        slot = self.slots.get(digest)
+        if slot is not None:
+            self.slots.move_to_end(digest)
+            self.hits += 1
+            return slot, True
+        self.misses += 1
+        if self.free:
+            slot = self.free.pop(0)
+        else:
+            _, slot = self.slots.popitem(last=False)
+        return slot, False
+
+    def store(self, aad, slot):
+        self.discard(slot)
+        if slot in self.free:
+            self.free.remove(slot)
+        self.slots[hashlib.sha256(aad).digest()] = slot
+
+    def discard(self, slot):
+        for digest, value in list(self.slots.items()):
+            if value == slot:
+                del self.slots[digest]
+
+    def release(self, slot):
+        """登记失败：槽号不再对应任何AAD，放回空闲列表"""
+        self.discard(slot)
+        if slot not in self.free:
+            self.free.append(slot)
+            self.free.sort()
+
+    def clear(self):
+        self.slots.clear()
+        self.free = list(range(self.capacity))
+
+
+class ChunkCache:
+    """持久化的密文块缓存：AES-GCM-SIV是确定性的，密钥、块Nonce、AAD和明文块都相同时
+    密文块也相同。键为 (密钥ID, 块Nonce, AAD哈希, 明文块哈希)，
+    按最近使用顺序淘汰，总大小不超过 max_bytes"""
+
+    def __init__(self, path=CHUNK_CACHE_PATH, max_bytes=CHUNK_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (id BLOB PRIMARY KEY, data BLOB NOT NULL, "
+                        "size INTEGER NOT NULL, used INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS chunks_used ON chunks (used)")
+        self._clock, self.total_bytes = self.db.execute(
+            "SELECT COALESCE(MAX(used), 0), COALESCE(SUM(size), 0) FROM chunks").fetchone()
+
+    @staticmethod
+    def key_id(key):
+        """密钥ID（不在缓存中保存密钥本身）"""
+        return hashlib.sha256(b'chunk-cache-key' + key).digest()[:16]
+
+    @staticmethod
+    def chunk_id(key_id, nonce, index, aad_hash, chunk):
+        """块Nonce由基础Nonce和块序号唯一确定，因此用 (nonce, index) 代表块Nonce"""
+        h = hashlib.sha256(key_id)
+        h.update(nonce)
+        h.update(struct.pack('>I', index))
+        h.update(aad_hash)
+        h.update(hashlib.sha256(chunk).digest())
+        return h.digest()
+
+    def get(self, chunk_id):
+        row = self.db.execute("SELECT data FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._clock += 1
+        self.db.execute("UPDATE chunks SET used = ? WHERE id = ?", (self._clock, chunk_id))
+        return bytes(row[0])
+
+    def put(self, chunk_id, data):
+        self._clock += 1
+        old = self.db.execute("SELECT size FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+        if old is not None:
+            self.total_bytes -= old[0]
+        self.db.execute("INSERT OR REPLACE INTO chunks (id, data, size, used) VALUES (?, ?, ?, ?)",
+                        (chunk_id, data, len(data), self._clock))
+        self.total_bytes += len(data)
+        while self.total_bytes > self.max_bytes:
+            # 淘汰最久未使用的块
+            victims = self.db.execute("SELECT id, size FROM chunks ORDER BY used LIMIT 64").fetchall()
+            if not victims:
+                break
+            for victim_id, size in victims:
+                self.db.execute("DELETE FROM chunks WHERE id = ?", (victim_id,))
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def flush(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class StreamDigest:
+    """流式计算SHA-256：按块序号顺序累加（帧校验模式下重传的输出帧可能乱序到达）"""
+
+    def __init__(self, prefix=b''):
+        self.hash = hashlib.sha256(prefix)
+        self.next_seq = 0
+        self.pending = {}  # 提前到达的块：序号 -> 数据
+        self.length = len(prefix)
+
+    def update(self, seq, data):
+        self.pending[seq] = data
+        while self.next_seq in self.pending:
+            data = self.pending.pop(self.next_seq)
+            self.hash.update(data)
+            self.length += len(data)
+            self.next_seq += 1
+
+    def hexdigest(self):
+        if self.pending:
+            raise ValueError(f"chunks missing before {min(self.pending)}")
+        return self.hash.hexdigest()
+
+
+class BufferSource:
+    """_run_stream 的数据来源：按块提供内存中的数据"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.total_size = len(data)  # 数据总长度（None表示未知，不能声明长度）
+
+    @property
+    def exhausted(self):
+        """不会再有数据"""
+        return self.pos >= len(self.data)
+
+    def read_chunk(self, size):
+        """返回下一个不超过size字节的块；暂时没有数据时返回None"""
+        if self.exhausted:
+            return None
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+class QueueSource:
+    """_run_stream 的数据来源：其他线程用 put() 提供数据块，end() 表示没有更多数据。
+    队列最多 depth 块（生产者等待即背压）；取块时没有数据返回None，数据到达后
+    通过 set_wakeup 的回调唤醒协调器。whole_blocks 时每个放入的块原样作为一块发送"""
+
+    def __init__(self, depth=READ_AHEAD_CHUNKS, whole_blocks=True):
+        self.queue = queue.Queue(maxsize=depth)
+        self.whole_blocks = whole_blocks
+        self.total_size = None
+        self.leftover = b''
+        self.eof = False
+        self.error = None
+        self._cancelled = False
+        self._waiting = False  # 取块时没有数据，需要唤醒
+        self._wakeup = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def set_wakeup(self, callback):
+        self._wakeup = callback
+
+    @property
+    def exhausted(self):
+        return self.eof and not self.leftover
+
+    def read_chunk(self, size):
+        if self._cancelled:
+            self.eof = True
+            self.leftover = b''
+            return None
+        while len(self.leftover) < size and not self.eof and not (self.whole_blocks and self.leftover):
+            with self._lock:
+                try:
+                    block = self.queue.get_nowait()
+                except queue.Empty:
+                    self._waiting = True
+                    return None
+            if block is None:
+                self.eof = True
+            else:
+                self.leftover += block
+        if not self.leftover:
+            return None
+        chunk, self.leftover = self.leftover[:size], self.leftover[size:]
+        return chunk
+
+    def put(self, block):
+        """放入一块（None表示结束），队列满时等待；close() 之后返回False"""
+        while not self._stop.is_set():
+            try:
+                self.queue.put(block, timeout=LINK_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        self._wake()
+        return not self._stop.is_set()
+
+    def end(self):
+        """没有更多数据：发送完已放入的块后结束流"""
+        return self.put(None)
+
+    def cancel(self):
+        """丢弃尚未发送的块，尽快结束流"""
+        self._cancelled = True
+        self._wake()
+
+    def close(self):
+        """会话结束：不再接收数据（等待中的 put() 返回False）"""
+        self._stop.set()
+
+    def _wake(self):
+        with self._lock:
+            wakeup = self._wakeup if self._waiting else None
+            self._waiting = False
+        if wakeup is not None:
+            wakeup()
+
+
+class RecordSource(QueueSource):
+    """记录模式的数据来源：put() 放入一条已带长度头的记录；取块时把已到达的记录尽量
+    多地装进一块（不拆分记录），链路忙时等待的记录自然合并成较大的批"""
+
+    def __init__(self, depth=RECORD_QUEUE_SIZE):
+        super().__init__(depth)
+
+    def read_chunk(self, size):
+        if self._cancelled:
+            self.eof = True
+            self.leftover = b''
+            return None
+        batch = []
+        total = 0
+        while not self.eof:
+            if self.leftover:
+                record, self.leftover = self.leftover, b''
+            else:
+                with self._lock:
+                    try:
+                        record = self.queue.get_nowait()
+                    except queue.Empty:
+                        if not batch:
+                            self._waiting = True
+                        break
+                if record is None:
+                    self.eof = True
+                    break
+            if batch and total + len(record) > size:
+                self.leftover = record
+                break
+            batch.append(record)
+            total += len(record)
+        return b''.join(batch) if batch else None
+
+
+class ReadAheadSource(QueueSource):
+    """_run_stream 的数据来源：读线程从文件预读最多 depth 个块，串口线程取块时不等待磁盘。
+    path 为 '-' 时读取标准输入，也可以是已打开的二进制文件对象（长度未知，offset 由调用者
+    自行跳过）；follow 时跟随增长的文件（如日志），块满或等待超过 latency 秒就发送，直到调用
+    finish()；prefixed 时输入是跟随模式写出的密文记录（4字节长度 + 密文块），每条记录作为一块"""
+
+    def __init__(self, path, offset=0, chunk_size=CHUNK_SIZE, depth=READ_AHEAD_CHUNKS,
+                 follow=False, prefixed=False, latency=FOLLOW_LATENCY):
+        # 跟随模式和记录输入中读线程给出的每一块都是完整的块，不再凑满请求的大小
+        super().__init__(depth, whole_blocks=follow or prefixed)
+        self._pipe = None  # 跟随标准输入时由单独的线程阻塞读取，这里按超时取数据
+        self._pipe_rest = b''
+        self.owned = False  # 文件由本对象打开（关闭时一起关闭）
+        if path == '-':
+            self.file = sys.stdin.buffer
+        elif hasattr(path, 'read'):
+            self.file = path
+        else:
+            self.file = open(path, 'rb')
+            self.owned = True
+            self.file.seek(offset)
+            self.total_size = None if follow else os.fstat(self.file.fileno()).st_size - offset
+        self.path = path
+        self.chunk_size = chunk_size
+        self.follow = follow
+        self.prefixed = prefixed
+        self.latency = latency
+        self._finish = threading.Event()  # 跟随模式：读完已有的数据后结束
+        if path == '-' and follow and not prefixed:
+            self._pipe = queue.Queue()
+            threading.Thread(target=self._pipe_loop, name="stdin-reader", daemon=True).start()
+        self._thread = threading.Thread(target=self._reader_loop, name="read-ahead", daemon=True)
+        self._thread.start()
+
+    def finish(self):
+        """结束跟随：发送完已经写入文件的数据后结束流"""
+        self._finish.set()
+
+    def close(self):
+        super().close()
+        self._finish.set()
+        self._thread.join()
+        if self.owned:
+            self.file.close()
+
+    def _read_exact(self, n):
+        # 读取n字节；跟随文件时等待文件增长，直到 finish()（标准输入读到EOF就结束）
+        data = b''
+        while len(data) < n and not self._stop.is_set():
+            piece = self.file.read(n - len(data))
+            if piece:
+                data += piece
+            elif self.follow and self.path != '-' and not self._finish.is_set():
+                self._stop.wait(FOLLOW_POLL_INTERVAL)
+            else:
+                break
+        return data
+
+    def _pipe_loop(self):
+        try:
+            while True:
+                piece = self.file.read1(self.chunk_size)
+                self._pipe.put(piece)
+                if not piece:
+                    return
+        except OSError as e:
+            self.error = e
+            self._pipe.put(b'')
+
+    def _read_available(self, n):
+        # 跟随模式：读取最多n字节，暂时没有新数据时返回b''
+        if self._pipe is None:
+            return self.file.read(n)
+        if not self._pipe_rest:
+            try:
+                self._pipe_rest = self._pipe.get(timeout=FOLLOW_POLL_INTERVAL)
+            except queue.Empty:
+                return b''
+            if not self._pipe_rest:
+                self._finish.set()  # 标准输入已关闭
+                return b''
+        piece, self._pipe_rest = self._pipe_rest[:n], self._pipe_rest[n:]
+        return piece
+
+    def _reader_loop(self):
+        try:
+            if self.prefixed:
+                while not self._stop.is_set():
+                    header = self._read_exact(4)
+                    if not header:
+                        break
+                    length = struct.unpack('>I', header)[0] if len(header) == 4 else None
+                    block = self._read_exact(length) if length else b''
+                    if length is None or len(block) < length:
+                        raise OSError(f"truncated chunk record in {self.path}")
+                    self.put(block)
+            elif self.follow:
+                pending = bytearray()
+                first_at = 0
+                while not self._stop.is_set():
+                    finishing = self._finish.is_set()
+                    piece = self._read_available(self.chunk_size - len(pending))
+                    if piece:
+                        if not pending:
+                            first_at = time.monotonic()
+                        pending += piece
+                    if pending and (len(pending) >= self.chunk_size or finishing or
+                                    time.monotonic() - first_at >= self.latency):
+                        self.put(bytes(pending))
+                        pending = bytearray()
+                    elif not piece:
+                        if finishing:
+                            break
+                        if self._pipe is None:
+                            self._finish.wait(FOLLOW_POLL_INTERVAL)
+            else:
+                while not self._stop.is_set():
+                    block = self.file.read(self.chunk_size)
+                    if not block:
+                        break
+                    self.put(block)
+        except OSError as e:
+            self.error = e
+        finally:
+            self.put(None)
+
+
+class WriteBehindSink:
+    """_run_stream 的结果去处：结果块按序号顺序攒成批，由写线程写入文件，
+    结束时只fsync一次；失败时删除不完整的输出文件。
+    path 为 '-' 时写到标准输出，也可以是已打开的二进制文件对象（只flush，不fsync、不关闭）；
+    prefixed 时每块前加4字节长度（跟随模式的块大小不固定）"""
+
+    def __init__(self, path, header=b'', batch_size=WRITE_BATCH_SIZE, depth=WRITE_BEHIND_BATCHES,
+                 prefixed=False):
+        self.path = path
+        self.owned = not (path == '-' or hasattr(path, 'write'))  # 文件由本对象创建
+        if path == '-':
+            self.file = sys.__stdout__.buffer
+        else:
+            self.file = open(path, 'wb') if self.owned else path
+        self.prefixed = prefixed
+        self.batch = bytearray(header)
+        self.batch_size = batch_size
+        self.next_seq = 0
+        self.pending = {}       # 提前到达的块：序号 -> 数据
+        self.bytes_written = 0  # 结果数据的字节数（不含文件头）
+        self.error = None
+        self.queue = queue.Queue(maxsize=depth)
+        self._thread = threading.Thread(target=self._writer_loop, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def write(self, seq, data):
+        """on_output 回调：保存第seq块的结果（None表示MCU没有返回数据）"""
+        self.pending[seq] = data or b''
+        while self.next_seq in self.pending:
+            data = self.pending.pop(self.next_seq)
+            if self.prefixed:
+                self.batch += struct.pack('>I', len(data))
+            self.batch += data
+            self.bytes_written += len(data)
+            self.next_seq += 1
+        if self.batch and len(self.batch) >= self.batch_size:
+            self.queue.put(self.batch)
+            self.batch = bytearray()
+
+    def close(self, keep=True):
+        """写完剩余数据并fsync；keep为False或写入出错时删除文件。返回文件是否完整保存"""
+        if keep and self.batch:
+            self.queue.put(self.batch)
+        self.queue.put(None)
+        self._thread.join()
+        try:
+            if not self.owned:
+                self.file.flush()
+            elif keep and self.error is None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+        except OSError as e:
+            self.error = e
+        finally:
+            if self.owned:
+                self.file.close()
+        if self.error is not None:
+            print(f"Write error: {self.error}")
+        if not keep or self.error is not None:
+            if self.owned:
+                os.remove(self.path)
+            return False
+        return True
+
+    def _writer_loop(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.error is None:
+                try:
+                    self.file.write(data)
+                    if self.queue.empty():
+                        self.file.flush()  # 管道另一端尽快收到结果
+                except OSError as e:
+                    self.error = e
+
+
+class RoundTripSource:
+    """往返校验会话（操作 'r'）的数据来源：先发送明文块，MCU返回的密文块随即
+    作为解密块发回同一会话，解密结果与原明文块在内存中比较。
+    每块前带1字节类型（'e'/'d'）和4字节块序号"""
+
+    def __init__(self, data, chunk_size=CHUNK_SIZE):
+        self.chunks = [data[pos:pos + chunk_size] for pos in range(0, len(data), chunk_size)]
+        self.next_plain = 0
+        self.feedback = deque()  # 待发回解密的 (块号, 密文)
+        self.sent = []           # 按发送顺序：(类型, 块号)
+        self.pending = 0         # 已发送但尚未返回密文的明文块数
+        self.verified = 0
+        self.mismatches = []     # 往返结果与原明文不同（或没有结果）的块号
+        self.total_size = None
+
+    @property
+    def exhausted(self):
+        return self.next_plain >= len(self.chunks) and not self.feedback and self.pending == 0
+
+    def read_chunk(self, size):
+        # 优先发回密文：尽早完成校验，内存中只保留少量在途的块
+        if self.feedback:
+            n, ciphertext = self.feedback.popleft()
+            self.sent.append((b'd', n))
+            return b'd' + struct.pack('>I', n) + ciphertext
+        if self.next_plain < len(self.chunks):
+            n = self.next_plain
+            self.next_plain += 1
+            self.pending += 1
+            self.sent.append((b'e', n))
+            return b'e' + struct.pack('>I', n) + self.chunks[n]
+        return None
+
+    def on_output(self, seq, out):
+        """MCU返回第seq个已发送块的结果（None表示没有收到数据）"""
+        kind, n = self.sent[seq]
+        if kind == b'e':
+            self.pending -= 1
+            if out is None:
+                self.mismatches.append(n)
+            else:
+                self.feedback.append((n, out))
+        else:
+            self.verified += 1
+            if out != self.chunks[n]:
+                self.mismatches.append(n)
+
+
 class GCM_SIV_FileProcessor:
-    def __init__(self, port, verbose=False, show_progress=True):
+    def __init__(self, port, verbose=False, show_progress=True, frame_crc=False,
+                 credit_flow=True, rtscts=False, aad_cache=True, chunk_cache=None,
+                 write_manifest=False, engine=None, declared_length=False):
         self.port = port
         self.ser = None
         self.verbose = verbose
@@ -25,10 +934,36 @@ class GCM_SIV_FileProcessor:
         self.custom_key = None  # 用户自定义密钥
         self.custom_nonce = None  # 用户自定义Nonce
         self.custom_aad = b''  # 用户自定义AAD
+        self.frame_crc = frame_crc  # 请求帧校验与选择性重传（需要固件支持）
+        self.credit_flow = credit_flow  # 请求基于额度的流控（需要固件支持）
+        self.rtscts = rtscts  # 使用RTS/CTS硬件流控（需要连接RTS/CTS线）
+        self.session_options = 0  # 本次会话MCU接受的协议选项
+        self.options_supported = None  # 固件是否应答 'o' 命令（None表示未知）
+        self.key_slots_used = False  # 本次会话是否使用了板上密钥槽
+        self.aad_cache = AadCache() if aad_cache else None  # 已登记到MCU的AAD
+        self.aad_slot_used = None  # 本次会话引用的AAD槽号
+        self.chunk_cache = chunk_cache  # 密文块缓存（ChunkCache），None表示不使用
+        self.cache_report = None  # 最近一次加密的缓存统计
+        self.digests = None  # 最近一次加密/解密在流式过程中算出的SHA-256（十六进制）
+        self.mcu_metrics = None  # 最近一次数据流MCU报告的统计（stream_metrics() 的结果）
+        self.follow_source = None  # 正在跟随的输入（stop_follow 结束它）
+        self.follow_latency = FOLLOW_LATENCY  # 跟随模式中块未满时的最长等待（秒）
+        self.write_manifest = write_manifest  # 加密时写出块哈希清单（update_file需要）
+        self.capabilities = None  # MCU能力（CAPS应答），{}表示旧固件不支持查询
+        self.engine = engine  # 双模式固件中每次会话使用的加密引擎（None表示不切换）
+        self.declared_length = declared_length  # 已知数据长度时预先声明（需要固件支持；块不带长度头）
+        self.frames_resent = 0
+        self.frames_nak_requested = 0
+        self.abort_report = None  # 最近一次中止时MCU报告的已处理块数
+        self.link_timing = None  # 链路校准结果（LinkTiming），None表示未校准，使用固定超时
+        self._cancel = threading.Event()
+        self._link = None  # 数据阶段正在使用的链路（cancel() 唤醒它）
         
     def set_custom_parameters(self, key=None, nonce=None, aad=None):
-        """设置用户自定义参数"""
-        if key is not None:
+        """设置用户自定义参数（key 可以是16字节密钥或 KeyHandle）"""
+        if isinstance(key, KeyHandle):
+            self.custom_key = key
+        elif key is not None:
             if len(key) != 16:
                 raise ValueError("Key must be 16 bytes")
             self.custom_key = key
@@ -41,6 +976,19 @@ class GCM_SIV_FileProcessor:
         if aad is not None:
             self.custom_aad = aad if isinstance(aad, bytes) else aad.encode('utf-8')
         
+    def stop_follow(self):
+        """结束跟随模式：发送完已经写入输入文件的数据后正常结束会话（可以在信号处理中调用）"""
+        if self.follow_source is not None:
+            self.follow_source.finish()
+
+    def cancel(self):
+        """中止正在进行的流式会话：丢弃尚未发送的数据，用UART break通知MCU在块边界停止并
+        回到空闲状态，操作返回失败（可以在其他线程或信号处理中调用）"""
+        self._cancel.set()
+        link = self._link
+        if link is not None:
+            link.wake()
+
     def _update_progress(self):
         """更新进度显示"""
         if self.show_progress and self.total_size > 0:
@@ -50,9 +998,16 @@ class GCM_SIV_FileProcessor:
 
     def connect(self):
         """连接到串口设备"""
+        self._cancel.clear()
         try:
-            self.ser = serial.Serial(self.port, BaudRate, timeout=10, dsrdtr=False,
-                                   write_timeout=10, xonxoff=False, rtscts=False)
+            if self.port.lower().startswith('sim'):
+                # 使用MCU固件仿真器（见 mcu_simulator.py）
+                from mcu_simulator import open_simulated_port
+                self.ser = open_simulated_port(self.port, BaudRate, timeout=10, write_timeout=10,
+                                               rtscts=self.rtscts)
+            else:
+                self.ser = serial.Serial(self.port, BaudRate, timeout=10, dsrdtr=False,
+                                       write_timeout=10, xonxoff=False, rtscts=self.rtscts)
             print(f"Connected to {self.port}")
             return True
         except Exception as e:
@@ -79,8 +1034,10 @@ class GCM_SIV_FileProcessor:
                 time.sleep(0.01)
         return output_lines
         
-    def wait_for_message(self, expected_msg, timeout=10):
-        """等待特定消息 - 增强版本"""
+    def wait_for_message(self, expected_msg, timeout=None):
+        """等待特定消息 - 增强版本（不给出timeout时按链路校准结果推算）"""
+        if timeout is None:
+            timeout = self._reply_timeout()
         print(f"Waiting for: {expected_msg}")
         start_time = time.time()
         
@@ -114,38 +1071,25 @@ class GCM_SIV_FileProcessor:
         print(f"Timeout waiting for: {expected_msg}")
         return None
         
-    def send_and_wait(self, data, expected_response, timeout=10):
-        """发送数据并等待响应"""
+    def send_and_wait(self, data, expected_response, timeout=None):
+        """发送数据并等待响应（不给出timeout时按链路校准结果推算）"""
         if isinstance(data, str):
             data = data.encode()
+        if timeout is None:
+            timeout = self._reply_timeout(len(data))
         print(f"Sending: {data[:min(50, len(data))]}{'...' if len(data) > 50 else ''}")
         self.ser.write(data)
         self.ser.flush()
         return self.wait_for_message(expected_response, timeout)
         
     def safe_base64_decode(self, b64_data):
-        """安全的Base64解码"""
-        try:
-            # 移除所有可能的无效字符
-            import re
-            b64_data = re.sub(r'[^A-Za-z0-9+/=]', '', b64_data)
-            
-            # 确保长度是4的倍数
-            padding_needed = (4 - len(b64_data) % 4) % 4
-            b64_data += '=' * padding_needed
-            
-            # 验证Base64字符串格式
-            if len(b64_data) < 4 or len(b64_data) % 4 != 0:
-                print(f"Invalid Base64 length: {len(b64_data)}")
-                return None
-                
-            # 尝试解码
-            decoded = base64.b64decode(b64_data)
-            return decoded
-        except Exception as e:
-            print(f"Base64 decode error: {e}")
-            print(f"Problematic data length: {len(b64_data)}")
-            return None
+        """安全的Base64解码（str或bytes）"""
+        if isinstance(b64_data, str):
+            b64_data = b64_data.encode('ascii', errors='ignore')
+        decoded = decode_b64_payload(b64_data)
+        if decoded is None:
+            print(f"Base64 decode error, problematic data length: {len(b64_data)}")
+        return decoded
     
     def send_streaming_chunk(self, chunk_data, is_last=False):
         """在流式模式下发送一个数据块（简化版）"""
@@ -179,23 +1123,260 @@ class GCM_SIV_FileProcessor:
             self.ser.flush()
             return True
     
-    def encrypt_file(self, input_file, output_file):
-        """加密文件（支持自定义参数）"""
-        if not self.connect():
+    def query_capabilities(self):
+        """查询MCU固件能力（需要已连接且MCU空闲），结果保存在 self.capabilities"""
+        reply = self.send_and_wait(b'c', 'CAPS', CAPS_TIMEOUT)
+        if reply and reply.startswith('CAPS:'):
+            self.capabilities = parse_capabilities(reply)
+            print(f"MCU capabilities: {self.capabilities.get('algorithm', '?')} "
+                  f"v{self.capabilities.get('version', '?')}, "
+                  f"options {option_names(self.capabilities.get('options', 0))}")
+        else:
+            # 旧固件不支持能力查询，也不支持协议选项
+            self.capabilities = {}
+            self.options_supported = False
+            print("MCU does not report capabilities, using basic streaming")
+        return self.capabilities
+
+    def _reply_timeout(self, sent=0):
+        """发送sent字节后等待一行应答的超时"""
+        if self.link_timing is None:
+            return REPLY_TIMEOUT
+        return self.link_timing.deadline(sent, 64)
+
+    def calibrate_link(self):
+        """链路校准（需要已连接且MCU空闲）：空的 'p' 测往返时间，再来回传输
+        CALIBRATION_BYTES 字节测吞吐量；结果保存在 self.link_timing，之后的超时由它推算"""
+        def probe(size):
+            start = time.perf_counter()
+            self.ser.write(b'p' + struct.pack('>HH', size, size) + bytes(size))
+            saved = self.ser.timeout
+            self.ser.timeout = CALIBRATION_TIMEOUT
+            try:
+                while time.perf_counter() - start < CALIBRATION_TIMEOUT:
+                    line = self.ser.readline()
+                    if line.startswith(b'PONG:'):
+                        return time.perf_counter() - start, len(line)
+            finally:
+                self.ser.timeout = saved
+            return None, 0
+
+        rtt, _ = probe(0)
+        elapsed, reply_size = probe(CALIBRATION_BYTES) if rtt is not None else (None, 0)
+        if elapsed is None:
+            print("Link calibration failed, using fixed timeouts")
+            self.link_timing = None
+            return None
+        bytes_per_s = (CALIBRATION_BYTES + reply_size) / max(elapsed - rtt, 1e-4)
+        self.link_timing = LinkTiming(rtt, bytes_per_s, (self.capabilities or {}).get("crypto_rate"))
+        print(f"Link calibration: RTT {rtt * 1000:.1f} ms, {bytes_per_s:.0f} B/s")
+        return self.link_timing
+
+    def session_info(self):
+        """本次会话的固件能力与实际使用的协议选项（随测试结果一起记录）"""
+        return {
+            "capabilities": self.capabilities or {},
+            "options": self.session_options,
+            "features": option_names(self.session_options),
+            "engine": self.engine or (self.capabilities or {}).get("algorithm"),
+            "link": {"rtt": self.link_timing.rtt, "bytes_per_s": self.link_timing.bytes_per_s}
+            if self.link_timing else None,
+            "mcu": self.mcu_metrics,
+        }
+
+    def _select_engine(self):
+        """在双模式固件上切换本次会话的加密引擎（需要已连接且MCU空闲）"""
+        if self.engine is None:
+            return True
+        if self.engine not in (self.capabilities or {}).get("engines", []):
+            if (self.capabilities or {}).get("algorithm") == self.engine:
+                return True  # 单引擎固件，已经是所需的引擎
+            print(f"MCU firmware has no {self.engine} engine")
+            return False
+        reply = self.send_and_wait(b'g' + bytes([ENGINE_IDS[self.engine]]), 'ENGINE', ENGINE_TIMEOUT)
+        if not reply or reply != f"ENGINE:{self.engine}":
+            print(f"Failed to select engine {self.engine}")
+            return False
+        return True
+
+    def _negotiate_options(self, extra=0):
+        """用 'o' 命令请求本次会话的协议选项；MCU不应答（旧固件）时使用基本协议。
+        已知MCU能力时只请求它支持的选项"""
+        self.session_options = 0
+        requested = (OPT_FRAME_CRC if self.frame_crc else 0) | (OPT_CREDITS if self.credit_flow else 0) | extra
+        if self.capabilities:
+            requested &= self.capabilities.get("options", 0)
+        if not requested or self.options_supported is False:
+            return
+        reply = self.send_and_wait(b'o' + struct.pack('>I', requested), 'OPTIONS', OPTIONS_TIMEOUT)
+        if reply and reply.startswith('OPTIONS:'):
+            self.options_supported = True
+            try:
+                self.session_options = int(reply.split(':')[1], 16) & requested
+            except ValueError:
+                pass
+        else:
+            # 记住结果，之后的会话不再等待
+            self.options_supported = False
+            print("MCU does not support protocol options, using basic streaming")
+        print(f"Session options: 0x{self.session_options:08X}")
+
+    def _load_key_slot(self, handle):
+        """确保密钥已装入MCU的密钥槽（每个端口只发送一次密钥）"""
+        if self.port in handle.loaded_ports:
+            return True
+        print(f"Loading key into slot {handle.slot}")
+        reply = self.send_and_wait(b'k' + bytes([handle.slot]) + handle.key, 'KEY_SLOT', KEY_SLOT_TIMEOUT)
+        if not reply or not reply.startswith('KEY_SLOT:'):
+            print("Failed to load key slot, sending key with the session")
+            return False
+        handle.loaded_ports.add(self.port)
+        return True
+
+    def _register_aad(self, aad):
+        """确保AAD已登记到MCU的某个AAD槽，返回槽号（失败返回None）"""
+        slot, cached = self.aad_cache.lookup(aad)
+        if cached:
+            print(f"AAD cached in slot {slot}")
+            return slot
+        print(f"Registering AAD ({len(aad)} bytes) in slot {slot}")
+        self.aad_cache.discard(slot)
+        request = b'a' + bytes([slot]) + struct.pack('>I', len(aad)) + aad
+        reply = self.send_and_wait(request, 'AAD_SLOT', KEY_SLOT_TIMEOUT + len(aad) * 20 / BaudRate)
+        if not reply or not reply.startswith('AAD_SLOT:'):
+            print("Failed to register AAD, sending AAD with the session")
+            self.aad_cache.release(slot)
+            return None
+        self.aad_cache.store(aad, slot)
+        return slot
+
+    def _start_stream_session(self, operation, key, nonce, aad, extra_options=0, required_options=0,
+                              sized=True):
+        """会话握手：READY -> 协议选项 -> 流模式 -> 操作/密钥/Nonce/AAD -> READY_FOR_DATA；
+        required_options 中的选项MCU不接受时在进入流模式之前失败；
+        sized 表示数据长度在数据阶段开始前已知（管道等长度未知的输入为False）"""
+        # 等待MCU准备；MCU可能还停在上一次被中断的会话中，发送break让它回到空闲状态
+        if not self.wait_for_message('READY', READY_PROBE_TIMEOUT):
+            print("MCU not ready, sending abort (UART break)")
+            send_uart_break(self.ser)
+            if not self.wait_for_message('READY', READY_TIMEOUT - READY_PROBE_TIMEOUT):
+                print("MCU not ready")
+                return False
+
+        if self.capabilities is None:
+            self.query_capabilities()
+        if self.link_timing is None and (self.capabilities or {}).get("options", 0) & OPT_PING:
+            self.calibrate_link()
+        if not self._select_engine():
+            return False
+
+        handle = key if isinstance(key, KeyHandle) else None
+        cache_aad = self.aad_cache is not None and AAD_CACHE_MIN <= len(aad) <= AAD_SLOT_SIZE
+        self._negotiate_options((OPT_KEY_SLOTS if handle else 0) | (OPT_AAD_CACHE if cache_aad else 0)
+                                | (OPT_DECLARED_LENGTH if self.declared_length and sized else 0)
+                                | extra_options | required_options)
+        if self.session_options & required_options != required_options:
+            print(f"MCU firmware does not support required options 0x{required_options:08X}")
+            return False
+        self.key_slots_used = False
+        if handle:
+            # 固件支持时使用密钥槽，否则回退为随会话发送密钥
+            self.key_slots_used = bool(self.session_options & OPT_KEY_SLOTS) and self._load_key_slot(handle)
+            key = handle.key
+        self.aad_slot_used = None
+        if cache_aad and self.session_options & OPT_AAD_CACHE:
+            self.aad_slot_used = self._register_aad(aad)
+
+        # 进入流模式
+        if not self.send_and_wait(b'n', 'NEW_STREAM_MODE'):
+            return False
+            
+        # 等待操作选择
+        if not self.wait_for_message('WAIT_OPERATION'):
+            return False
+            
+        if self.key_slots_used:
+            # 操作码大写（E/D）+ 槽号：使用板上已扩展的密钥，跳过密钥传输
+            if not self.send_and_wait(operation.upper() + bytes([handle.slot]), 'ACK'):
+                # 槽位为空（例如开发板已复位），下次会话重新装入
+                handle.loaded_ports.discard(self.port)
+                return False
+        else:
+            # 发送操作（e: 加密, d: 解密）
+            if not self.send_and_wait(operation, 'ACK'):
+                return False
+
+            # 等待密钥请求
+            if not self.wait_for_message('WAIT_KEY'):
+                return False
+
+            # 发送密钥
+            if not self.send_and_wait(key, 'ACK'):
+                return False
+            
+        # 等待Nonce请求  
+        if not self.wait_for_message('WAIT_NONCE'):
+            return False
+            
+        # 发送Nonce
+        if not self.send_and_wait(nonce, 'ACK'):
+            return False
+            
+        # 等待AAD长度请求
+        if not self.wait_for_message('WAIT_AAD_LEN'):
             return False
             
+        if self.aad_slot_used is not None:
+            # 引用已登记的AAD：长度字段最高位置1，低8位为槽号，不再发送AAD
+            if not self.send_and_wait(struct.pack('>I', AAD_REF_FLAG | self.aad_slot_used), 'ACK'):
+                # 槽位为空（例如开发板已复位），下次会话重新登记
+                self.aad_cache.clear()
+                return False
+        else:
+            # 发送AAD长度
+            aad_len_data = struct.pack('>I', len(aad))
+            if not self.send_and_wait(aad_len_data, 'ACK'):
+                return False
+
+        # 如果AAD长度大于0，发送AAD数据
+        if len(aad) > 0 and self.aad_slot_used is None:
+            if not self.wait_for_message('WAIT_AAD'):
+                return False
+            
+            if not self.send_and_wait(aad, 'ACK'):
+                return False
+        
+        # 不再发送文件大小，直接等待READY_FOR_DATA
+        if not self.wait_for_message('READY_FOR_DATA'):
+            return False
+            
+        print("✓ Entered streaming mode")
+        return True
+
+    def encrypt_file(self, input_file, output_file, follow=False):
+        """加密文件（支持自定义参数）；设置了 chunk_cache 时缓存命中的块不经过MCU。
+        文件名为 '-' 时使用标准输入/标准输出；follow 时跟随增长的输入文件，直到
+        stop_follow()，输出的每个密文块前带4字节长度（块大小不固定）"""
         try:
-            # 读取输入文件
-            with open(input_file, 'rb') as f:
-                file_data = f.read()
+            # 读取输入文件：缓存和清单需要整个文件的内容，否则在传输过程中由读线程预读
+            streamed = input_file == '-' or follow
+            if (self.chunk_cache is not None or self.write_manifest) and streamed:
+                print("Chunk cache and manifest need a regular input file, disabled for this run")
+            if (self.chunk_cache is not None or self.write_manifest) and not streamed:
+                with open(input_file, 'rb') as f:
+                    file_data = f.read()
+                file_size = len(file_data)
+            else:
+                file_data = None
+                file_size = None if streamed else os.path.getsize(input_file)
                 
-            print(f"File size: {len(file_data)} bytes")
+            print(f"File size: {file_size if file_size is not None else 'unknown (streaming input)'} bytes")
             
             # 初始化进度变量
-            self.total_size = len(file_data)
+            self.total_size = file_size or 0
             self.total_processed = 0
             self.current_chunk = 0
-            self.total_chunks = (len(file_data) + CHUNK_SIZE - 1) // CHUNK_SIZE
+            self.total_chunks = ((file_size or 0) + CHUNK_SIZE - 1) // CHUNK_SIZE
             
             # 使用用户自定义参数或默认值
             if self.custom_nonce is not None:
@@ -211,70 +1392,35 @@ class GCM_SIV_FileProcessor:
             aad = self.custom_aad if self.custom_aad is not None else b''
             
             print(f"Encryption parameters:")
-            print(f"  Key: {'custom' if self.custom_key else 'default'}")
+            print(f"  Key: {self.custom_key if isinstance(self.custom_key, KeyHandle) else 'custom' if self.custom_key else 'default'}")
             print(f"  Nonce: {'custom' if self.custom_nonce else 'random'}")
             print(f"  AAD length: {len(aad)} bytes")
-            
-            print(f"Starting encryption process (streaming mode)...")
-            
-            # 等待MCU准备
-            if not self.wait_for_message('READY', 15):
-                print("MCU not ready")
-                return False
-                
-            # 进入流模式
-            if not self.send_and_wait(b'n', 'NEW_STREAM_MODE'):
-                return False
-                
-            # 等待操作选择
-            if not self.wait_for_message('WAIT_OPERATION'):
-                return False
-                
-            # 发送加密操作
-            if not self.send_and_wait(b'e', 'ACK'):
-                return False
-                
-            # 等待密钥请求
-            if not self.wait_for_message('WAIT_KEY'):
-                return False
-                
-            # 发送密钥
-            if not self.send_and_wait(key, 'ACK'):
-                return False
-                
-            # 等待Nonce请求  
-            if not self.wait_for_message('WAIT_NONCE'):
-                return False
-                
-            # 发送Nonce
-            if not self.send_and_wait(nonce, 'ACK'):
-                return False
-                
-            # 等待AAD长度请求
-            if not self.wait_for_message('WAIT_AAD_LEN'):
-                return False
-                
-            # 发送AAD长度
-            aad_len_data = struct.pack('>I', len(aad))
-            if not self.send_and_wait(aad_len_data, 'ACK'):
+
+            cached = chunk_ids = None
+            if self.chunk_cache is not None and file_data is not None:
+                cached, chunk_ids = self._lookup_cached_chunks(file_data, key, nonce, aad)
+                if file_data and len(cached) == len(chunk_ids):
+                    # 所有块都命中缓存，不需要连接MCU
+                    print("All chunks found in ciphertext cache, MCU not needed")
+                    ok = self._encrypt_streaming(file_data, nonce, output_file, cached, chunk_ids)
+                    if ok and self.write_manifest:
+                        self._save_manifest(output_file, self._new_manifest(file_data, key, nonce, aad))
+                    return ok
+
+            if not self.connect():
                 return False
-                
-            # 如果AAD长度大于0，发送AAD数据
-            if len(aad) > 0:
-                if not self.wait_for_message('WAIT_AAD'):
-                    return False
-                
-                if not self.send_and_wait(aad, 'ACK'):
-                    return False
+
+            print(f"Starting encryption process (streaming mode)...")
             
-            # 不再发送文件大小，直接等待READY_FOR_DATA
-            if not self.wait_for_message('READY_FOR_DATA'):
+            if not self._start_stream_session(b'e', key, nonce, aad, OPT_CHUNK_INDEX if cached else 0,
+                                              sized=file_size is not None):
                 return False
-                
-            print("✓ Entered streaming mode")
             
             # 流式模式发送数据
-            return self._encrypt_streaming(file_data, nonce, output_file)
+            ok = self._encrypt_streaming(file_data, nonce, output_file, cached, chunk_ids, input_file, follow)
+            if ok and self.write_manifest and file_data is not None:
+                self._save_manifest(output_file, self._new_manifest(file_data, key, nonce, aad))
+            return ok
                 
         except Exception as e:
             print(f"Encryption error: {e}")
@@ -284,190 +1430,834 @@ class GCM_SIV_FileProcessor:
         finally:
             self.disconnect()
     
-    def _encrypt_streaming(self, file_data, nonce, output_file):
-        """流式模式加密 - 复用传统模式通信逻辑"""
-        total_sent = 0
-        chunk_count = 0
-        encrypted_data = b''
-        
+    def _run_stream(self, data, chunk_size, label, indices=None, on_output=None, tag_only=False,
+                    digests=None):
+        """流式数据阶段的协议协调器：写线程发送数据块，读线程接收MCU输出，
+        两者全双工并行；返回 (处理结果, 块数)，失败返回 None。
+        data 是字节串或数据来源（BufferSource/RoundTripSource）；给出 on_output 时
+        每块结果交给它处理 (序号, 结果)，不再保留在返回值中。
+        tag_only（操作 'v'）时MCU不返回数据，只用 VBITS 位图报告每块标签是否正确，
+        结果以 (序号, True/False) 交给 on_output。
+        digests 为 (输入, 输出) 两个 StreamDigest 时，发送的数据和收到的结果边传输边计算摘要。
+        发送的块数从不超过MCU给出的额度（WAIT_CHUNK，或OPT_CREDITS时的CREDIT:<n>）；
+        启用帧校验（OPT_FRAME_CRC）时，损坏的帧按序号单独重传；
+        indices 给出各块的块序号时（OPT_CHUNK_INDEX），每块前附加4字节块序号；
+        声明长度（OPT_DECLARED_LENGTH）时先发送总长度，块不带长度头，MCU收完最后一块
+        自行结束流。链路已校准时等待MCU的超时由期望的传输和计算时间推算，超时后先用
+        保活ping确认MCU是否还在（应答说明只是处理得慢，继续等待）；没有待处理的块时
+        也定期发送ping，MCU不会因主机长时间没有数据而结束会话"""
         # 关键：在开始前给MCU一些预热时间（与传统模式相同）
         print("Allowing MCU hardware warmup...")
         time.sleep(0.3)  # 300ms预热时间，与传统模式的自然延迟相当
-        
-        # 复用传统模式的通信循环
-        while total_sent < len(file_data):
-            chunk_count += 1
-            self.current_chunk = chunk_count
-            
-            # 等待MCU的WAIT_CHUNK消息（与传统模式完全相同）
-            chunk_line = None
-            start_time = time.time()
-            while time.time() - start_time < 30 and chunk_line is None:
-                if self.ser.in_waiting > 0:
-                    line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                    print(f"MCU: {line}")
-                    
-                    if line.startswith('WAIT_CHUNK'):
-                        chunk_line = line
-                    elif 'ERROR' in line:
-                        print(f"MCU error: {line}")
-                        return False
-                    elif 'STREAM_COMPLETE' in line:
-                        print("✓ Stream completed unexpectedly")
+
+        stream_start = time.time()
+        mcu_stats = mcu_summary = None
+        self.mcu_metrics = None
+        framed = bool(self.session_options & OPT_FRAME_CRC)
+        declared = bool(self.session_options & OPT_DECLARED_LENGTH)
+        source = BufferSource(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        total_size = source.total_size
+        total_sent = 0
+        chunks_sent = 0
+        chunks_done = 0
+        grants = 0            # 发送额度：已收到但尚未使用的WAIT_CHUNK/CREDIT
+        requested_size = chunk_size
+        next_missing = 0      # 最小的尚未正确收到输出的块序号
+        end_sent = False
+        complete = False
+        received = None
+        outputs = {}          # 块序号 -> 处理结果
+        unacked = {}          # 重传缓冲区：序号 -> 已发送但未确认(CHUNK_RECEIVED)的帧
+        nak_sent = {}         # 已请求MCU重传的输出帧序号 -> 请求时间
+        self.frames_resent = 0
+        self.frames_nak_requested = 0
+        timeout = STREAM_EVENT_TIMEOUT
+        last_progress = time.time()
+        timing = self.link_timing
+        pingable = timing is not None and bool((self.capabilities or {}).get("options", 0) & OPT_PING) \
+            and (framed or not declared)
+        ping_sent = None      # 尚未应答的保活ping的发送时间
+        pings = 0             # 连续未应答的ping数
+        last_event = time.time()
+        last_output = None    # 上一块输出的时间
+        sent_at = {}          # 块序号 -> 发送时间（估计每块的处理时间）
+
+        link = SerialLink(self.ser)
+        if hasattr(source, 'set_wakeup'):
+            source.set_wakeup(link.wake)
+        self._link = link
+
+        def send_frame(length, seq, payload=b''):
+            header = struct.pack('>II', length, seq)
+            frame = header + payload + struct.pack('>I', binascii.crc32(header + payload))
+            if length not in (NAK_MARKER, PING_MARKER):
+                unacked[seq] = frame
+            return link.send(frame)
+
+        def send_ping():
+            nonlocal ping_sent, pings
+            ping_sent = time.time()
+            pings += 1
+            print("Sending keep-alive ping")
+            if framed:
+                return send_frame(PING_MARKER, chunks_sent)
+            return link.send(struct.pack('>I', PING_MARKER))
+
+        def store_output(seq, out):
+            # 保存一块结果（None表示MCU确认处理了该块但没有收到数据）；
+            # 给出 on_output 时交给它处理，只保留占位以便判断是否已收到
+            nonlocal last_output
+            if timing is not None and seq in sent_at:
+                # 处理时间：从块发出（或上一块输出，MCU在此之前还在处理上一块）到这块输出
+                now = time.time()
+                timing.observe(now - max(sent_at.pop(seq), last_output or 0))
+                last_output = now
+            if out is not None:
+                self.total_processed += len(out)
+            if digests is not None:
+                digests[1].update(seq, out or b'')
+            if on_output is not None:
+                outputs[seq] = b''
+                on_output(seq, out)
+            elif out is not None:
+                outputs[seq] = out
+
+        def request_output(seq):
+            # 请求MCU重传损坏/缺失的输出帧
+            nak_sent[seq] = time.time()
+            self.frames_nak_requested += 1
+            print(f"Requesting retransmission of output frame {seq}")
+            return send_frame(NAK_MARKER, seq)
+
+        def pump():
+            # 用掉已收到的WAIT_CHUNK；帧校验模式下不让MCU超前于最早缺失的输出帧
+            # RETX_WINDOW 个块，否则该帧会被挤出MCU的重传缓冲区
+            nonlocal grants, total_sent, chunks_sent, end_sent
+            while grants > 0 and not end_sent:
+                if framed and not tag_only and chunks_sent - next_missing >= RETX_WINDOW:
+                    return True
+                chunk = source.read_chunk(requested_size)
+                if chunk is not None:
+                    print(f"Sending chunk {chunks_sent + 1}: {len(chunk)} bytes")
+                    if digests is not None:
+                        digests[0].update(chunks_sent, chunk)
+                    if timing is not None:
+                        sent_at[chunks_sent] = time.time()
+                    payload = chunk if indices is None else struct.pack('>I', indices[chunks_sent]) + chunk
+                    if framed:
+                        ok = send_frame(len(payload), chunks_sent, payload)
+                    elif declared:
+                        # 块大小由声明的总长度决定，不需要块头
+                        ok = link.send(payload)
+                    else:
+                        # 块头（4字节长度，大端序）与数据一起放入发送队列
+                        ok = link.send(struct.pack('>I', len(payload)) + payload)
+                    total_sent += len(chunk)
+                    chunks_sent += 1
+                    if declared and not framed and source.exhausted:
+                        end_sent = True  # MCU收完声明的长度后自行结束流
+                elif not source.exhausted:
+                    return True  # 等待数据来源提供更多数据
+                elif getattr(source, 'error', None) is not None:
+                    print(f"Input read error: {source.error}")
+                    return False
+                else:
+                    # 所有数据发送完毕；帧校验模式下要等所有输出帧都正确收到
+                    if framed and not tag_only and next_missing < chunks_sent:
                         return True
-                time.sleep(0.01)
-            
-            if chunk_line is None:
-                print("No chunk request received")
+                    if declared and not framed:
+                        # MCU收完声明的长度后自行结束流
+                        end_sent = True
+                        return True
+                    print("Sending end-of-stream marker (0-length chunk)")
+                    if framed:
+                        ok = send_frame(0, chunks_sent)
+                    else:
+                        ok = link.send(struct.pack('>I', 0))
+                    end_sent = True
+                if not ok:
+                    return False
+                grants -= 1
+            return True
+
+        link.start()
+        if declared:
+            # 数据阶段开始时声明总长度（不含块序号），MCU据此算出块划分
+            print(f"Declaring stream length: {total_size} bytes")
+            if not link.send(struct.pack('>I', total_size)):
+                link.stop()
+                return None
+        try:
+            while True:
+                if self._cancel.is_set():
+                    self._abort_link(link)
+                    return None
+                if nak_sent:
+                    # 重传请求或重传的数据也可能损坏，超时后重新请求
+                    now = time.time()
+                    for seq, requested_at in list(nak_sent.items()):
+                        if now - requested_at >= NAK_RETRY_INTERVAL and not request_output(seq):
+                            return None
+                    if now - last_progress >= timeout:
+                        print(f"Timeout waiting for retransmission of output frame {min(nak_sent)}")
+                        return None
+                if timing is None:
+                    wait = timeout
+                elif ping_sent is not None:
+                    wait = max(ping_sent + timing.deadline(12, 8) - time.time(), 0)
+                elif complete:
+                    wait = timing.deadline(0, 128)
+                elif chunks_sent > chunks_done or end_sent:
+                    wait = timing.chunk_deadline(requested_size) * (1 if pingable else UNPINGED_MARGIN)
+                else:
+                    wait = KEEPALIVE_INTERVAL if pingable else timeout
+                event = link.get(NAK_RETRY_INTERVAL if nak_sent else wait)
+                if event is None:
+                    if complete:
+                        break
+                    if nak_sent:
+                        continue
+                    if timing is not None and not end_sent and time.time() - last_event < STREAM_EVENT_TIMEOUT:
+                        # 超过期望时间没有输出，或长时间没有数据要发送：用保活ping确认MCU还在
+                        # （ping本身也可能损坏，重试一次）。声明长度且没有帧校验时块不带块头，
+                        # 不能插入ping，超时已放宽 UNPINGED_MARGIN 倍
+                        if not pingable:
+                            if chunks_sent == chunks_done:
+                                continue
+                            print(f"MCU not responding ({wait:.1f} s without output)")
+                        elif pings < 2:
+                            if not send_ping():
+                                return None
+                            continue
+                        else:
+                            print(f"MCU not responding to keep-alive ping "
+                                  f"({(time.time() - ping_sent) * 1000:.0f} ms)")
+                    if received is not None:
+                        # 即使没有收到CHUNK_PROCESSED，如果收到了数据就保留
+                        print(f"⚠ Chunk {chunks_done + 1} completed without confirmation (data received)")
+                        store_output(chunks_done, received)
+                        chunks_done += 1
+                        received = None
+                    if end_sent and chunks_done == chunks_sent:
+                        print("Warning: Stream completion not received, but assuming completion...")
+                        break
+                    print(f"Timeout waiting for MCU (chunk {chunks_done + 1})")
+                    self.link_timing = None  # 下次会话重新校准
+                    return None
+
+                kind, payload = event
+                if kind != 'WAKE':
+                    last_event = time.time()
+                if kind == 'B64':
+                    if payload:
+                        received = payload
+                        print(f"✓ Received {label} chunk {chunks_done + 1}: {len(payload)} bytes")
+                    else:
+                        print(f"Base64 decode failed for chunk {chunks_done + 1}")
+                    continue
+                if kind == 'B64F':
+                    seq, frame_data = payload
+                    if seq is None:
+                        print("Discarding corrupted output frame")
+                    elif frame_data is None:
+                        # CRC错误时序号本身也可能损坏：只请求MCU已确认处理（CHUNK_PROCESSED）
+                        # 但尚未正确收到的帧，否则丢弃该行，由CHUNK_PROCESSED的缺帧检测
+                        # 请求真正缺失的帧（请求MCU没有输出过的帧会让会话中止）
+                        print(f"CRC error in output frame {seq}")
+                        if next_missing <= seq < chunks_done and seq not in outputs and seq not in nak_sent:
+                            if not request_output(seq):
+                                return None
+                    elif seq not in outputs:
+                        store_output(seq, frame_data)
+                        nak_sent.pop(seq, None)
+                        last_progress = time.time()
+                        print(f"✓ Received {label} chunk {seq + 1}: {len(frame_data)} bytes")
+                        while next_missing in outputs:
+                            next_missing += 1
+                        if not pump():
+                            return None
+                    continue
+                if kind == 'ERROR':
+                    print(f"Serial link error: {payload}")
+                    return None
+                if kind == 'WAKE':
+                    # 预读的数据到达
+                    if not pump():
+                        return None
+                    continue
+
+                line = payload
+                print(f"MCU: {line}")
+
+                if line == 'PONG':
+                    ping_sent = None
+                    pings = 0
+
+                elif line.startswith('WAIT_CHUNK'):
+                    # 每个WAIT_CHUNK表示MCU有一个空闲接收缓冲区
+                    try:
+                        requested_size = int(line.split(':')[1])
+                    except (IndexError, ValueError):
+                        requested_size = chunk_size
+                    grants += 1
+                    if not pump():
+                        return None
+
+                elif line.startswith('CREDIT:'):
+                    # MCU通告空闲的接收缓冲区数量，主机发送的块数不超过额度
+                    try:
+                        grants += int(line.split(':')[1])
+                    except ValueError:
+                        continue
+                    if not pump():
+                        return None
+
+                elif line.startswith('CHUNK_RECEIVED:'):
+                    try:
+                        unacked.pop(int(line.split(':')[1]), None)
+                    except ValueError:
+                        pass
+
+                elif line.startswith('NAK:'):
+                    # MCU收到损坏的帧并清空了接收缓冲区：从该序号起重发所有未确认的帧
+                    try:
+                        first = int(line.split(':')[1])
+                    except ValueError:
+                        continue
+                    for seq in sorted(s for s in unacked if s >= first):
+                        self.frames_resent += 1
+                        print(f"Retransmitting frame {seq}")
+                        if not link.send(unacked[seq]):
+                            return None
+
+                elif 'CHUNK_PROCESSED' in line:
+                    if framed:
+                        try:
+                            seq = int(line.split(':')[1])
+                        except (IndexError, ValueError):
+                            continue
+                        if seq >= chunks_sent:
+                            print(f"Ignoring confirmation of unsent frame {seq}")
+                            continue
+                        if seq not in outputs and seq not in nak_sent:
+                            # B64F行损坏到无法识别
+                            if not request_output(seq):
+                                return None
+                        chunks_done = max(chunks_done, seq + 1)
+                        self.current_chunk = chunks_done
+                    else:
+                        if received is not None:
+                            print(f"✓ Chunk {chunks_done + 1} processed successfully")
+                        else:
+                            print(f"Warning: Chunk {chunks_done + 1} processed but no data received")
+                        store_output(chunks_done, received)
+                        received = None
+                        chunks_done += 1
+                        self.current_chunk = chunks_done
+                        # 结果可能让数据来源有了新的块（往返校验发回的密文）
+                        if on_output is not None and not pump():
+                            return None
+                    if total_size is not None:
+                        print(f"Stream progress: {total_sent}/{total_size} bytes")
+                    else:
+                        print(f"Stream progress: {total_sent} bytes")
+
+                elif line.startswith('VBITS:'):
+                    # 标签校验位图：VBITS:<首块>:<块数>:<十六进制>，第i位对应第 首块+i 块
+                    try:
+                        first, count, bits = line.split(':')[1:4]
+                        first, count, bits = int(first), int(count), int(bits, 16)
+                    except ValueError:
+                        print(f"Malformed verification bitmap: {line}")
+                        return None
+                    for i in range(count):
+                        on_output(first + i, bool(bits >> i & 1))
+                    chunks_done = max(chunks_done, first + count)
+                    self.current_chunk = chunks_done
+                    last_progress = time.time()
+
+                elif line.startswith('VERIFY_RESULT:'):
+                    print(f"MCU verification result: {line.split(':', 1)[1].strip()}")
+
+                elif line.startswith('SCHEDULE:'):
+                    print(f"MCU chunk schedule: {line.split(':')[1]} chunks")
+
+                elif 'STREAM_STATS' in line:
+                    print(f"MCU Stream Stats: {line}")
+                    if ':' in line:
+                        mcu_stats = parse_metrics(line)
+
+                elif 'ERROR' in line:
+                    print(f"MCU error: {line}")
+                    return None
+
+                elif 'STREAM_COMPLETE' in line:
+                    if not end_sent:
+                        print("✓ Stream completed unexpectedly")
+                    complete = True
+                    # 只再等待总结信息
+                    timeout = SUMMARY_TIMEOUT
+
+                elif line.startswith('SUMMARY:'):
+                    print(f"MCU Summary: {line}")
+                    mcu_summary = parse_metrics(line)
+                    if complete:
+                        break
+        except KeyboardInterrupt:
+            # Ctrl-C：让MCU回到空闲状态，下次运行不必等待超时或复位开发板
+            self._abort_link(link)
+            raise
+        finally:
+            self._link = None
+            link.stop()
+
+        if framed and self.frames_resent + self.frames_nak_requested:
+            print(f"Retransmissions: {self.frames_resent} frames resent, "
+                  f"{self.frames_nak_requested} output frames requested")
+        if mcu_stats or mcu_summary:
+            self.mcu_metrics = stream_metrics(mcu_stats, mcu_summary, time.time() - stream_start)
+            print(f"MCU metrics: {format_metrics(self.mcu_metrics)}")
+        return b''.join(outputs[i] for i in sorted(outputs)), chunks_done
+
+    def _abort_link(self, link):
+        """中止数据阶段：丢弃尚未发送的数据，发送UART break，等待MCU报告已处理的块数"""
+        print("Aborting stream (UART break)...")
+        self.abort_report = None
+        if not link.abort():
+            return False
+        deadline = time.time() + ABORT_TIMEOUT
+        while True:
+            remaining = deadline - time.time()
+            event = link.get(remaining) if remaining > 0 else None
+            if event is None:
+                print("MCU did not acknowledge the abort")
                 return False
-            
-            # 解析请求的块大小
-            try:
-                requested_size = int(chunk_line.split(':')[1])
-            except:
-                requested_size = CHUNK_SIZE
-            
-            # 计算要发送的实际块大小
-            remaining = len(file_data) - total_sent
-            current_chunk_size = min(requested_size, remaining)
-            
-            # 发送块头（4字节长度信息）
-            chunk_header = struct.pack('>I', current_chunk_size)
-            print(f"Sending chunk header: {current_chunk_size} bytes")
-            self.ser.write(chunk_header)
-            self.ser.flush()
-            
-            # 发送数据块
-            chunk = file_data[total_sent:total_sent + current_chunk_size]
-            print(f"Sending chunk {chunk_count}: {len(chunk)} bytes")
-            self.ser.write(chunk)
-            self.ser.flush()
-            total_sent += len(chunk)
-            
-            # 等待块接收确认（与传统模式相同）
-            if not self.wait_for_message('CHUNK_RECEIVED', 30):
-                print("Chunk not acknowledged")
+            kind, payload = event
+            if kind == 'ERROR':
+                print(f"Serial link error: {payload}")
                 return False
-            
-            # 处理响应（与传统模式相同）
-            chunk_success = False
+            if kind == 'LINE' and payload.startswith('ABORTED'):
+                try:
+                    self.abort_report = int(payload.split('chunks=')[1].split()[0])
+                except (IndexError, ValueError):
+                    pass
+                print(f"✓ MCU aborted the stream after {self.abort_report} chunks")
+                return True
+
+    def verify_roundtrip(self, input_file):
+        """往返校验：在同一会话中MCU加密每块后，密文立即发回解密，结果与原明文块在
+        内存中比较；只握手一次，不写临时文件。返回校验结果字典，失败返回None"""
+        try:
+            with open(input_file, 'rb') as f:
+                file_data = f.read()
+
+            print(f"File size: {len(file_data)} bytes")
+
+            self.total_size = 2 * len(file_data)  # 每块加密一次、解密一次
+            self.total_processed = 0
+            self.current_chunk = 0
+            self.total_chunks = 2 * ((len(file_data) + CHUNK_SIZE - 1) // CHUNK_SIZE)
+
+            nonce = self.custom_nonce if self.custom_nonce is not None else secrets.token_bytes(16)
+            key = self.custom_key if self.custom_key is not None else bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
+            aad = self.custom_aad if self.custom_aad is not None else b''
+
+            if not self.connect():
+                return None
+
+            print(f"Starting round-trip verification (streaming mode)...")
+
+            start_time = time.time()
+            if not self._start_stream_session(b'r', key, nonce, aad, required_options=OPT_ROUND_TRIP,
+                                              sized=False):
+                return None
+            source = RoundTripSource(file_data)
+            if self._run_stream(source, CHUNK_SIZE, "round-trip", on_output=source.on_output) is None:
+                return None
+            elapsed = time.time() - start_time
+
+            report = {
+                "chunks": len(source.chunks),
+                "verified": source.verified,
+                "mismatched_chunks": source.mismatches,
+                "success": source.verified == len(source.chunks) and not source.mismatches,
+                "seconds": elapsed,
+                "mcu": self.mcu_metrics,
+            }
+            if report["success"]:
+                print(f"✓ Round-trip verified: {report['verified']} chunks in {elapsed:.3f}s")
+            else:
+                print(f"✗ Round-trip verification failed: {report['verified']}/{report['chunks']} chunks verified, "
+                      f"mismatched chunks: {source.mismatches[:10]}")
+            return report
+
+        except Exception as e:
+            print(f"Round-trip error: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+        finally:
+            self.disconnect()
+
+    def verify_tags(self, input_file):
+        """只校验加密文件的标签：MCU解密并检查每块标签，不返回明文，回传只有每块约
+        十几字节的额度和位图。返回校验结果字典，会话失败返回None"""
+        if not self.connect():
+            return None
+
+        try:
+            with open(input_file, 'rb') as f:
+                encrypted_file_data = f.read()
+
+            if len(encrypted_file_data) < 16:
+                print("Error: Encrypted file too short")
+                return None
+
+            file_nonce = encrypted_file_data[:16]
+            encrypted_data = encrypted_file_data[16:]
+            nonce = self.custom_nonce if self.custom_nonce is not None else file_nonce
+            key = self.custom_key if self.custom_key is not None else bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
+            aad = self.custom_aad if self.custom_aad is not None else b''
+
+            print(f"Encrypted file: {len(encrypted_data)} bytes encrypted data")
+
+            self.total_size = len(encrypted_data)
+            self.total_processed = 0
+            self.current_chunk = 0
+            self.total_chunks = (len(encrypted_data) + CHUNK_SIZE + 15) // (CHUNK_SIZE + 16)
+
+            # 增量更新过的文件需要按清单逐块指定块序号
+            indices = None
+            manifest = self._load_manifest(input_file)
+            if manifest and manifest["nonce"] == file_nonce.hex() and \
+                    manifest["indices"] != list(range(len(manifest["indices"]))):
+                indices = manifest["indices"]
+                print(f"Using chunk indices from manifest (generation {manifest['generation']})")
+
+            print(f"Starting tag verification (streaming mode)...")
+
             start_time = time.time()
-            received_b64_data = None
-            
-            while time.time() - start_time < 60 and not chunk_success:
-                if self.ser.in_waiting > 0:
-                    line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                    print(f"MCU: {line}")
-                    
-                    if line.startswith('B64:'):
-                        b64_data = line[4:]
-                        if len(b64_data) > 10:
-                            decoded = self.safe_base64_decode(b64_data)
-                            if decoded:
-                                received_b64_data = decoded
-                                encrypted_data += decoded
-                                self.total_processed += len(decoded)
-                                print(f"✓ Received encrypted chunk {chunk_count}: {len(decoded)} bytes")
-                            else:
-                                print(f"Base64 decode failed for chunk {chunk_count}")
-                    
-                    elif 'CHUNK_PROCESSED' in line:
-                        if received_b64_data is not None:
-                            print(f"✓ Chunk {chunk_count} processed successfully")
-                            chunk_success = True
-                        else:
-                            print(f"Warning: Chunk {chunk_count} processed but no data received")
-                            chunk_success = True
-                    
-                    elif 'STREAM_STATS' in line:
-                        print(f"MCU Stream Stats: {line}")
-                        # 不打断处理流程，继续等待CHUNK_PROCESSED
-                    
-                    elif 'ERROR' in line:
-                        print(f"MCU error: {line}")
-                        return False
-                    
-                    elif 'STREAM_COMPLETE' in line:
-                        print("✓ Stream completed during chunk processing")
-                        return True
-                else:
-                    time.sleep(0.01)
-            
-            if not chunk_success:
-                print(f"Chunk {chunk_count} processing timeout")
-                # 即使超时也继续尝试，只要收到了数据
-                if received_b64_data is not None:
-                    print(f"Continuing despite timeout (data received)")
-                    chunk_success = True
-                else:
-                    return False
-            
-            print(f"Stream progress: {total_sent}/{len(file_data)} bytes")
-        
-        # 所有数据发送完毕，发送结束标记
-        print("Sending end-of-stream marker (0-length chunk)")
-        end_header = struct.pack('>I', 0)
+            if not self._start_stream_session(b'v', key, nonce, aad,
+                                              required_options=OPT_TAG_VERIFY | (OPT_CHUNK_INDEX if indices else 0)):
+                return None
+            results = {}
+            if self._run_stream(encrypted_data, CHUNK_SIZE + 16, "verified", indices,
+                                on_output=results.__setitem__, tag_only=True) is None:
+                return None
+            elapsed = time.time() - start_time
 
-        # 确保串口缓冲区清空
-        time.sleep(0.1)  # 100ms延迟
+            failed = sorted(i for i, ok in results.items() if not ok)
+            missing = self.total_chunks - len(results)
+            report = {
+                "chunks": self.total_chunks,
+                "passed": len(results) - len(failed),
+                "failed_chunks": failed,
+                "success": not failed and missing == 0,
+                "seconds": elapsed,
+                "mcu": self.mcu_metrics,
+            }
+            if report["success"]:
+                print(f"✓ All {report['chunks']} chunk tags verified in {elapsed:.3f}s")
+            else:
+                print(f"✗ Tag verification failed: {len(failed)} bad chunks {failed[:10]}"
+                      + (f", {missing} chunks not reported" if missing else ""))
+            return report
 
-        self.ser.write(end_header)
-        self.ser.flush()
+        except Exception as e:
+            print(f"Verification error: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+        finally:
+            self.disconnect()
 
-        # 关键：等待MCU处理结束标记
-        print("Waiting for MCU to process end-of-stream marker...")
-        time.sleep(0.5)  # 500ms延迟
+    def encrypt_records(self, records, nonce=None):
+        """记录模式加密：records 是可迭代的短消息（每条不超过 MAX_RECORD_SIZE 字节），
+        在一个会话中成批发送，返回按输入顺序产出 密文+16字节标签 的 RecordStream；
+        每条记录使用由会话Nonce（返回对象的 nonce）和记录序号派生的Nonce"""
+        if nonce is None:
+            nonce = self.custom_nonce if self.custom_nonce is not None else secrets.token_bytes(16)
+        return RecordStream(self, b'e', records, nonce)
 
-        # 等待流结束确认
-        end_msg = self.wait_for_message('END_OF_STREAM', 10)  # 缩短超时时间
-        if not end_msg:
-            print("Warning: Did not receive END_OF_STREAM confirmation, but continuing...")
+    def decrypt_records(self, records, nonce):
+        """记录模式解密：records 是 encrypt_records 按顺序产出的密文记录，nonce 是其会话Nonce；
+        返回按顺序产出明文（标签错误的记录为None）的 RecordStream"""
+        return RecordStream(self, b'd', records, nonce)
 
-        # 等待流完成
-        stream_msg = self.wait_for_message('STREAM_COMPLETE', 10)
-        if not stream_msg:
-            print("Warning: Stream completion not received, but assuming completion...")
+    def _lookup_cached_chunks(self, file_data, key, nonce, aad):
+        """在密文块缓存中查找每个明文块，返回 (命中的块 {序号: 密文块}, 各块的缓存键)"""
+        key_id = ChunkCache.key_id(key.key if isinstance(key, KeyHandle) else key)
+        aad_hash = hashlib.sha256(aad).digest()
+        chunk_ids = []
+        cached = {}
+        for index, pos in enumerate(range(0, len(file_data), CHUNK_SIZE)):
+            chunk_id = ChunkCache.chunk_id(key_id, nonce, index, aad_hash, file_data[pos:pos + CHUNK_SIZE])
+            chunk_ids.append(chunk_id)
+            ciphertext = self.chunk_cache.get(chunk_id)
+            if ciphertext is not None:
+                cached[index] = ciphertext
+        print(f"Ciphertext cache: {len(cached)}/{len(chunk_ids)} chunks cached")
+        return cached, chunk_ids
 
-        # 等待总结信息
-        summary_msg = self.wait_for_message('SUMMARY:', 5)
-        if summary_msg:
-            print(f"MCU Summary: {summary_msg}")
-        
-        # 保存加密结果
-        if encrypted_data:
+    def _report_cache(self, hits, total):
+        """统计缓存命中率和节省的链路时间（按Base64回传方向估算，它是瓶颈）"""
+        baudrate = self.ser.baudrate if self.ser else BaudRate
+        line_bytes = 4 * ((CHUNK_SIZE + 16 + 2) // 3) + 40  # B64行 + CHUNK_RECEIVED/CHUNK_PROCESSED
+        saved = hits * line_bytes * 10 / baudrate
+        self.cache_report = {
+            "hits": hits,
+            "misses": total - hits,
+            "hit_ratio": hits / total if total else 0.0,
+            "saved_link_seconds": saved,
+        }
+        print(f"Ciphertext cache: {hits}/{total} hits ({self.cache_report['hit_ratio']:.1%}), "
+              f"saved ~{saved:.2f}s of link time")
+
+    def _encrypt_streaming(self, file_data, nonce, output_file, cached=None, chunk_ids=None, input_file=None,
+                           follow=False):
+        """流式模式加密（cached 为缓存命中的密文块，只有未命中的块发给MCU）；
+        file_data 为None时从 input_file 预读，结果由写线程写入 output_file"""
+        if chunk_ids is None:
+            # 加密文件的摘要包含文件头的nonce，与对整个输出文件计算的SHA-256相同
+            # （跟随模式的块长度前缀不计入摘要）
+            digests = (StreamDigest(), StreamDigest(nonce))
+            if file_data is None:
+                source = self.follow_source = ReadAheadSource(input_file, follow=follow,
+                                                              latency=self.follow_latency)
+            else:
+                source = BufferSource(file_data)
+            # 跟随模式每块都立即写出，保证端到端延迟
+            sink = WriteBehindSink(output_file, header=nonce, prefixed=follow,
+                                   batch_size=1 if follow else WRITE_BATCH_SIZE)
+            result = None
+            try:
+                result = self._run_stream(source, CHUNK_SIZE, "encrypted", on_output=sink.write, digests=digests)
+            finally:
+                if isinstance(source, ReadAheadSource):
+                    source.close()
+                self.follow_source = None
+                saved = sink.close(keep=result is not None and sink.bytes_written > 0)
+            if result is None:
+                return False
+            if not saved:
+                print("✗ Streaming encryption failed: no encrypted data received")
+                return False
+            chunk_count = result[1]
+            self.digests = {
+                "plaintext_in": digests[0].hexdigest(),
+                "ciphertext_out": digests[1].hexdigest(),
+            }
+            plain_size, encrypted_size = digests[0].length, sink.bytes_written
+        else:
+            if cached and len(cached) < len(chunk_ids) and not self.session_options & OPT_CHUNK_INDEX:
+                print("MCU cannot skip chunks, streaming all chunks")
+                cached = {}
+            chunks = [file_data[pos:pos + CHUNK_SIZE] for pos in range(0, len(file_data), CHUNK_SIZE)]
+            misses = [i for i in range(len(chunks)) if i not in cached]
+            pieces = {}
+            chunk_count = 0
+            if misses:
+                result = self._run_stream(b''.join(chunks[i] for i in misses), CHUNK_SIZE, "encrypted",
+                                          misses if cached else None)
+                if result is None:
+                    return False
+                streamed, chunk_count = result
+                pos = 0
+                for i in misses:
+                    pieces[i] = streamed[pos:pos + len(chunks[i]) + 16]
+                    pos += len(chunks[i]) + 16
+                if pos != len(streamed):
+                    print("✗ Streaming encryption failed: unexpected encrypted data length")
+                    return False
+                for i in misses:
+                    self.chunk_cache.put(chunk_ids[i], pieces[i])
+            self.chunk_cache.flush()
+            plain_digest, cipher_digest = StreamDigest(), StreamDigest(nonce)
+            for i, chunk in enumerate(chunks):
+                plain_digest.update(i, chunk)
+                cipher_digest.update(i, cached[i] if i in cached else pieces[i])
+            encrypted_data = b''.join(cached[i] if i in cached else pieces[i] for i in range(len(chunks)))
+            self.digests = {
+                "plaintext_in": plain_digest.hexdigest(),
+                "ciphertext_out": cipher_digest.hexdigest(),
+            }
+            self._report_cache(len(cached), len(chunks))
+            if not encrypted_data:
+                print("✗ Streaming encryption failed: no encrypted data received")
+                return False
+
+            # 保存加密结果
             with open(output_file, 'wb') as f:
                 f.write(nonce)
                 f.write(encrypted_data)
-                
-            print(f"✓ Streaming encryption successful: {output_file}")
-            print(f"  Nonce: {nonce.hex()}")
-            print(f"  Total encrypted data: {len(encrypted_data)} bytes")
-            print(f"  Original file size: {len(file_data)} bytes")
-            print(f"  Chunks processed: {chunk_count}")
+            plain_size, encrypted_size = len(file_data), len(encrypted_data)
+
+        print(f"✓ Streaming encryption successful: {output_file}")
+        print(f"  Nonce: {nonce.hex()}")
+        print(f"  Total encrypted data: {encrypted_size} bytes")
+        print(f"  Original file size: {plain_size} bytes")
+        print(f"  Chunks processed: {chunk_count}")
+        print(f"  SHA-256 plaintext: {self.digests['plaintext_in']}")
+        print(f"  SHA-256 ciphertext: {self.digests['ciphertext_out']}")
+        return True
+
+    @staticmethod
+    def _chunk_digests(key, file_data):
+        """各明文块的带密钥哈希（清单中不保存可被字典攻击的明文哈希）"""
+        mac_key = hashlib.sha256(b'manifest-key' + key).digest()
+        return [hmac.new(mac_key, file_data[pos:pos + CHUNK_SIZE], hashlib.sha256).hexdigest()[:32]
+                for pos in range(0, len(file_data), CHUNK_SIZE)]
+
+    def _new_manifest(self, file_data, key, nonce, aad):
+        key = key.key if isinstance(key, KeyHandle) else key
+        digests = self._chunk_digests(key, file_data)
+        return {
+            "version": 1,
+            "chunk_size": CHUNK_SIZE,
+            "key_id": ChunkCache.key_id(key).hex(),
+            "aad_sha256": hashlib.sha256(aad).hexdigest(),
+            "nonce": nonce.hex(),
+            "file_size": len(file_data),
+            "generation": 0,
+            "chunks": digests,
+            "indices": list(range(len(digests))),
+        }
+
+    @staticmethod
+    def _load_manifest(container_file):
+        try:
+            with open(container_file + MANIFEST_SUFFIX, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != 1 or manifest.get("chunk_size") != CHUNK_SIZE:
+            print("Ignoring incompatible manifest")
+            return None
+        return manifest
+
+    @staticmethod
+    def _save_manifest(container_file, manifest):
+        # 先写临时文件再替换，避免留下不完整的清单
+        temp_file = container_file + MANIFEST_SUFFIX + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temp_file, container_file + MANIFEST_SUFFIX)
+        print(f"Manifest saved: {container_file + MANIFEST_SUFFIX}")
+
+    def update_file(self, input_file, container_file):
+        """增量更新：与上次加密时的清单比较，只把变化的块（使用新的块Nonce）发给MCU，
+        并在原加密文件中就地替换，代价与修改量成正比"""
+        manifest = self._load_manifest(container_file)
+        if manifest is None:
+            print(f"Error: manifest not found: {container_file}{MANIFEST_SUFFIX}")
+            return False
+
+        try:
+            with open(input_file, 'rb') as f:
+                file_data = f.read()
+
+            key = self.custom_key if self.custom_key is not None else bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
+            aad = self.custom_aad if self.custom_aad is not None else b''
+            key_bytes = key.key if isinstance(key, KeyHandle) else key
+            if manifest["key_id"] != ChunkCache.key_id(key_bytes).hex() or \
+                    manifest["aad_sha256"] != hashlib.sha256(aad).hexdigest():
+                print("Error: key or AAD differs from the manifest, re-encrypt the whole file")
+                return False
+            nonce = bytes.fromhex(manifest["nonce"])
+
+            digests = self._chunk_digests(key_bytes, file_data)
+            old_digests = manifest["chunks"]
+            changed = [i for i, digest in enumerate(digests) if i >= len(old_digests) or old_digests[i] != digest]
+            print(f"Changed chunks: {len(changed)}/{len(digests)} "
+                  f"(file size {manifest['file_size']} -> {len(file_data)} bytes)")
+            if len(digests) > (1 << CHUNK_INDEX_BITS):
+                print("Error: file too large for incremental update")
+                return False
+
+            indices = manifest["indices"][:len(digests)]
+            indices += range(len(indices), len(digests))
+            generation = manifest["generation"]
+            pieces = {}
+            if changed:
+                generation += 1
+                if generation > MAX_GENERATION:
+                    print("Error: too many incremental updates, re-encrypt the whole file")
+                    return False
+                # 变化的块使用新的代数，块Nonce与之前所有版本都不同
+                for i in changed:
+                    indices[i] = (generation << CHUNK_INDEX_BITS) | i
+                chunks = {i: file_data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE] for i in changed}
+
+                if not self.connect():
+                    return False
+                self.total_size = sum(len(chunk) for chunk in chunks.values())
+                self.total_processed = 0
+                self.current_chunk = 0
+                self.total_chunks = len(changed)
+                if not self._start_stream_session(b'e', key, nonce, aad, required_options=OPT_CHUNK_INDEX):
+                    return False
+                result = self._run_stream(b''.join(chunks[i] for i in changed), CHUNK_SIZE, "encrypted",
+                                          [indices[i] for i in changed])
+                if result is None:
+                    return False
+                streamed, _ = result
+                pos = 0
+                for i in changed:
+                    pieces[i] = streamed[pos:pos + len(chunks[i]) + 16]
+                    pos += len(chunks[i]) + 16
+                if pos != len(streamed):
+                    print("✗ Update failed: unexpected encrypted data length")
+                    return False
+
+            # 就地替换变化的块，并按新的文件大小截断/扩展
+            with open(container_file, 'r+b') as f:
+                for i, piece in pieces.items():
+                    f.seek(16 + i * (CHUNK_SIZE + 16))
+                    f.write(piece)
+                f.truncate(16 + len(file_data) + 16 * len(digests))
+                f.flush()
+                os.fsync(f.fileno())
+
+            manifest.update(file_size=len(file_data), generation=generation, chunks=digests, indices=indices)
+            self._save_manifest(container_file, manifest)
+            print(f"✓ Incremental update successful: {container_file}")
+            print(f"  Chunks re-encrypted: {len(changed)}/{len(digests)}")
             return True
-        else:
-            print("✗ Streaming encryption failed: no encrypted data received")
+
+        except Exception as e:
+            print(f"Update error: {e}")
+            import traceback
+            traceback.print_exc()
             return False
+        finally:
+            self.disconnect()
 
-    def decrypt_file(self, input_file, output_file):
-        """解密文件（支持自定义参数）"""
+    def decrypt_file(self, input_file, output_file, follow=False, prefixed=None):
+        """解密文件（支持自定义参数）。文件名为 '-' 时使用标准输入/标准输出；
+        prefixed 表示输入是跟随模式写出的（每个密文块前带4字节长度），默认与 follow 相同；
+        follow 时跟随增长的输入文件，直到 stop_follow()"""
+        if prefixed is None:
+            prefixed = follow
         if not self.connect():
             return False
             
         try:
-            # 读取加密文件（格式: nonce + 所有加密块）
-            with open(input_file, 'rb') as f:
-                encrypted_file_data = f.read()
+            # 加密文件格式: nonce + 所有加密块；这里只读取文件头的nonce（前16字节），
+            # 加密块在传输过程中由读线程预读
+            if input_file == '-':
+                file_nonce = sys.stdin.buffer.read(16)
+                encrypted_size = None
+            else:
+                with open(input_file, 'rb') as f:
+                    file_nonce = f.read(16)
+                    encrypted_size = None if follow else os.fstat(f.fileno()).st_size - len(file_nonce)
                 
-            # 从文件头读取nonce（前16字节）
-            if len(encrypted_file_data) < 16:
+            if len(file_nonce) < 16:
                 print("Error: Encrypted file too short")
                 return False
-                
-            file_nonce = encrypted_file_data[:16]
-            encrypted_data = encrypted_file_data[16:]
             
-            print(f"Encrypted file: {len(encrypted_data)} bytes encrypted data")
+            if encrypted_size is not None:
+                print(f"Encrypted file: {encrypted_size} bytes encrypted data")
             print(f"Nonce from file: {file_nonce.hex()}")
             
             # 使用用户自定义参数或文件中的nonce
@@ -485,80 +2275,38 @@ class GCM_SIV_FileProcessor:
             aad = self.custom_aad if self.custom_aad is not None else b''
             
             print(f"Decryption parameters:")
-            print(f"  Key: {'custom' if self.custom_key else 'default'}")
+            print(f"  Key: {self.custom_key if isinstance(self.custom_key, KeyHandle) else 'custom' if self.custom_key else 'default'}")
             print(f"  Nonce: {'custom' if self.custom_nonce else 'from file'}")
             print(f"  AAD length: {len(aad)} bytes")
             
             # 初始化进度变量
-            self.total_size = len(encrypted_data)
+            self.total_size = encrypted_size or 0
             self.total_processed = 0
             self.current_chunk = 0
             
             # 验证文件完整性
-            if len(encrypted_data) == 0:
+            if encrypted_size == 0:
                 print("Error: Encrypted data is empty")
                 return False
                 
+            # 增量更新过的文件：部分块使用了新的块序号（块Nonce），需要按清单逐块指定
+            indices = None
+            manifest = self._load_manifest(input_file)
+            if manifest and manifest["nonce"] == file_nonce.hex() and \
+                    manifest["indices"] != list(range(len(manifest["indices"]))):
+                indices = manifest["indices"]
+                print(f"Using chunk indices from manifest (generation {manifest['generation']})")
+
             print(f"Starting decryption process (streaming mode)...")
             
-            # 等待MCU准备
-            if not self.wait_for_message('READY', 15):
-                print("MCU not ready")
-                return False
-                
-            # 进入流模式
-            if not self.send_and_wait(b'n', 'NEW_STREAM_MODE'):
-                return False
-                
-            # 等待操作选择
-            if not self.wait_for_message('WAIT_OPERATION'):
-                return False
-                
-            # 发送解密操作
-            if not self.send_and_wait(b'd', 'ACK'):
-                return False
-                
-            # 等待密钥请求
-            if not self.wait_for_message('WAIT_KEY'):
-                return False
-                
-            # 发送密钥
-            if not self.send_and_wait(key, 'ACK'):
-                return False
-                
-            # 等待Nonce请求  
-            if not self.wait_for_message('WAIT_NONCE'):
-                return False
-                
-            # 发送Nonce
-            if not self.send_and_wait(nonce, 'ACK'):
-                return False
-                
-            # 等待AAD长度请求
-            if not self.wait_for_message('WAIT_AAD_LEN'):
-                return False
-                
-            # 发送AAD长度
-            aad_len_data = struct.pack('>I', len(aad))
-            if not self.send_and_wait(aad_len_data, 'ACK'):
-                return False
-                
-            # 如果AAD长度大于0，发送AAD数据
-            if len(aad) > 0:
-                if not self.wait_for_message('WAIT_AAD'):
-                    return False
-                
-                if not self.send_and_wait(aad, 'ACK'):
-                    return False
-            
-            # 不再发送文件大小，直接等待READY_FOR_DATA
-            if not self.wait_for_message('READY_FOR_DATA'):
+            # 块长度不固定的输入不能声明长度（MCU按固定块大小计算块划分）
+            if not self._start_stream_session(b'd', key, nonce, aad,
+                                              required_options=OPT_CHUNK_INDEX if indices else 0,
+                                              sized=encrypted_size is not None and not prefixed):
                 return False
-                
-            print("✓ Entered streaming mode")
             
             # 流式模式发送数据
-            return self._decrypt_streaming(encrypted_data, nonce, output_file)
+            return self._decrypt_streaming(input_file, file_nonce, output_file, indices, follow, prefixed)
                 
         except Exception as e:
             print(f"Decryption error: {e}")
@@ -568,191 +2316,49 @@ class GCM_SIV_FileProcessor:
         finally:
             self.disconnect()
 
-    def _decrypt_streaming(self, encrypted_data, nonce, output_file):
-        """流式模式解密 - 修复版本，正确发送加密块大小"""
-        total_sent = 0
-        chunk_count = 0
-        decrypted_data = b''
-        
-        # 关键：在开始前给MCU一些预热时间
-        print("Allowing MCU hardware warmup...")
-        time.sleep(0.3)
-        
-        # 计算加密块大小（与GCM-SIV加密格式匹配）
-        # 重要：每个加密块 = 明文块大小 + 16字节标签
-        total_encrypted_size = len(encrypted_data)
-        remaining = total_encrypted_size
-        
-        print(f"Total encrypted data: {total_encrypted_size} bytes")
+    def _decrypt_streaming(self, input_file, file_nonce, output_file, indices=None, follow=False, prefixed=False):
+        """流式模式解密 - 每个加密块 = 明文块大小 + 16字节标签；
+        加密块由读线程预读，解密结果由写线程写入 output_file"""
+        source = self.follow_source = ReadAheadSource(input_file, offset=len(file_nonce),
+                                                      chunk_size=CHUNK_SIZE + 16, follow=follow, prefixed=prefixed)
+        if source.total_size is not None:
+            print(f"Total encrypted data: {source.total_size} bytes")
         print(f"Expected chunk size for decryption: {CHUNK_SIZE + 16} bytes (plaintext + tag)")
-        
-        while remaining > 0:
-            chunk_count += 1
-            self.current_chunk = chunk_count
-            
-            # 等待MCU的WAIT_CHUNK消息
-            chunk_line = None
-            start_time = time.time()
-            while time.time() - start_time < 30 and chunk_line is None:
-                if self.ser.in_waiting > 0:
-                    line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                    print(f"MCU: {line}")
-                    
-                    if line.startswith('WAIT_CHUNK'):
-                        chunk_line = line
-                        # 解析MCU请求的块大小
-                        try:
-                            requested_size = int(line.split(':')[1])
-                            print(f"MCU requested chunk size: {requested_size} bytes")
-                        except:
-                            requested_size = CHUNK_SIZE + 16  # 默认加密块大小
-                    elif 'ERROR' in line:
-                        print(f"MCU error: {line}")
-                        return False
-                    elif 'STREAM_COMPLETE' in line:
-                        print("✓ Stream completed unexpectedly")
-                        return True
-                time.sleep(0.01)
-            
-            if chunk_line is None:
-                print("No chunk request received")
-                return False
-            
-            # 计算要发送的加密块大小
-            # 对于解密模式，每个加密块应该是 (CHUNK_SIZE + 16) 字节
-            # 最后一个块可能小于这个值
-            expected_chunk_size = CHUNK_SIZE + 16
-            chunk_size = min(expected_chunk_size, remaining)
-            
-            # 检查MCU请求的大小是否与我们的预期匹配
-            try:
-                requested_size = int(chunk_line.split(':')[1])
-                if requested_size != expected_chunk_size and requested_size != chunk_size:
-                    print(f"Warning: MCU requested {requested_size} bytes, but we expected {expected_chunk_size}")
-                    # 使用MCU请求的大小，但不能超过剩余数据
-                    chunk_size = min(requested_size, remaining)
-            except:
-                pass  # 使用我们计算的chunk_size
-            
-            # 发送块头（4字节长度信息）
-            chunk_header = struct.pack('>I', chunk_size)
-            print(f"Sending encrypted chunk header: {chunk_size} bytes")
-            self.ser.write(chunk_header)
-            self.ser.flush()
-            
-            # 发送加密数据块
-            chunk = encrypted_data[total_sent:total_sent + chunk_size]
-            print(f"Sending encrypted chunk {chunk_count}: {len(chunk)} bytes")
-            self.ser.write(chunk)
-            self.ser.flush()
-            total_sent += len(chunk)
-            remaining -= len(chunk)
-            
-            # 等待块接收确认
-            ack_msg = self.wait_for_message('CHUNK_RECEIVED', 30)
-            if not ack_msg:
-                print("Chunk not acknowledged")
-                return False
-            
-            # 处理响应
-            chunk_success = False
-            start_time = time.time()
-            received_b64_data = None
-            
-            while time.time() - start_time < 30 and not chunk_success:  # 缩短超时时间
-                if self.ser.in_waiting > 0:
-                    line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                    print(f"MCU: {line}")
-                    
-                    if line.startswith('B64:'):
-                        b64_data = line[4:]
-                        decoded = self.safe_base64_decode(b64_data)
-                        if decoded:
-                            received_b64_data = decoded
-                            decrypted_data += decoded
-                            self.total_processed += len(decoded)
-                            print(f"✓ Received decrypted chunk {chunk_count}: {len(decoded)} bytes")
-                        else:
-                            print(f"Base64 decode failed for chunk {chunk_count}")
-                    
-                    elif 'CHUNK_PROCESSED' in line:
-                        if received_b64_data is not None:
-                            print(f"✓ Chunk {chunk_count} processed successfully")
-                            chunk_success = True
-                        else:
-                            print(f"Warning: Chunk {chunk_count} processed but no data received")
-                            chunk_success = True
-                    
-                    elif 'STREAM_STATS' in line:
-                        print(f"MCU Stream Stats: {line}")
-                        # 不打断处理流程，继续等待CHUNK_PROCESSED
-                    
-                    elif 'ERROR' in line:
-                        print(f"MCU error: {line}")
-                        return False
-                    
-                    elif 'STREAM_COMPLETE' in line:
-                        print("✓ Stream completed during chunk processing")
-                        return True
-                else:
-                    time.sleep(0.01)
-            
-            if not chunk_success:
-                # 即使没有收到CHUNK_PROCESSED，如果收到了数据就继续
-                if received_b64_data is not None:
-                    print(f"⚠ Chunk {chunk_count} completed without confirmation (data received)")
-                    chunk_success = True
-                else:
-                    print(f"✗ Chunk {chunk_count} failed: no data received")
-                    return False
-            
-            print(f"Stream progress: {total_sent}/{total_encrypted_size} bytes ({total_sent/total_encrypted_size*100:.1f}%)")
-        
-        # 所有数据发送完毕，发送结束标记
-        print("Sending end-of-stream marker (0-length chunk)")
-        end_header = struct.pack('>I', 0)
-
-        # 确保串口缓冲区清空
-        time.sleep(0.1)  # 100ms延迟
-
-        self.ser.write(end_header)
-        self.ser.flush()
 
-        # 关键：等待MCU处理结束标记
-        print("Waiting for MCU to process end-of-stream marker...")
-        time.sleep(0.5)  # 500ms延迟
-
-        # 等待流结束确认
-        end_msg = self.wait_for_message('END_OF_STREAM', 10)
-        if not end_msg:
-            print("Warning: Did not receive END_OF_STREAM confirmation, but continuing...")
-
-        # 等待流完成
-        stream_msg = self.wait_for_message('STREAM_COMPLETE', 10)
-        if not stream_msg:
-            print("Warning: Stream completion not received, but assuming completion...")
+        digests = (StreamDigest(file_nonce), StreamDigest())
+        sink = WriteBehindSink(output_file, batch_size=1 if follow else WRITE_BATCH_SIZE)
+        result = None
+        try:
+            result = self._run_stream(source, CHUNK_SIZE + 16, "decrypted", indices,
+                                      on_output=sink.write, digests=digests)
+        finally:
+            source.close()
+            self.follow_source = None
+            saved = sink.close(keep=result is not None and sink.bytes_written > 0)
+        if result is None:
+            return False
+        chunk_count = result[1]
+        total_encrypted_size = digests[0].length - len(file_nonce)
+        self.digests = {
+            "ciphertext_in": digests[0].hexdigest(),
+            "plaintext_out": digests[1].hexdigest(),
+        }
+        decrypted_size = sink.bytes_written
 
-        # 等待总结信息
-        summary_msg = self.wait_for_message('SUMMARY:', 5)
-        if summary_msg:
-            print(f"MCU Summary: {summary_msg}")
-        
         # 保存解密结果
-        if decrypted_data:
-            with open(output_file, 'wb') as f:
-                f.write(decrypted_data)
-                
+        if saved:
             print(f"✓ Streaming decryption successful: {output_file}")
-            print(f"  Plaintext: {len(decrypted_data)} bytes")
-            print(f"  Total encrypted data processed: {total_sent}/{total_encrypted_size} bytes")
+            print(f"  Plaintext: {decrypted_size} bytes")
+            print(f"  Total encrypted data processed: {total_encrypted_size} bytes")
             print(f"  Chunks processed: {chunk_count}")
+            print(f"  SHA-256 plaintext: {self.digests['plaintext_out']}")
             
             # 验证解密结果
             expected_plaintext_size = total_encrypted_size - (chunk_count * 16)
-            if len(decrypted_data) == expected_plaintext_size:
-                print(f"  ✓ Decrypted size matches expected: {len(decrypted_data)} bytes")
+            if decrypted_size == expected_plaintext_size:
+                print(f"  ✓ Decrypted size matches expected: {decrypted_size} bytes")
             else:
-                print(f"  ⚠ Decrypted size mismatch: expected {expected_plaintext_size}, got {len(decrypted_data)}")
+                print(f"  ⚠ Decrypted size mismatch: expected {expected_plaintext_size}, got {decrypted_size}")
             
             return True
         else:
@@ -786,39 +2392,326 @@ class GCM_SIV_FileProcessor:
             print(f"  ✗ Verification error: {e}")
             return False
 
-def verify_files(file1, file2):
-    """验证两个文件是否相同"""
-    try:
-        with open(file1, 'rb') as f1, open(file2, 'rb') as f2:
-            content1 = f1.read()
-            content2 = f2.read()
-            
-            if content1 == content2:
-                print("✓ SUCCESS: Files are identical")
-                print(f"  {file1}: {len(content1)} bytes")
-                print(f"  {file2}: {len(content2)} bytes")
-                return True
+class _BoardStream(io.RawIOBase):
+    """EncryptingWriter/DecryptingReader 的公共部分：在后台线程中运行一个流式会话，
+    密钥和AAD使用 processor 的自定义参数"""
+
+    def __init__(self, processor):
+        super().__init__()
+        self.processor = processor
+        self.digests = None  # 会话正常结束后的SHA-256（与 processor.digests 的键相同）
+        self.error = None
+        self._source = None
+        self._result = None
+        self._thread = None
+
+    def _start(self, operation, nonce, source, chunk_size, label, on_output, digests):
+        self._source = source
+
+        def session():
+            p = self.processor
+            key = p.custom_key if p.custom_key is not None else bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
+            aad = p.custom_aad if p.custom_aad is not None else b''
+            try:
+                if p.connect() and p._start_stream_session(operation, key, nonce, aad, sized=False):
+                    self._result = p._run_stream(source, chunk_size, label, on_output=on_output, digests=digests)
+            except Exception as e:
+                self.error = e
+                print(f"Board stream error: {e}")
+            finally:
+                source.close()
+                p.disconnect()
+                self._session_done()
+
+        self._thread = threading.Thread(target=session, name="board-stream", daemon=True)
+        self._thread.start()
+
+    def _session_done(self):
+        pass
+
+    def _failed(self):
+        return not self._thread.is_alive() and self._result is None
+
+
+class EncryptingWriter(_BoardStream):
+    """文件式加密接口：写入的明文按块边界缓存，经MCU加密后写入 raw（任何可写的二进制
+    文件对象），格式与 encrypt_file 的输出相同（nonce + 密文块）；nonce 未设置时随机生成。
+    close()（或 with 块结束）时发送最后的不满块并等待会话结束，失败时抛出 OSError"""
+
+    def __init__(self, processor, raw):
+        super().__init__(processor)
+        self.nonce = processor.custom_nonce if processor.custom_nonce is not None else secrets.token_bytes(16)
+        self._buffer = bytearray()
+        self._sink = WriteBehindSink(raw, header=self.nonce)
+        self._digests = (StreamDigest(), StreamDigest(self.nonce))
+        self._start(b'e', self.nonce, QueueSource(), CHUNK_SIZE, "encrypted", self._sink.write, self._digests)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._checkClosed()
+        if self._failed():
+            raise OSError("board encryption session failed")
+        data = memoryview(b).cast('B')
+        self._buffer += data
+        while len(self._buffer) >= CHUNK_SIZE:
+            if not self._source.put(bytes(self._buffer[:CHUNK_SIZE])):
+                raise OSError("board encryption session failed")
+            del self._buffer[:CHUNK_SIZE]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._source.put(bytes(self._buffer))
+                self._buffer.clear()
+            self._source.end()
+            self._thread.join()
+            saved = self._sink.close(keep=self._result is not None)
+            if self._result is None or not saved:
+                raise OSError("board encryption session failed")
+            self.digests = {
+                "plaintext_in": self._digests[0].hexdigest(),
+                "ciphertext_out": self._digests[1].hexdigest(),
+            }
+        finally:
+            super().close()
+
+
+class DecryptingReader(_BoardStream):
+    """文件式解密接口：从 raw（任何可读的二进制文件对象）读取 encrypt_file/EncryptingWriter
+    格式的加密数据，经MCU解密后由 read()/readinto() 提供明文；prefixed 表示输入是跟随模式
+    写出的（每个密文块前带4字节长度）。读到结尾时会话失败（如标签错误）抛出 OSError；
+    提前 close() 时丢弃尚未发送的密文块并结束会话"""
+
+    def __init__(self, processor, raw, prefixed=False):
+        super().__init__(processor)
+        self.nonce = b''
+        while len(self.nonce) < 16:
+            piece = raw.read(16 - len(self.nonce))
+            if not piece:
+                raise ValueError("Encrypted stream too short")
+            self.nonce += piece
+        self._plain = queue.Queue(maxsize=READ_AHEAD_CHUNKS)
+        self._pending = {}  # 提前到达的块：序号 -> 明文
+        self._next_seq = 0
+        self._rest = b''
+        self._eof = False
+        self._closing = False
+        self._digests = (StreamDigest(self.nonce), StreamDigest())
+        nonce = processor.custom_nonce if processor.custom_nonce is not None else self.nonce
+        source = ReadAheadSource(raw, chunk_size=CHUNK_SIZE + 16, prefixed=prefixed)
+        self._start(b'd', nonce, source, CHUNK_SIZE + 16, "decrypted", self._on_output, self._digests)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        self._checkClosed()
+        while not self._rest and not self._eof:
+            data = self._plain.get()
+            if data is None:
+                self._eof = True
+                self._thread.join()
+                if self._result is None:
+                    raise OSError("board decryption session failed")
+                self.digests = {
+                    "ciphertext_in": self._digests[0].hexdigest(),
+                    "plaintext_out": self._digests[1].hexdigest(),
+                }
             else:
-                print("✗ FAILED: Files differ")
-                print(f"  {file1}: {len(content1)} bytes")
-                print(f"  {file2}: {len(content2)} bytes")
-                
-                # 找出差异
-                min_len = min(len(content1), len(content2))
-                differences = 0
-                for i in range(min_len):
-                    if content1[i] != content2[i]:
-                        differences += 1
-                        if differences == 1:
-                            print(f"  First difference at byte {i}: 0x{content1[i]:02x} vs 0x{content2[i]:02x}")
-                
-                if differences > 0:
-                    print(f"  Total differences: {differences}")
-                    
-                return False
+                self._rest = data
+        n = min(len(b), len(self._rest))
+        memoryview(b).cast('B')[:n] = self._rest[:n]
+        self._rest = self._rest[n:]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._thread.is_alive():
+                self._closing = True
+                self._source.cancel()
+                self._thread.join()
+        finally:
+            super().close()
+
+    def _on_output(self, seq, out):
+        # 协调器线程：按块序号顺序交给 readinto()
+        self._pending[seq] = out or b''
+        while self._next_seq in self._pending:
+            self._deliver(self._pending.pop(self._next_seq))
+            self._next_seq += 1
+
+    def _deliver(self, data):
+        # 读者跟不上时等待（背压）；已关闭时丢弃
+        while not self._closing:
+            try:
+                self._plain.put(data, timeout=LINK_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _session_done(self):
+        self._deliver(None)
+
+
+class RecordStream:
+    """encrypt_records/decrypt_records 返回的迭代器：后台线程把输入的记录按批发送给MCU
+    （一个OPT_RECORDS会话），按输入顺序产出每条记录的结果。nonce 是会话Nonce，
+    第i条记录（从0开始）使用由它和i派生的Nonce，解密时记录的顺序必须与加密时相同；
+    解密时标签错误的记录产出None。输入记录无效或会话失败时迭代抛出异常；
+    close()（或 with 块结束）提前结束会话"""
+
+    _END = object()
+
+    def __init__(self, processor, operation, records, nonce):
+        self.processor = processor
+        self.nonce = nonce
+        self.count = 0  # 已产出的记录数
+        self.error = None
+        self._result = None
+        self._done = False
+        self._closing = False
+        self._pending = {}  # 提前到达的批：序号 -> 输出
+        self._next_seq = 0
+        self._source = RecordSource()
+        self._results = queue.Queue(maxsize=RECORD_QUEUE_SIZE)
+        chunk_size = CHUNK_SIZE if operation == b'e' else CHUNK_SIZE + 16
+        label = "encrypted records" if operation == b'e' else "decrypted records"
+        self._session = threading.Thread(target=self._session_loop, args=(operation, chunk_size, label),
+                                         name="record-session", daemon=True)
+        self._feeder = threading.Thread(target=self._feed, args=(records, chunk_size - 2),
+                                        name="record-feeder", daemon=True)
+        self._session.start()
+        self._feeder.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        item = self._results.get()
+        if item is self._END:
+            self._done = True
+            self._session.join()
+            if self.error is not None:
+                raise self.error
+            if self._result is None:
+                raise OSError("board record session failed")
+            raise StopIteration
+        self.count += 1
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """丢弃尚未发送的记录并结束会话"""
+        if self._session.is_alive():
+            self._closing = True
+            self._source.cancel()
+            self._session.join()
+        self._done = True
+
+    def _feed(self, records, limit):
+        try:
+            for n, record in enumerate(records):
+                record = bytes(record)
+                if len(record) > limit:
+                    raise ValueError(f"Record {n} too large: {len(record)} bytes (max {limit})")
+                if not self._source.put(struct.pack('>H', len(record)) + record):
+                    return  # 会话已结束
+            self._source.end()
+        except Exception as e:
+            self.error = e
+            self._source.cancel()
+
+    def _session_loop(self, operation, chunk_size, label):
+        p = self.processor
+        key = p.custom_key if p.custom_key is not None else bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
+        aad = p.custom_aad if p.custom_aad is not None else b''
+        try:
+            if p.connect() and p._start_stream_session(operation, key, self.nonce, aad,
+                                                       required_options=OPT_RECORDS, sized=False):
+                self._result = p._run_stream(self._source, chunk_size, label, on_output=self._on_output)
+        except Exception as e:
+            self.error = e
+            print(f"Record session error: {e}")
+        finally:
+            self._source.close()
+            p.disconnect()
+            self._deliver(self._END)
+
+    def _on_output(self, seq, out):
+        # 协调器线程：按批序号顺序拆出每条记录的结果
+        if out is None:
+            # 不知道这一批有几条记录，之后的结果无法与输入对应
+            self.error = OSError(f"No output received for record batch {seq}")
+            self._source.cancel()
+            return
+        self._pending[seq] = out
+        while self._next_seq in self._pending:
+            batch = self._pending.pop(self._next_seq)
+            self._next_seq += 1
+            pos = 0
+            while pos + 2 <= len(batch):
+                length = struct.unpack_from('>H', batch, pos)[0]
+                pos += 2
+                if length == RECORD_FAILED:
+                    self._deliver(None)
+                else:
+                    self._deliver(bytes(batch[pos:pos + length]))
+                    pos += length
+
+    def _deliver(self, item):
+        # 调用者跟不上时等待（背压）；已关闭时丢弃
+        while not self._closing:
+            try:
+                self._results.put(item, timeout=LINK_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+
+def verify_files(file1, file2, chunk_size=CHUNK_SIZE, offset=0):
+    """验证两个文件是否相同，不同时报告第一个差异和受影响的协议块"""
+    try:
+        report = compare_files(file1, file2, chunk_size, offset)
     except Exception as e:
         print(f"Error comparing files: {e}")
         return False
+    if report["identical"]:
+        print("✓ SUCCESS: Files are identical")
+    else:
+        print("✗ FAILED: Files differ")
+    print(f"  {file1}: {report['size1']} bytes")
+    print(f"  {file2}: {report['size2']} bytes")
+    if report["identical"]:
+        return True
+    first = report["first_diff"]
+    if first < min(report["size1"], report["size2"]):
+        with open(file1, 'rb') as f1, open(file2, 'rb') as f2:
+            f1.seek(first)
+            f2.seek(first)
+            print(f"  First difference at byte {first}: 0x{f1.read(1)[0]:02x} vs 0x{f2.read(1)[0]:02x}")
+    else:
+        print(f"  First difference at byte {first}: one file ends there")
+    if report["differences"]:
+        print(f"  Total differences: {report['differences']}")
+    if report["header_differs"]:
+        print(f"  Header ({offset} bytes) differs")
+    if report["chunks"]:
+        print(f"  Affected chunks ({len(report['chunks'])}): {format_chunk_ranges(report['chunks'])}")
+    return False
 
 def main():
     port = "COM3"  # 修改为您的串口
@@ -828,8 +2721,11 @@ def main():
     print("2. Decrypt file (streaming mode)") 
     print("3. Encrypt -> Decrypt -> Compare (automated test)")
     print("4. Verify files")
+    print("5. Update encrypted file (incremental, needs manifest)")
+    print("6. Round-trip verification (single session, no temp files)")
+    print("7. Check encrypted file integrity (tag-only, no plaintext returned)")
     
-    choice = input("Choose operation (1-4): ").strip()
+    choice = input("Choose operation (1-7): ").strip()
     
     processor = GCM_SIV_FileProcessor(port)
     
@@ -875,6 +2771,9 @@ def main():
             if aad_input:
                 processor.custom_aad = aad_input.encode('utf-8')
         
+        # 写出块哈希清单，之后可以用选项5增量更新
+        processor.write_manifest = input("Write manifest for incremental updates? (y/N): ").strip().lower() == 'y'
+        
         # 流式模式加密
         success = processor.encrypt_file(input_file, output_file)
         if success and os.path.exists(output_file):
@@ -945,6 +2844,7 @@ def main():
         
         # 检查加密结果
         if encryption_success:
+            encrypt_digests = processor.digests
             if os.path.exists(default_ciphertext):
                 print(f"✓ Encryption file created: {default_ciphertext}")
                 file_size = os.path.getsize(default_ciphertext)
@@ -958,7 +2858,14 @@ def main():
                 
                 if processor.decrypt_file(default_ciphertext, default_output):
                     print("\n--- Step 3: Verification ---")
-                    verify_files(default_input, default_output)
+                    # 比较流式过程中算出的摘要，不需要重新读取文件
+                    if processor.digests["ciphertext_in"] != encrypt_digests["ciphertext_out"]:
+                        print("✗ FAILED: Encrypted file changed between encryption and decryption")
+                    elif processor.digests["plaintext_out"] == encrypt_digests["plaintext_in"]:
+                        print("✓ SUCCESS: Files are identical")
+                        print(f"  SHA-256: {encrypt_digests['plaintext_in']}")
+                    else:
+                        verify_files(default_input, default_output)
                 else:
                     print("✗ Decryption failed")
             else:
@@ -969,8 +2876,112 @@ def main():
     elif choice == "4":
         verify_files(default_input, default_output)
 
+    elif choice == "5":
+        input_file = input("Modified input file [input.txt]: ").strip() or default_input
+        container_file = input("Encrypted file to update [encrypted.bin]: ").strip() or default_ciphertext
+        
+        if not os.path.exists(input_file) or not os.path.exists(container_file):
+            print("Input file or encrypted file does not exist")
+            return
+        
+        # 密钥和AAD必须与生成清单时相同
+        key_input = input("Enter 16-byte key (hex) or press Enter for default: ").strip()
+        if key_input:
+            try:
+                processor.set_custom_parameters(key=bytes.fromhex(key_input))
+            except ValueError as e:
+                print(f"Invalid key: {e}")
+                return
+        aad_input = input("Enter Additional Authenticated Data (AAD) text or press Enter for none: ").strip()
+        if aad_input:
+            processor.custom_aad = aad_input.encode('utf-8')
+        
+        processor.update_file(input_file, container_file)
+
+    elif choice == "6":
+        input_file = input("Input file [input.txt]: ").strip() or default_input
+        
+        if not os.path.exists(input_file):
+            print(f"Input file does not exist: {input_file}")
+            return
+        
+        processor.verify_roundtrip(input_file)
+
+    elif choice == "7":
+        input_file = input("Encrypted file [encrypted.bin]: ").strip() or default_ciphertext
+        
+        if not os.path.exists(input_file):
+            print(f"Input file does not exist: {input_file}")
+            return
+        
+        # 密钥和AAD必须与加密时相同
+        key_input = input("Enter 16-byte key (hex) or press Enter for default: ").strip()
+        if key_input:
+            try:
+                processor.set_custom_parameters(key=bytes.fromhex(key_input))
+            except ValueError as e:
+                print(f"Invalid key: {e}")
+                return
+        aad_input = input("Enter Additional Authenticated Data (AAD) text or press Enter for none: ").strip()
+        if aad_input:
+            processor.custom_aad = aad_input.encode('utf-8')
+        
+        processor.verify_tags(input_file)
+
     else:
         print("Invalid choice")
 
+def cli(argv):
+    """命令行模式：encrypt/decrypt <输入> <输出>，文件名 '-' 表示标准输入/标准输出"""
+    parser = argparse.ArgumentParser(description="GCM-SIV encryption/decryption through the MCU (streaming mode)")
+    parser.add_argument("operation", choices=["encrypt", "decrypt"])
+    parser.add_argument("input", help="input file, '-' for stdin")
+    parser.add_argument("output", help="output file, '-' for stdout")
+    parser.add_argument("--port", default="COM3", help="serial port (default COM3)")
+    parser.add_argument("--key", help="16-byte key (hex), default key if omitted")
+    parser.add_argument("--aad", help="Additional Authenticated Data (text)")
+    parser.add_argument("--follow", action="store_true",
+                        help="follow a growing input (e.g. a log) until Ctrl-C or end of stdin; "
+                             "encrypted chunks are written with length prefixes")
+    parser.add_argument("--prefixed", action="store_true",
+                        help="decrypt: input was written by --follow (implied by --follow)")
+    parser.add_argument("--latency", type=float, default=FOLLOW_LATENCY,
+                        help=f"--follow: send a partial chunk after this many seconds (default {FOLLOW_LATENCY})")
+    parser.add_argument("--declared-length", action="store_true",
+                        help="declare the total length up front when it is known (firmware option)")
+    args = parser.parse_args(argv)
+
+    processor = GCM_SIV_FileProcessor(args.port, show_progress=False, declared_length=args.declared_length)
+    try:
+        processor.set_custom_parameters(key=bytes.fromhex(args.key) if args.key else None,
+                                        aad=args.aad.encode('utf-8') if args.aad else None)
+    except ValueError as e:
+        print(f"Invalid key: {e}", file=sys.stderr)
+        return 2
+    processor.follow_latency = args.latency
+
+    # Ctrl-C：跟随模式下第一次发送完已有的数据后正常结束；之后中止会话（MCU在块边界停止并
+    # 回到空闲状态）；再按一次恢复默认行为
+    stages = ([processor.stop_follow] if args.follow else []) + [processor.cancel]
+
+    def on_sigint(signum, frame):
+        action = stages.pop(0)
+        if not stages:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+        action()
+    signal.signal(signal.SIGINT, on_sigint)
+
+    # 数据写到标准输出时，状态信息改到标准错误
+    status = contextlib.redirect_stdout(sys.stderr) if args.output == '-' else contextlib.nullcontext()
+    with status:
+        if args.operation == "encrypt":
+            ok = processor.encrypt_file(args.input, args.output, follow=args.follow)
+        else:
+            ok = processor.decrypt_file(args.input, args.output, follow=args.follow,
+                                        prefixed=args.follow or args.prefixed)
+    return 0 if ok else 1
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
     main()
\ No newline at end of file
@@ -0,0 +1,1094 @@
+"""
+MCU固件仿真器
+
+在主机上模拟 CM32M433R 流式加解密固件的串口协议与时序，用于在没有开发板的
+情况下运行上位机（Serial File Transport.py / benchmark.py）并测量传输性能。
+
+- 串口两个方向分别按波特率（8N1，每字节10位）建模，全双工；
+- 固件的接收缓冲区数量可配置：rx_buffers=1 时与现有固件行为一致
+  （CHUNK_PROCESSED 之后才发出下一个 WAIT_CHUNK），>=2 时固件在收到一个块后
+  立即为下一个块发出 WAIT_CHUNK，可与 Base64 回传重叠；
+- ber>0 时对数据阶段的数据帧（主机发送的块、MCU返回的B64行）按比特错误率
+  注入随机比特翻转，控制行（WAIT_CHUNK、CHUNK_PROCESSED等）不受影响；
+- 支持会话协议选项（'o' 命令）：OPT_FRAME_CRC 时数据帧带序号和CRC32，
+  损坏的帧通过 NAK 选择性重传；OPT_CREDITS 时固件用 CREDIT:<n> 通告空闲的
+  接收缓冲区；OPT_KEY_SLOTS 时支持 'k' 命令把密钥（及其扩展结果）装入板上
+  密钥槽，之后的会话用操作码 'E'/'D' + 槽号引用；OPT_AAD_CACHE 时支持 'a'
+  命令把AAD登记到板上的AAD槽，会话中用 AAD_REF_FLAG|槽号 代替AAD长度；
+  OPT_CHUNK_INDEX 时每个数据块前带4字节块序号（主机可跳过已缓存的块）；
+  OPT_DECLARED_LENGTH 时主机在数据阶段开始时先发送4字节总长度，固件预先算出块
+  划分（SCHEDULE:<块数>），数据块不再带长度头，按额度连续发送，最后一块之后固件
+  自行结束流（帧校验模式仍由主机的结束帧结束，以便完成输出帧重传）；
+  OPT_ROUND_TRIP 时支持往返校验操作 'r'/'R'：同一会话中每块前带1字节类型
+  （'e' 加密 / 'd' 解密）和4字节块序号，主机把返回的密文立即发回解密；
+  OPT_TAG_VERIFY 时支持只校验标签的操作 'v'/'V'：按解密处理但不返回明文，每
+  VERIFY_BATCH 块发送一行通过/失败位图 VBITS:<首块>:<块数>:<十六进制>，
+  最后发送 VERIFY_RESULT；标签错误不中止会话；
+  OPT_RECORDS 时加解密的每个数据块是一批记录（每条前2字节长度），每条记录按会话
+  中的记录序号派生Nonce、单独带标签，输出块同样是一批记录；解密时标签错误的记录
+  长度为 0xFFFF，不中止会话；
+  OPT_ABORT（能力位，不需要协商）：主机发送UART break 时固件在块边界中止当前
+  会话（正在处理的块完成，已接收未处理的块丢弃），清空接收缓冲区，应答
+  ABORTED: chunks=<已处理的块数> 后回到空闲状态（立即发送READY）；
+  OPT_PING（能力位）：空闲时 'p' + 2字节上行长度 + 2字节下行长度 + 上行数据，
+  固件收完后应答 PONG:<下行长度字节的Base64>（主机据此测量往返时间和吞吐量）；
+  数据阶段块头长度字段为 0xFFFFFFFD 时是保活ping，固件立即应答 PONG（等待空闲
+  接收缓冲区时也应答），并重新开始等待主机数据的超时；CAPS 中的 crypto_rate
+  是片上加解密的标称速度（字节/秒）；
+  每个数据流正常结束时（END_OF_STREAM 之前）发送一行
+  STREAM_STATS: chunks= bytes_in= bytes_out= cycles= chunk_cycles_min= chunk_cycles_max=
+  cpu_hz= buffers= buffers_hw= stall_cycles= idle_cycles= overruns=（加解密消耗的CPU周期、
+  接收缓冲区占用的最高值、接收任务等待空闲缓冲区/加解密任务等待数据的周期数）；
+  OPT_BENCH（能力位）：分阶段测试命令，与加密引擎无关。'x' + 4字节总长度：应答
+  ECHO:<总长度> 后按块（最多CHUNK_SIZE字节）接收数据，每块原样用 B64: 行发回，最后
+  ECHO_DONE: bytes=<总长度>（只测链路，主机未确认的块数不超过接收缓冲区数）；
+  'y' + 4字节块数 + 2字节块大小：用当前引擎加密板上生成的数据，不经过串口，应答
+  CRYPTO_BENCH: chunks= bytes= cycles= cpu_hz=；
+  'c' 命令返回一行 CAPS:（算法、固件版本、最大块大小、缓冲区数、支持的波特率、
+  协议选项、密钥槽/AAD槽数量、可选的加密引擎）；options=0 可模拟不支持选项和
+  CAPS的旧固件；
+- engines=hw_aes,sw_aes 模拟同时包含SAC硬件引擎和软件AES的双模式固件：'g' 命令
+  + 1字节引擎号切换之后会话使用的引擎（应答 ENGINE:<名称>），无需重新烧录；
+- 接收缓冲区是有限的：所有缓冲区都被占用时到达的数据只能进入 rx_fifo 字节的
+  UART接收FIFO，多出的字节被丢弃（溢出，计入 overruns）；rtscts=1 表示连接了
+  RTS/CTS，主机以 rtscts=True 打开串口时由硬件流控暂停发送，不会溢出；
+- 加解密只用于仿真：基于 SHA-256/SHAKE-256 的确定性构造，接口形式与
+  AES-GCM-SIV 相同（每块 16 字节标签），不是真正的 AES-GCM-SIV。
+
+用法：上位机端口名以 "sim" 开头即使用仿真器，例如
+    GCM_SIV_FileProcessor("sim://board0?baud=921600&rx_buffers=2")
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import queue
+import random
+import struct
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_BAUD = 115200
+CHUNK_SIZE = 1024
+TAG_SIZE = 16
+READY_INTERVAL = 1.0   # 空闲时重复发送READY的间隔（秒）
+RX_TIMEOUT = 30        # 固件等待主机数据的超时（秒）
+USB_PACKET_SIZE = 64   # USB转串口芯片向主机上报数据的包大小（字节）
+DRAIN_IDLE = 0.05      # 帧错误后清空接收缓冲区：线路空闲多久视为清空完成（秒）
+RETX_FRAMES = 8        # 固件保留的已发送输出帧数量（供主机NAK重传）
+RX_FIFO_SIZE = 256     # 没有空闲接收缓冲区时UART接收FIFO能暂存的字节数
+FIRMWARE_VERSION = "2.0.0-sim"
+SUPPORTED_BAUDS = (115200, 230400, 460800, 921600, 2000000)
+KEY_SLOTS = 8          # 板上密钥槽数量
+AAD_SLOTS = 4          # 板上AAD槽数量
+AAD_SLOT_SIZE = 4096   # 每个AAD槽的最大长度（字节）
+ENGINE_IDS = {"hw_aes": 0, "sw_aes": 1, "sw_ascon": 2}  # 'g' 命令的引擎号，与上位机一致
+CPU_HZ = 144000000     # CM32M433R 主频（STREAM_STATS 中的周期数按此换算）
+
+# 会话协议选项（'o' 命令），与上位机中的定义一致
+OPT_FRAME_CRC = 0x01   # 数据帧带序号和CRC32，支持NAK选择性重传
+OPT_CREDITS = 0x02     # 用 CREDIT:<n> 通告空闲接收缓冲区，代替每块一个WAIT_CHUNK
+OPT_KEY_SLOTS = 0x04   # 支持 'k' 命令和按槽号引用密钥的操作码 'E'/'D'
+OPT_AAD_CACHE = 0x08   # 支持 'a' 命令登记AAD，会话中按槽号引用
+OPT_CHUNK_INDEX = 0x10  # 数据块前带4字节块序号（用于派生块Nonce），块可以不连续
+OPT_DECLARED_LENGTH = 0x20  # 数据阶段先声明总长度，数据块不带长度头、不需要结束标记
+OPT_ROUND_TRIP = 0x40  # 支持往返校验操作 'r'/'R'（同一会话中加密块和解密块交替）
+OPT_TAG_VERIFY = 0x80  # 支持只校验标签的操作 'v'/'V'（不返回明文，只返回通过/失败位图）
+OPT_RECORDS = 0x100    # 记录模式：每个数据块是一批记录（2字节长度+数据），每条记录单独加密
+OPT_ABORT = 0x200      # 能力位：UART break 中止当前会话（不需要协商，任何状态下都有效）
+OPT_PING = 0x400       # 能力位：空闲时的 'p' 校准命令，数据阶段的保活ping（不需要协商）
+OPT_BENCH = 0x800      # 能力位：分阶段测试命令 'x'（链路回显）和 'y'（只加密，不经过串口）
+SUPPORTED_OPTIONS = (OPT_FRAME_CRC | OPT_CREDITS | OPT_KEY_SLOTS | OPT_AAD_CACHE | OPT_CHUNK_INDEX
+                     | OPT_DECLARED_LENGTH | OPT_ROUND_TRIP | OPT_TAG_VERIFY | OPT_RECORDS | OPT_ABORT
+                     | OPT_PING | OPT_BENCH)
+VERIFY_BATCH = 32      # 只校验标签时每多少块发送一行位图
+RECORD_FAILED = 0xFFFF  # 记录模式解密时标签错误的记录：长度字段为此值，没有数据
+RECORD_SETUP_BYTES = 96  # 每条记录的额外计算量（按字节折算：每个Nonce派生消息密钥约6个AES块）
+AAD_REF_FLAG = 0x80000000  # AAD长度字段的最高位：低8位是已登记的AAD槽号
+NAK_MARKER = 0xFFFFFFFF  # 帧头长度字段为此值时表示主机请求重传输出帧
+PING_MARKER = 0xFFFFFFFD  # 块头（或帧头）长度字段为此值时是保活ping，固件应答 PONG
+PING_MAX = 4096        # 'p' 校准命令每个方向的最大字节数
+
+# 各固件版本的片上加解密速度（字节/秒，按实测数据估算）和每次装入密钥的
+# 准备时间（秒，密钥扩展/POLYVAL密钥派生，估算值）
+ALGORITHMS = {
+    "hw_aes": {"name": "AES-GCM-SIV (SAC)", "crypto_rate": 2000000, "key_setup": 0.0005},
+    "sw_aes": {"name": "AES-GCM-SIV (software)", "crypto_rate": 250000, "key_setup": 0.003},
+    "sw_ascon": {"name": "Ascon-128 (software)", "crypto_rate": 180000, "key_setup": 0.0001},
+}
+
+
+# ==================== 仿真加解密 ====================
+
+def derive_chunk_nonce(nonce, index):
+    """每块Nonce：基础Nonce的最后4字节与块序号异或"""
+    counter = struct.unpack('>I', nonce[12:16])[0] ^ index
+    return nonce[:12] + struct.pack('>I', counter)
+
+
+def _xor(data, keystream):
+    if not data:
+        return b''
+    value = int.from_bytes(data, 'little') ^ int.from_bytes(keystream, 'little')
+    return value.to_bytes(len(data), 'little')
+
+
+def _tag(key, chunk_nonce, aad, plaintext):
+    mac = hmac.new(key, chunk_nonce + struct.pack('>I', len(aad)) + aad + plaintext, hashlib.sha256)
+    return mac.digest()[:TAG_SIZE]
+
+
+def seal_chunk(key, nonce, aad, index, plaintext):
+    """加密一个块，返回 密文 + 16字节标签"""
+    chunk_nonce = derive_chunk_nonce(nonce, index)
+    tag = _tag(key, chunk_nonce, aad, plaintext)
+    keystream = hashlib.shake_256(key + chunk_nonce + tag).digest(len(plaintext))
+    return _xor(plaintext, keystream) + tag
+
+
+def open_chunk(key, nonce, aad, index, data):
+    """解密一个块，标签不匹配时返回None"""
+    if len(data) < TAG_SIZE:
+        return None
+    ciphertext, tag = data[:-TAG_SIZE], data[-TAG_SIZE:]
+    chunk_nonce = derive_chunk_nonce(nonce, index)
+    keystream = hashlib.shake_256(key + chunk_nonce + tag).digest(len(ciphertext))
+    plaintext = _xor(ciphertext, keystream)
+    if not hmac.compare_digest(tag, _tag(key, chunk_nonce, aad, plaintext)):
+        return None
+    return plaintext
+
+
+def split_records(data):
+    """把记录模式的数据块拆成记录列表（每条记录前2字节长度，大端序），格式错误返回None"""
+    records = []
+    pos = 0
+    while pos < len(data):
+        if pos + 2 > len(data):
+            return None
+        length = struct.unpack('>H', data[pos:pos + 2])[0]
+        if pos + 2 + length > len(data):
+            return None
+        records.append(data[pos + 2:pos + 2 + length])
+        pos += 2 + length
+    return records
+
+
+class _SessionAborted(Exception):
+    """主机发送了UART break：中止当前会话"""
+
+    def __init__(self, chunks=0):
+        super().__init__(chunks)
+        self.chunks = chunks
+
+
+# ==================== UART通道 ====================
+
+class _UartChannel:
+    """单向UART通道：按波特率计算每个字节到达对端的时间。
+    packet_size>1 时按USB转串口芯片的批量包建模：一个包内的字节同时可见"""
+
+    def __init__(self, baudrate, packet_size=1):
+        self.byte_time = 10.0 / baudrate
+        self.packet_size = packet_size
+        self.bytes_sent = 0
+        self._cond = threading.Condition()
+        self._segments = deque()  # [开始时间, 数据, 已读偏移]
+        self._breaks = deque()  # 接收方检测到break的时间（排在之前发送的数据之后）
+        self._free_at = 0.0
+
+    def push(self, data):
+        """写入数据，返回最后一个字节到达对端的时间"""
+        with self._cond:
+            start = max(time.monotonic(), self._free_at)
+            if data:
+                self._segments.append([start, bytes(data), 0])
+                self._free_at = start + len(data) * self.byte_time
+                self.bytes_sent += len(data)
+                self._cond.notify_all()
+            return self._free_at
+
+    def push_break(self):
+        """发送break：线路保持低电平，接收方在约11个位时间后检测到"""
+        with self._cond:
+            start = max(time.monotonic(), self._free_at)
+            self._free_at = start + 1.1 * self.byte_time
+            self._breaks.append(self._free_at)
+            self._cond.notify_all()
+
+    def take_break(self):
+        """已检测到break时取走它并返回True"""
+        with self._cond:
+            if self._breaks and self._breaks[0] <= time.monotonic():
+                self._breaks.popleft()
+                return True
+            return False
+
+    @property
+    def free_at(self):
+        with self._cond:
+            return self._free_at
+
+    def clear(self):
+        with self._cond:
+            self._segments.clear()
+            self._breaks.clear()
+
+    def drop_overrun(self, capacity, before):
+        """模拟接收溢出：before之前到达且未被读取的字节只保留前capacity个，
+        其余丢弃（后面到达的字节时间不变），返回丢弃的字节数"""
+        dropped = 0
+        with self._cond:
+            kept = deque()
+            for seg in self._segments:
+                start, data, offset = seg
+                arrived = min(len(data), max(0, int((before - start) / self.byte_time))) - offset
+                if arrived <= capacity:
+                    capacity -= max(arrived, 0)
+                    kept.append(seg)
+                    continue
+                cut = offset + capacity
+                end = offset + arrived
+                if cut > offset:
+                    kept.append([start, data[:cut], offset])
+                if end < len(data):
+                    kept.append([start + end * self.byte_time, data[end:], 0])
+                dropped += end - cut
+                capacity = 0
+            self._segments = kept
+        return dropped
+
+    def _visible_at(self, seg, index):
+        """段内第index个字节（从0开始）对读取方可见的时间"""
+        last = min(len(seg[1]), (index // self.packet_size + 1) * self.packet_size)
+        return seg[0] + last * self.byte_time
+
+    def _arrived(self, seg, now):
+        count = min(len(seg[1]), int((now - seg[0]) / self.byte_time))
+        if self.packet_size > 1 and count < len(seg[1]):
+            count -= count % self.packet_size
+        return count - seg[2]
+
+    def peek(self, size):
+        """返回已到达但未读取的前size字节（不取走）"""
+        with self._cond:
+            now = time.monotonic()
+            out = bytearray()
+            for seg in self._segments:
+                arrived = self._arrived(seg, now)
+                if arrived <= 0:
+                    break
+                out += seg[1][seg[2]:seg[2] + min(arrived, size - len(out))]
+                if len(out) >= size or seg[2] + arrived < len(seg[1]):
+                    break
+            return bytes(out)
+
+    def in_waiting(self):
+        with self._cond:
+            now = time.monotonic()
+            total = 0
+            for seg in self._segments:
+                arrived = self._arrived(seg, now)
+                if arrived <= 0:
+                    break
+                total += arrived
+            return total
+
+    def _take(self, limit, now, stop=None):
+        out = bytearray()
+        while self._segments and len(out) < limit:
+            seg = self._segments[0]
+            avail = self._arrived(seg, now)
+            if avail <= 0:
+                break
+            take = min(avail, limit - len(out))
+            found = False
+            if stop is not None:
+                idx = seg[1].find(stop, seg[2], seg[2] + take)
+                if idx >= 0:
+                    take = idx - seg[2] + 1
+                    found = True
+            out += seg[1][seg[2]:seg[2] + take]
+            seg[2] += take
+            if seg[2] == len(seg[1]):
+                self._segments.popleft()
+            if found:
+                return out, True
+        return out, False
+
+    def _arrival_of(self, count):
+        """第count个未读字节的到达时间（数据尚未写入时返回None）"""
+        for seg in self._segments:
+            unread = len(seg[1]) - seg[2]
+            if count <= unread:
+                return self._visible_at(seg, seg[2] + count - 1)
+            count -= unread
+        return None
+
+    def _arrival_of_stop(self, stop):
+        for seg in self._segments:
+            idx = seg[1].find(stop, seg[2])
+            if idx >= 0:
+                return self._visible_at(seg, idx)
+        return None
+
+    def read(self, size, timeout, stop=None):
+        """读取size字节（或读到stop字节为止），超时或检测到break时返回已读到的部分"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        out = bytearray()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                piece, found = self._take(size - len(out), now, stop)
+                out += piece
+                if found or len(out) >= size:
+                    break
+                if deadline is not None and now >= deadline:
+                    break
+                if self._breaks and self._breaks[0] <= now:
+                    break
+                if stop is not None:
+                    ready_at = self._arrival_of_stop(stop)
+                    if ready_at is None:
+                        ready_at = self._arrival_of(size - len(out))
+                else:
+                    ready_at = self._arrival_of(size - len(out))
+                if self._breaks:
+                    ready_at = self._breaks[0] if ready_at is None else min(ready_at, self._breaks[0])
+                wait = None if ready_at is None else max(ready_at - now, 0.0001)
+                if deadline is not None:
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
+        return bytes(out)
+
+
+# ==================== 仿真开发板 ====================
+
+class SimulatedBoard:
+    """仿真开发板：运行固件状态机，状态在多次打开串口之间保持"""
+
+    def __init__(self, baudrate=DEFAULT_BAUD, rx_buffers=1, algorithm="hw_aes",
+                 crypto_rate=None, chunk_overhead=0.002, options=SUPPORTED_OPTIONS,
+                 ber=0.0, seed=None, rx_timeout=RX_TIMEOUT, rx_fifo=RX_FIFO_SIZE, rtscts=False,
+                 engines=None):
+        self.baudrate = baudrate
+        self.rx_timeout = rx_timeout
+        self.rx_fifo = rx_fifo
+        self.rtscts_wired = rtscts
+        self.flow_control = False  # 主机是否启用了RTS/CTS（需要rtscts_wired）
+        self.overruns = 0
+        self.rx_buffers = max(1, rx_buffers)
+        self.supported_options = options
+        self.session_options = 0
+        self.ber = ber
+        self.bit_errors = 0
+        self.frames_retransmitted = 0
+        self._rng = random.Random(seed)
+        self.engines = list(engines or [algorithm])  # 固件中包含的加密引擎
+        self._crypto_rate_override = crypto_rate
+        self.select_engine(algorithm if algorithm in self.engines else self.engines[0])
+        self.key_slots = {}  # 槽号 -> 已扩展的密钥（复位前一直保留）
+        self.key_setups = 0
+        self.aad_slots = {}  # 槽号 -> 已登记的AAD
+        self.chunk_overhead = chunk_overhead
+        self.host_to_board = _UartChannel(baudrate)
+        self.board_to_host = _UartChannel(baudrate, packet_size=USB_PACKET_SIZE)
+        self.sessions = 0
+        self._cpu_total = 0.0
+        self._cpu_lock = threading.Lock()
+        self._cpu_local = threading.local()
+        self._attached = threading.Event()
+        self._announce = threading.Event()
+        self._thread = threading.Thread(target=self._firmware_main, daemon=True)
+        self._thread.start()
+
+    @property
+    def cpu_seconds(self):
+        """仿真器线程消耗的CPU时间（用于从主机测量中扣除）"""
+        return self._cpu_total
+
+    def _account_cpu(self):
+        """累计当前线程自上次统计以来消耗的CPU时间"""
+        now = time.thread_time()
+        last = getattr(self._cpu_local, "last", 0.0)
+        self._cpu_local.last = now
+        with self._cpu_lock:
+            self._cpu_total += now - last
+
+    def attach(self, rtscts=False):
+        self.flow_control = rtscts and self.rtscts_wired
+        self.board_to_host.clear()
+        self._attached.set()
+        self._announce.set()
+
+    def detach(self):
+        self._attached.clear()
+
+    # ---------- 固件I/O ----------
+
+    def println(self, text):
+        """发送一行（阻塞到发送完成，与固件中的printf一致）"""
+        self.send_raw((text + "\r\n").encode())
+
+    def send_raw(self, data):
+        done_at = self.board_to_host.push(data)
+        delay = done_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def send_data_line(self, tag, text):
+        """发送数据行（B64/B64F），tag之后的内容受比特错误注入影响"""
+        self.send_raw(tag + self.corrupt(text.encode()) + b"\r\n")
+
+    def receive(self, size, timeout=None):
+        data = self.host_to_board.read(size, self.rx_timeout if timeout is None else timeout)
+        self.check_abort()
+        return data if len(data) == size else None
+
+    def check_abort(self):
+        """接收中断检测到break时（固件支持OPT_ABORT）中止当前会话"""
+        if self.host_to_board.take_break() and self.supported_options & OPT_ABORT:
+            raise _SessionAborted()
+
+    def receive_data(self, size, timeout=None):
+        """接收数据阶段的字节（受比特错误注入影响）"""
+        data = self.receive(size, timeout)
+        return None if data is None else self.corrupt(data)
+
+    def select_engine(self, algorithm):
+        """切换之后会话使用的加密引擎（固件中的全局模式标志）"""
+        self.algorithm = algorithm
+        self.crypto_rate = self._crypto_rate_override or ALGORITHMS[algorithm]["crypto_rate"]
+        self.key_setup = ALGORITHMS[algorithm]["key_setup"]
+
+    def check_overrun(self, since):
+        """接收缓冲区从since起才重新可用：之前到达的数据超出FIFO的部分丢失"""
+        if self.flow_control:
+            return
+        self.overruns += self.host_to_board.drop_overrun(self.rx_fifo, since)
+
+    def _expand_key(self, key):
+        """装入密钥：模拟密钥扩展的耗时，返回扩展结果"""
+        time.sleep(self.key_setup)
+        self.key_setups += 1
+        return key
+
+    def corrupt(self, data):
+        """按比特错误率随机翻转比特"""
+        if self.ber <= 0 or not data:
+            return data
+        nbits = len(data) * 8
+        pos = int(self._rng.expovariate(self.ber))
+        if pos >= nbits:
+            return data
+        buf = bytearray(data)
+        while pos < nbits:
+            buf[pos >> 3] ^= 1 << (pos & 7)
+            self.bit_errors += 1
+            pos += 1 + int(self._rng.expovariate(self.ber))
+        return bytes(buf)
+
+    def drain(self):
+        """丢弃接收缓冲区中的数据，直到线路空闲"""
+        while self.host_to_board.read(4096, DRAIN_IDLE):
+            pass
+
+    # ---------- 固件主循环 ----------
+
+    def _firmware_main(self):
+        last_ready = 0.0
+        while True:
+            self._account_cpu()
+            if self._announce.is_set() or time.monotonic() - last_ready >= READY_INTERVAL:
+                self._announce.clear()
+                if self._attached.is_set():
+                    self.println("READY")
+                last_ready = time.monotonic()
+            cmd = self.host_to_board.read(1, 0.05)
+            try:
+                self.check_abort()
+                if cmd:
+                    self._handle_command(cmd)
+            except _SessionAborted as e:
+                # 丢弃break之后仍在线路上的数据，报告已处理的块数并回到空闲状态
+                self.drain()
+                self.println(f"ABORTED: chunks={e.chunks}")
+                self._announce.set()
+
+    def _handle_command(self, cmd):
+        """空闲状态下的一条命令"""
+        if cmd == b'n':
+            self.sessions += 1
+            try:
+                self._stream_session()
+            finally:
+                self.session_options = 0
+                self._announce.set()
+        elif cmd == b'o' and self.supported_options:
+            mask = self.receive(4, 1)
+            if mask is not None:
+                self.session_options = struct.unpack('>I', mask)[0] & self.supported_options
+                self.println(f"OPTIONS:{self.session_options:08X}")
+        elif cmd == b'c' and self.supported_options:
+            self.println(self.capabilities_line())
+        elif cmd == b'p' and self.supported_options & OPT_PING:
+            # 校准：收完上行数据后应答下行长度的数据
+            request = self.receive(4, 1)
+            if request is None:
+                return
+            up, down = struct.unpack('>HH', request)
+            if up > PING_MAX or down > PING_MAX:
+                self.println("ERROR: Invalid ping")
+                return
+            if up and self.receive(up, 1 + 2 * up * self.host_to_board.byte_time) is None:
+                self.println("ERROR: Ping timeout")
+                return
+            self.println("PONG:" + base64.b64encode(bytes(down)).decode())
+        elif cmd == b'x' and self.supported_options & OPT_BENCH:
+            # 链路回显：按块接收，原样发回（不加解密）
+            header = self.receive(4, 1)
+            if header is None:
+                return
+            total = struct.unpack('>I', header)[0]
+            self.println(f"ECHO:{total}")
+            remaining = total
+            while remaining:
+                size = min(CHUNK_SIZE, remaining)
+                data = self.receive(size)
+                if data is None:
+                    self.println("ERROR: Echo timeout")
+                    return
+                self.send_raw(b"B64:" + base64.b64encode(data) + b"\r\n")
+                remaining -= size
+            self.println(f"ECHO_DONE: bytes={total}")
+        elif cmd == b'y' and self.supported_options & OPT_BENCH:
+            # 只加密：板上生成数据，用当前引擎加密，报告消耗的周期数
+            request = self.receive(6, 1)
+            if request is None:
+                return
+            chunks, size = struct.unpack('>IH', request)
+            if not 0 < size <= CHUNK_SIZE:
+                self.println("ERROR: Invalid chunk size")
+                return
+            key = self._expand_key(bytes(16))
+            seconds = chunks * (size / self.crypto_rate + self.chunk_overhead)
+            seal_chunk(key, bytes(16), b'', 0, bytes(size))
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                time.sleep(max(0.0, min(0.1, deadline - time.monotonic())))
+                self.check_abort()
+            self.println(f"CRYPTO_BENCH: chunks={chunks} bytes={chunks * size} "
+                         f"cycles={int((seconds + self.key_setup) * CPU_HZ)} cpu_hz={CPU_HZ}")
+        elif cmd == b'g' and len(self.engines) > 1:
+            # 切换加密引擎：1字节引擎号
+            engine_id = self.receive(1, 1)
+            if engine_id is None:
+                return
+            names = [name for name, i in ENGINE_IDS.items() if i == engine_id[0]]
+            if not names or names[0] not in self.engines:
+                self.println("ERROR: Engine not available")
+                return
+            self.select_engine(names[0])
+            self.println(f"ENGINE:{self.algorithm}")
+        elif cmd == b'k' and self.supported_options & OPT_KEY_SLOTS:
+            # 装入密钥槽：1字节槽号 + 16字节密钥
+            request = self.receive(17, 1)
+            if request is None:
+                return
+            if request[0] >= KEY_SLOTS:
+                self.println("ERROR: Invalid key slot")
+                return
+            self.key_slots[request[0]] = self._expand_key(request[1:])
+            self.println(f"KEY_SLOT:{request[0]}")
+        elif cmd == b'a' and self.supported_options & OPT_AAD_CACHE:
+            # 登记AAD：1字节槽号 + 4字节长度 + AAD
+            request = self.receive(5, 1)
+            if request is None:
+                return
+            slot, length = request[0], struct.unpack('>I', request[1:])[0]
+            if slot >= AAD_SLOTS or length > AAD_SLOT_SIZE:
+                self.println("ERROR: Invalid AAD slot")
+                return
+            aad = self.receive(length, 1 + 2 * length * self.host_to_board.byte_time)
+            if aad is None:
+                self.println("ERROR: AAD timeout")
+                return
+            self.aad_slots[slot] = aad
+            self.println(f"AAD_SLOT:{slot}")
+
+    def capabilities_line(self):
+        """能力查询的应答：CAPS: key=value ...（值中不含空格）"""
+        build = hashlib.sha256(f"{'+'.join(self.engines)}-{FIRMWARE_VERSION}".encode()).hexdigest()[:8]
+        fields = [
+            ("algorithm", self.algorithm),
+            ("version", FIRMWARE_VERSION),
+            ("build", build),
+            ("max_chunk", CHUNK_SIZE),
+            ("buffers", self.rx_buffers),
+            ("bauds", ",".join(str(b) for b in SUPPORTED_BAUDS)),
+            ("options", f"{self.supported_options:08X}"),
+            ("crypto_rate", self.crypto_rate),
+            ("key_slots", KEY_SLOTS if self.supported_options & OPT_KEY_SLOTS else 0),
+            ("aad_slots", AAD_SLOTS if self.supported_options & OPT_AAD_CACHE else 0),
+        ]
+        if len(self.engines) > 1:
+            fields.append(("engines", ",".join(self.engines)))
+        return "CAPS: " + " ".join(f"{k}={v}" for k, v in fields)
+
+    def _stream_session(self):
+        self.println("NEW_STREAM_MODE")
+        self.println("WAIT_OPERATION")
+        op = self.receive(1)
+        if op in (b'r', b'R') and not self.session_options & OPT_ROUND_TRIP or \
+                op in (b'v', b'V') and not self.session_options & OPT_TAG_VERIFY:
+            self.println("ERROR: Invalid operation")
+            return
+        if op in (b'E', b'D', b'R', b'V') and self.supported_options & OPT_KEY_SLOTS:
+            # 使用密钥槽中已扩展的密钥：操作码后紧跟1字节槽号，不再发送密钥
+            slot = self.receive(1)
+            if slot is None or slot[0] not in self.key_slots:
+                self.println(f"ERROR: Key slot {slot[0] if slot else '?'} empty")
+                return
+            key = self.key_slots[slot[0]]
+            op = op.lower()
+            self.println("ACK")
+        elif op in (b'e', b'd', b'r', b'v'):
+            self.println("ACK")
+            self.println("WAIT_KEY")
+            key = self.receive(16)
+            if key is None:
+                self.println("ERROR: Key timeout")
+                return
+            key = self._expand_key(key)
+            self.println("ACK")
+        else:
+            self.println("ERROR: Invalid operation")
+            return
+        self.println("WAIT_NONCE")
+        nonce = self.receive(16)
+        if nonce is None:
+            self.println("ERROR: Nonce timeout")
+            return
+        self.println("ACK")
+        self.println("WAIT_AAD_LEN")
+        header = self.receive(4)
+        if header is None:
+            self.println("ERROR: AAD length timeout")
+            return
+        aad_len = struct.unpack('>I', header)[0]
+        aad = b''
+        if aad_len & AAD_REF_FLAG and self.supported_options & OPT_AAD_CACHE:
+            # 引用已登记的AAD，不再接收AAD数据
+            slot = aad_len & 0xFF
+            if slot not in self.aad_slots:
+                self.println(f"ERROR: AAD slot {slot} empty")
+                return
+            aad = self.aad_slots[slot]
+            aad_len = 0
+        self.println("ACK")
+        if aad_len > 0:
+            self.println("WAIT_AAD")
+            aad = self.receive(aad_len)
+            if aad is None:
+                self.println("ERROR: AAD timeout")
+                return
+            self.println("ACK")
+        self.println("READY_FOR_DATA")
+        self._stream_data(op, key, nonce, aad)
+
+    def _read_frame(self, max_chunk):
+        """读取一个带序号和CRC的帧：返回 (长度字段, 序号, 数据)，
+        帧损坏返回None，等待帧头超时返回False"""
+        header = self.receive_data(8)
+        if header is None:
+            return False
+        length, seq = struct.unpack('>II', header)
+        if length in (NAK_MARKER, PING_MARKER):
+            data = b''
+        elif length > max_chunk:
+            return None
+        else:
+            data = self.receive_data(length, 0.1 + 2 * length * self.host_to_board.byte_time)
+            if data is None:
+                return None
+        crc = self.receive_data(4, 0.1)
+        if crc is None or struct.unpack('>I', crc)[0] != binascii.crc32(header + data):
+            return None
+        return length, seq, data
+
+    def _answer_ping(self, framed):
+        """等待空闲接收缓冲区时也应答保活ping（ping不占用接收缓冲区）"""
+        if not self.supported_options & OPT_PING:
+            return
+        size = 12 if framed else 4
+        head = self.host_to_board.peek(size)
+        if len(head) == size and struct.unpack('>I', head[:4])[0] == PING_MARKER:
+            self.host_to_board.read(size, 0)
+            self.println("PONG")
+
+    def _stream_data(self, op, key, nonce, aad):
+        """数据阶段：接收任务与加解密/发送任务通过rx_buffers个缓冲区衔接；
+        op 为 b'e' 加密、b'd' 解密、b'r' 往返校验（每块自带类型和块序号）、
+        b'v' 只校验标签；OPT_RECORDS 时加解密的每个块是一批记录，每条记录按会话中的
+        记录序号派生Nonce、单独带标签，输出同样是一批记录（解密失败的记录不中止会话）"""
+        framed = bool(self.session_options & OPT_FRAME_CRC)
+        indexed = bool(self.session_options & OPT_CHUNK_INDEX)
+        roundtrip = op == b'r'
+        tag_only = op == b'v'
+        records = bool(self.session_options & OPT_RECORDS) and op in (b'e', b'd')
+        verify_bits = []  # 只校验标签时尚未发送的位图（每块是否通过）
+        max_chunk = CHUNK_SIZE if op == b'e' else CHUNK_SIZE + TAG_SIZE
+        schedule = None  # 声明长度模式下预先算出的各块大小
+        if self.session_options & OPT_DECLARED_LENGTH:
+            header = self.receive(4)
+            if header is None:
+                self.println("ERROR: Size timeout")
+                return
+            total = struct.unpack('>I', header)[0]
+            schedule = [min(max_chunk, total - pos) for pos in range(0, total, max_chunk)]
+            self.println(f"SCHEDULE:{len(schedule)}")
+        # 声明长度模式下没有逐块的WAIT_CHUNK，总是用额度通告空闲缓冲区
+        credits = bool(self.session_options & OPT_CREDITS) or schedule is not None
+        max_frame = max_chunk + (4 if indexed else 0) + (5 if roundtrip else 0)
+        free_buffers = threading.Semaphore(self.rx_buffers)
+        freed_at = [time.monotonic()]  # 最近一次释放接收缓冲区的时间
+        work = queue.Queue()
+        sent_frames = deque(maxlen=RETX_FRAMES)  # (序号, 输出数据)
+        stats = {"chunks": 0, "bytes_in": 0, "bytes_out": 0, "failed": False, "passed": 0, "records": 0,
+                 "aborted": False, "cycles": 0, "chunk_cycles_min": 0, "chunk_cycles_max": 0,
+                 "buffers_hw": 0, "stall": 0.0, "idle": 0.0}
+        overruns_before = self.overruns
+        occupied = [0]  # 正在使用的接收缓冲区数量
+
+        def send_verify_bits():
+            # 位图：第i位对应第 首块+i 块，1表示标签正确
+            first = stats["chunks"] - len(verify_bits)
+            bits = sum(1 << i for i, ok in enumerate(verify_bits) if ok)
+            self.println(f"VBITS:{first}:{len(verify_bits)}:{bits:X}")
+            verify_bits.clear()
+
+        def send_output(seq, out):
+            if framed:
+                crc = binascii.crc32(struct.pack('>I', seq) + out)
+                self.send_data_line(b"B64F:", f"{seq}:{crc:08X}:" + base64.b64encode(out).decode())
+                self.println(f"CHUNK_PROCESSED:{seq}")
+            else:
+                self.send_data_line(b"B64:", base64.b64encode(out).decode())
+                self.println("CHUNK_PROCESSED")
+
+        def compute(seconds):
+            # 加解密耗时（仿真），按主频换算成周期数计入统计
+            time.sleep(seconds)
+            cycles = int(seconds * CPU_HZ)
+            stats["cycles"] += cycles
+            stats["chunk_cycles_min"] = min(stats["chunk_cycles_min"] or cycles, cycles)
+            stats["chunk_cycles_max"] = max(stats["chunk_cycles_max"], cycles)
+
+        def release_buffer():
+            freed_at[0] = time.monotonic()
+            occupied[0] -= 1
+            free_buffers.release()
+            if credits and not stats["failed"] and not stats["aborted"]:
+                self.println("CREDIT:1")
+
+        def worker():
+            idle_since = None  # 处理完上一块、开始等待下一块的时间
+            while True:
+                item = work.get()
+                if item is None:
+                    break
+                if idle_since is not None:
+                    stats["idle"] += time.monotonic() - idle_since
+                if stats["aborted"]:
+                    continue  # 中止：已接收但未处理的块丢弃
+                seq, index, data, encrypt = item
+                if records:
+                    # 每条记录用自己的记录序号派生Nonce；输出：2字节长度 + 密文和标签（或明文）
+                    compute(sum(len(r) + RECORD_SETUP_BYTES for r in data) / self.crypto_rate
+                            + self.chunk_overhead)
+                    results = []
+                    for record in data:
+                        index = stats["records"]
+                        stats["records"] += 1
+                        out = seal_chunk(key, nonce, aad, index, record) if encrypt else \
+                            open_chunk(key, nonce, aad, index, record)
+                        if out is None:
+                            results.append(struct.pack('>H', RECORD_FAILED))
+                        else:
+                            results.append(struct.pack('>H', len(out)) + out)
+                    out = b''.join(results)
+                    sent_frames.append((seq, out))
+                    send_output(seq, out)
+                    stats["chunks"] += 1
+                    stats["bytes_out"] += len(out)
+                    self._account_cpu()
+                    release_buffer()
+                    idle_since = time.monotonic()
+                    continue
+                compute(len(data) / self.crypto_rate + self.chunk_overhead)
+                if encrypt:
+                    out = seal_chunk(key, nonce, aad, index, data)
+                else:
+                    out = open_chunk(key, nonce, aad, index, data)
+                if tag_only:
+                    # 只记录标签是否正确，不返回明文，也不因标签错误中止
+                    verify_bits.append(out is not None)
+                    stats["chunks"] += 1
+                    stats["passed"] += out is not None
+                    if len(verify_bits) == VERIFY_BATCH:
+                        send_verify_bits()
+                    self._account_cpu()
+                    release_buffer()
+                    idle_since = time.monotonic()
+                    continue
+                if out is None:
+                    stats["failed"] = True
+                    self.println("ERROR: Authentication failed")
+                    release_buffer()
+                    break
+                sent_frames.append((seq, out))
+                send_output(seq, out)
+                stats["chunks"] += 1
+                stats["bytes_out"] += len(out)
+                self._account_cpu()
+                release_buffer()
+                idle_since = time.monotonic()
+            self._account_cpu()
+
+        worker_thread = threading.Thread(target=worker, daemon=True)
+        worker_thread.start()
+        expected = 0
+        if credits:
+            self.println(f"CREDIT:{self.rx_buffers}")
+        try:
+            while not stats["failed"]:
+                if schedule is not None and not framed and expected == len(schedule):
+                    break  # 已收到全部声明的数据，不需要结束标记
+                if not free_buffers.acquire(blocking=False):
+                    # 所有接收缓冲区都被占用：这段时间到达的数据只能进入UART FIFO
+                    stalled = time.monotonic()
+                    while not free_buffers.acquire(timeout=0.05):
+                        if stats["failed"]:
+                            return
+                        self.check_abort()
+                        self._answer_ping(framed)
+                    stats["stall"] += time.monotonic() - stalled
+                    self.check_overrun(freed_at[0])
+                occupied[0] += 1
+                stats["buffers_hw"] = max(stats["buffers_hw"], occupied[0])
+                if not credits:
+                    self.println(f"WAIT_CHUNK:{max_chunk}")
+                while True:
+                    if framed:
+                        frame = self._read_frame(max_frame)
+                        if frame is False:
+                            self.println("ERROR: Chunk header timeout")
+                            return
+                        if frame is None:
+                            # 帧损坏：清空接收缓冲区后请求从期望的序号开始重传
+                            self.drain()
+                            self.println(f"NAK:{expected}")
+                            continue
+                        size, seq, data = frame
+                        if size == PING_MARKER:
+                            self.println("PONG")
+                            continue
+                        if size == NAK_MARKER:
+                            # 主机请求重传输出帧
+                            for sent_seq, out in list(sent_frames):
+                                if sent_seq == seq:
+                                    self.frames_retransmitted += 1
+                                    send_output(sent_seq, out)
+                                    break
+                            else:
+                                self.println(f"ERROR: Frame {seq} not available")
+                                return
+                            continue
+                        if seq < expected:
+                            self.println(f"CHUNK_RECEIVED:{seq}")
+                            continue
+                        if seq > expected:
+                            continue
+                    else:
+                        if schedule is not None:
+                            # 块大小由声明的总长度决定，不带长度头
+                            size = schedule[expected] + (4 if indexed else 0)
+                        else:
+                            header = self.receive_data(4)
+                            if header is None:
+                                self.println("ERROR: Chunk header timeout")
+                                return
+                            size = struct.unpack('>I', header)[0]
+                            if size == PING_MARKER:
+                                self.println("PONG")
+                                continue
+                        if size > max_frame:
+                            self.println("ERROR: Chunk too large")
+                            return
+                        data = self.receive_data(size) if size else b''
+                        if data is None:
+                            self.println("ERROR: Chunk data timeout")
+                            return
+                        seq = expected
+                    break
+                expected += 1
+                if size == 0:
+                    break
+                index = seq
+                if indexed:
+                    if size < 4:
+                        self.println("ERROR: Missing chunk index")
+                        return
+                    index, data = struct.unpack('>I', data[:4])[0], data[4:]
+                encrypt = op == b'e'
+                if roundtrip:
+                    # 往返校验：1字节类型 + 4字节块序号
+                    if size < 5 or data[:1] not in (b'e', b'd'):
+                        self.println("ERROR: Invalid round-trip chunk")
+                        return
+                    encrypt = data[:1] == b'e'
+                    index, data = struct.unpack('>I', data[1:5])[0], data[5:]
+                stats["bytes_in"] += len(data)
+                if records:
+                    data = split_records(data)
+                    if data is None:
+                        self.println("ERROR: Invalid record batch")
+                        return
+                if framed:
+                    self.println(f"CHUNK_RECEIVED:{seq}")
+                elif not tag_only:
+                    self.println("CHUNK_RECEIVED")
+                work.put((seq, index, data, encrypt))
+                self._account_cpu()
+        except _SessionAborted:
+            stats["aborted"] = True
+        finally:
+            work.put(None)
+            worker_thread.join()
+        if stats["aborted"]:
+            # 正在处理的块已完成并发送，报告已处理的块数
+            raise _SessionAborted(stats["chunks"])
+        if stats["failed"]:
+            return
+        if tag_only:
+            if verify_bits:
+                send_verify_bits()
+            self.println(f"VERIFY_RESULT: chunks={stats['chunks']} passed={stats['passed']} "
+                         f"failed={stats['chunks'] - stats['passed']}")
+        self.println(f"STREAM_STATS: chunks={stats['chunks']} bytes_in={stats['bytes_in']} "
+                     f"bytes_out={stats['bytes_out']} cycles={stats['cycles']} "
+                     f"chunk_cycles_min={stats['chunk_cycles_min']} chunk_cycles_max={stats['chunk_cycles_max']} "
+                     f"cpu_hz={CPU_HZ} buffers={self.rx_buffers} buffers_hw={stats['buffers_hw']} "
+                     f"stall_cycles={int(stats['stall'] * CPU_HZ)} idle_cycles={int(stats['idle'] * CPU_HZ)} "
+                     f"overruns={self.overruns - overruns_before}")
+        self.println("END_OF_STREAM")
+        self.println("STREAM_COMPLETE")
+        self.println(f"SUMMARY: chunks={stats['chunks']} bytes_in={stats['bytes_in']} "
+                     f"bytes_out={stats['bytes_out']}" + (f" records={stats['records']}" if records else ""))
+
+
+# ==================== 仿真串口 ====================
+
+class SimulatedSerial:
+    """与 pyserial 的 serial.Serial 接口兼容的仿真串口"""
+
+    def __init__(self, board, timeout=None, write_timeout=None, rtscts=False):
+        self.board = board
+        self.port = "sim"
+        self.baudrate = board.baudrate
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = True
+        self._break_condition = False
+        board.attach(rtscts)
+
+    @property
+    def break_condition(self):
+        return self._break_condition
+
+    @break_condition.setter
+    def break_condition(self, value):
+        if value and not self._break_condition:
+            self.board.host_to_board.push_break()
+        self._break_condition = bool(value)
+
+    def send_break(self, duration=0.25):
+        self.break_condition = True
+        time.sleep(duration)
+        self.break_condition = False
+
+    @property
+    def in_waiting(self):
+        return self.board.board_to_host.in_waiting()
+
+    def read(self, size=1):
+        return self.board.board_to_host.read(size, self.timeout)
+
+    def readline(self, size=-1):
+        """与pyserial相同：逐字节read(1)直到换行（CPU开销也与真实串口一致）"""
+        line = bytearray()
+        while size is None or size < 0 or len(line) < size:
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+            if c == b'\n':
+                break
+        return bytes(line)
+
+    def write(self, data):
+        self.board.host_to_board.push(data)
+        return len(data)
+
+    def flush(self):
+        """等待已写入数据发送完成"""
+        delay = self.board.host_to_board.free_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reset_input_buffer(self):
+        self.board.board_to_host.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.board.detach()
+
+
+_boards = {}
+_boards_lock = threading.Lock()
+
+
+def get_board(url, baudrate=DEFAULT_BAUD):
+    """按端口URL获取（或创建）仿真开发板，例如 sim://board0?baud=921600&rx_buffers=2"""
+    with _boards_lock:
+        board = _boards.get(url)
+        if board is None:
+            params = {k: v[-1] for k, v in parse_qs(urlparse(url).query).items()}
+            board = SimulatedBoard(
+                baudrate=int(params.get("baud", baudrate)),
+                rx_buffers=int(params.get("rx_buffers", 1)),
+                algorithm=params.get("algorithm", "hw_aes"),
+                crypto_rate=float(params["crypto_rate"]) if "crypto_rate" in params else None,
+                chunk_overhead=float(params.get("chunk_overhead", 0.002)),
+                options=int(params.get("options", SUPPORTED_OPTIONS)),
+                rx_fifo=int(params.get("rx_fifo", RX_FIFO_SIZE)),
+                rtscts=params.get("rtscts", "0") not in ("0", "false", ""),
+                ber=float(params.get("ber", 0)),
+                seed=int(params["seed"]) if "seed" in params else None,
+                rx_timeout=float(params.get("rx_timeout", RX_TIMEOUT)),
+                engines=[e for e in params["engines"].split(",") if e] if "engines" in params else None,
+            )
+            _boards[url] = board
+        return board
+
+
+def open_simulated_port(url, baudrate=DEFAULT_BAUD, timeout=None, write_timeout=None, rtscts=False, **kwargs):
+    """打开仿真串口（参数与 serial.Serial 相同，多余参数忽略）"""
+    return SimulatedSerial(get_board(url, baudrate), timeout=timeout, write_timeout=write_timeout,
+                           rtscts=rtscts)
@@ -0,0 +1,32 @@
+"""
+测试共用的模块加载：上位机文件名有空格、benchmark.py 在测试结果目录中，都不能直接import
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(REPO_ROOT, "测试结果", "硬件AES、软件AES、软件Ascon测试")
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def transport():
+    """Serial File Transport.py"""
+    return _load("serial_file_transport", os.path.join(REPO_ROOT, "Serial File Transport.py"))
+
+
+@pytest.fixture(scope="session")
+def benchmark():
+    """测试结果/.../benchmark.py"""
+    return _load("gcm_siv_benchmark", os.path.join(BENCHMARK_DIR, "benchmark.py"))
@@ -0,0 +1,81 @@
+"""benchmark.py：确定性测试数据（generate_data）和测试活动配置（load_campaign）"""
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("kind", ["printable", "random", "zeros", "text"])
+def test_generate_data_is_deterministic_with_prefix_property(benchmark, kind):
+    size = benchmark.TEST_DATA_BLOCK + 5000      # 跨越计数器模式的块边界
+    data = benchmark.generate_data(size, 42, kind)
+    assert len(data) == size
+    assert benchmark.generate_data(size, 42, kind) == data
+    for n in (0, 1, 256, 4096, benchmark.TEST_DATA_BLOCK, benchmark.TEST_DATA_BLOCK + 1):
+        assert benchmark.generate_data(n, 42, kind) == data[:n]
+
+
+def test_generate_data_kinds(benchmark):
+    printable = benchmark.generate_data(65536, 42, "printable")
+    assert set(printable) <= set(benchmark.PRINTABLE_CHARS)
+    assert len(set(printable)) == len(benchmark.PRINTABLE_CHARS)
+    assert benchmark.generate_data(1000, 42, "zeros") == bytes(1000)
+    assert len(set(benchmark.generate_data(65536, 42, "random"))) == 256
+    text = benchmark.generate_data(4096, 42, "text")
+    assert set(text.split()) - {b""} <= {w.encode() + s for w in benchmark.TEXT_WORDS for s in (b"", b".")}
+
+
+def test_generate_data_seed_changes_output(benchmark):
+    assert benchmark.generate_data(4096, 42, "random") != benchmark.generate_data(4096, 43, "random")
+
+
+def test_generate_data_unknown_kind(benchmark):
+    with pytest.raises(ValueError):
+        benchmark.generate_data(10, 42, "binary")
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    def write(config):
+        path = tmp_path / "campaign.json"
+        path.write_text(json.dumps(config), encoding="utf-8")
+        return str(path)
+    return write
+
+
+def test_load_campaign_defaults(benchmark, config_file):
+    config = benchmark.load_campaign(config_file({"ports": ["COM3", {"port": "COM4", "algorithm": "sw_ascon"}]}))
+    assert config["ports"] == [{"port": "COM3"}, {"port": "COM4", "algorithm": "sw_ascon"}]
+    assert config["algorithms"] == [] and config["sizes"] == []
+    assert config["iterations"] is None and config["time_budget"] is None
+    assert config["max_retries"] == benchmark.MAX_RETRIES
+    assert config["data_kind"] == "printable"
+
+
+@pytest.mark.parametrize("config", [
+    {},
+    {"ports": []},
+    {"ports": ["COM3"], "algorithms": ["aes_ctr"]},
+    {"ports": ["COM3"], "data_kind": "binary"},
+])
+def test_load_campaign_rejects_invalid(benchmark, config_file, config):
+    with pytest.raises(ValueError):
+        benchmark.load_campaign(config_file(config))
+
+
+def test_select_sizes(benchmark, tmp_path):
+    runner = benchmark.BenchmarkRunner("sim://unused", "t", str(tmp_path))
+    benchmark._select_sizes(runner, ["256B", "200KB", 3000, 300 * 1024, "16MB"], 2)
+    # 小文件阶段的第1次迭代只作预热，多运行一次
+    assert runner.small_files == [("256B", 256, 3), ("3000B", 3000, 3)]
+    assert runner.medium_files == [("200KB", 200 * 1024, 2)]
+    assert runner.large_files == [("307200B", 300 * 1024, 2), ("16MB", 16 * 1024 * 1024, 2)]
+    with pytest.raises(ValueError):
+        benchmark._select_sizes(runner, ["3GB"], None)
+
+
+def test_select_sizes_default_iterations_record_custom_sizes(benchmark, tmp_path):
+    # iterations 为 null 时，小文件阶段的自定义大小也要在预热之外至少记录一次迭代
+    runner = benchmark.BenchmarkRunner("sim://unused", "t", str(tmp_path))
+    benchmark._select_sizes(runner, [3000, 300 * 1024], None)
+    assert runner.small_files == [("3000B", 3000, 2)]
+    assert runner.large_files == [("307200B", 300 * 1024, 1)]
@@ -0,0 +1,87 @@
+"""主机端缓存：AAD槽LRU（AadCache）和密文块缓存（ChunkCache）"""
+import pytest
+
+
+def test_aad_cache_assigns_slots_then_evicts_lru(transport):
+    cache = transport.AadCache(capacity=2)
+    a, b, c = b"A" * 100, b"B" * 100, b"C" * 100
+    assert cache.lookup(a) == (0, False)
+    cache.store(a, 0)
+    assert cache.lookup(b) == (1, False)
+    cache.store(b, 1)
+    assert cache.lookup(a) == (0, True)     # a 变为最近使用
+    assert cache.lookup(c) == (1, False)    # 淘汰最久未用的 b，沿用它的槽号
+    cache.store(c, 1)
+    assert cache.lookup(b) == (0, False)    # 再淘汰 a
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_aad_cache_discard_and_clear(transport):
+    cache = transport.AadCache(capacity=4)
+    cache.store(b"x", 2)
+    cache.store(b"y", 3)
+    cache.discard(2)
+    assert cache.lookup(b"x")[1] is False
+    assert cache.lookup(b"y") == (3, True)
+    cache.clear()
+    assert cache.lookup(b"y")[1] is False
+
+
+def test_aad_cache_failed_registration_returns_slot(transport):
+    cache = transport.AadCache(capacity=4)
+    aads = [bytes([65 + i]) * 100 for i in range(6)]
+    for i in range(4):
+        slot, _ = cache.lookup(aads[i])
+        cache.store(aads[i], slot)
+    slot, cached = cache.lookup(aads[4])      # 缓存已满：淘汰 aads[0] 的槽 0
+    assert (slot, cached) == (0, False)
+    cache.release(slot)                       # 'a' 登记失败
+    slot, cached = cache.lookup(aads[5])      # 必须重用槽 0，而不是仍被 aads[3] 占用的槽 3
+    assert (slot, cached) == (0, False)
+    cache.store(aads[5], slot)
+    assert sorted(cache.slots.values()) == [0, 1, 2, 3]
+    for i in (1, 2, 3):
+        assert cache.lookup(aads[i]) == (i, True)
+
+
+@pytest.fixture
+def chunk_cache(transport, tmp_path):
+    cache = transport.ChunkCache(str(tmp_path / "cache.sqlite3"), max_bytes=300)
+    yield cache
+    cache.close()
+
+
+def test_chunk_id_depends_on_every_key_part(transport):
+    key_id = transport.ChunkCache.key_id(b"k" * 16)
+    assert b"k" * 16 not in key_id
+    base = (key_id, b"n" * 16, 0, b"h" * 32, b"plaintext")
+    ids = {transport.ChunkCache.chunk_id(*base)}
+    for i, changed in enumerate([transport.ChunkCache.key_id(b"j" * 16), b"m" * 16, 1, b"g" * 32, b"plaintexT"]):
+        parts = list(base)
+        parts[i] = changed
+        ids.add(transport.ChunkCache.chunk_id(*parts))
+    assert len(ids) == 6
+    assert transport.ChunkCache.chunk_id(*base) in ids
+
+
+def test_chunk_cache_evicts_least_recently_used(chunk_cache):
+    for name in (b"a", b"b", b"c"):
+        chunk_cache.put(name, name * 100)
+    assert chunk_cache.get(b"a") == b"a" * 100   # a 变为最近使用
+    chunk_cache.put(b"d", b"d" * 100)            # 超过300字节，淘汰 b
+    assert chunk_cache.get(b"b") is None
+    assert [chunk_cache.get(n) for n in (b"a", b"c", b"d")] == [b"a" * 100, b"c" * 100, b"d" * 100]
+    assert chunk_cache.total_bytes == 300
+    assert (chunk_cache.hits, chunk_cache.misses) == (4, 1)
+
+
+def test_chunk_cache_persists(transport, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = transport.ChunkCache(path)
+    cache.put(b"id", b"ciphertext")
+    cache.put(b"id", b"ciphertext")  # 覆盖同一块不重复计算大小
+    cache.close()
+    cache = transport.ChunkCache(path)
+    assert cache.total_bytes == len(b"ciphertext")
+    assert cache.get(b"id") == b"ciphertext"
+    cache.close()
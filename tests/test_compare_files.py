@@ -0,0 +1,102 @@
+"""分块文件比较（transport_common.compare_files）：第一个差异、差异字节数和受影响的协议块"""
+import random
+
+import pytest
+
+import transport_common
+
+
+@pytest.fixture
+def write(tmp_path):
+    def write(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def reference(a, b, chunk_size, offset):
+    """逐字节的参考实现"""
+    common = min(len(a), len(b))
+    diffs = [i for i in range(common) if a[i] != b[i]]
+    first = diffs[0] if diffs else (common if len(a) != len(b) else None)
+    chunks = {(i - offset) // chunk_size for i in diffs if i >= offset}
+    if len(a) != len(b):
+        chunks |= set(range(max((common - offset) // chunk_size, 0),
+                            (max(len(a), len(b)) - offset - 1) // chunk_size + 1))
+    return first, len(diffs), sorted(chunks)
+
+
+def test_identical(write):
+    data = bytes(range(256)) * 40
+    report = transport_common.compare_files(write("a", data), write("b", data), 1024)
+    assert report["identical"] and report["first_diff"] is None and report["chunks"] == []
+
+
+def test_empty_files(write):
+    assert transport_common.compare_files(write("a", b""), write("b", b""), 1024)["identical"]
+    report = transport_common.compare_files(write("a", b""), write("c", b"x" * 1500), 1024)
+    assert (report["first_diff"], report["chunks"]) == (0, [0, 1])
+
+
+def test_flipped_bytes_map_to_chunks(write):
+    data = bytearray(10 * 1024)
+    changed = bytearray(data)
+    for pos in (5, 6, 4096, 10 * 1024 - 1):
+        changed[pos] ^= 0xFF
+    report = transport_common.compare_files(write("a", bytes(data)), write("b", bytes(changed)), 1024)
+    assert report["first_diff"] == 5
+    assert report["differences"] == 4
+    assert report["chunks"] == [0, 4, 9]
+
+
+def test_truncated_tail(write):
+    data = bytes(5000)
+    report = transport_common.compare_files(write("a", data), write("b", data[:3000]), 1024)
+    assert report["first_diff"] == 3000 and report["differences"] == 0
+    assert report["chunks"] == [2, 3, 4]   # 块2只剩一部分，块3、4缺失
+
+
+def test_extended_tail_at_chunk_boundary(write):
+    data = bytes(2048)
+    report = transport_common.compare_files(write("a", data), write("b", data + b"x"), 1024)
+    assert report["first_diff"] == 2048 and report["chunks"] == [2]
+
+
+def test_encrypted_layout_offset(write):
+    """加密文件：16字节Nonce头之后是 CHUNK_SIZE+16 字节的块"""
+    size = 1024 + 16
+    data = bytes(16 + 3 * size)
+    changed = bytearray(data)
+    changed[16 + size + 3] = 1          # 第1块
+    report = transport_common.compare_files(write("a", data), write("b", bytes(changed)), size, offset=16)
+    assert report["chunks"] == [1] and not report["header_differs"]
+    changed[2] = 1                      # Nonce头
+    report = transport_common.compare_files(write("a", data), write("b", bytes(changed)), size, offset=16)
+    assert report["header_differs"] and report["first_diff"] == 2 and report["chunks"] == [1]
+
+
+@pytest.mark.parametrize("block_chunks", [1, 3, 1024])
+def test_random_cases_match_reference(write, monkeypatch, block_chunks):
+    monkeypatch.setattr(transport_common, "COMPARE_BLOCK_CHUNKS", block_chunks)
+    rng = random.Random(block_chunks)
+    for _ in range(100):
+        chunk_size, offset = rng.choice([4, 7, 16]), rng.choice([0, 3])
+        a = bytes(rng.randrange(256) for _ in range(rng.randrange(200)))
+        b = bytearray(a)
+        for _ in range(rng.randrange(4)):
+            if b:
+                b[rng.randrange(len(b))] ^= 1 << rng.randrange(8)
+        if rng.random() < 0.3:
+            b = b[:rng.randrange(len(b) + 1)]
+        if rng.random() < 0.2:
+            b += b"xy"
+        report = transport_common.compare_files(write("a", a), write("b", bytes(b)), chunk_size, offset)
+        assert (report["first_diff"], report["differences"], report["chunks"]) == \
+            reference(a, bytes(b), chunk_size, offset)
+        assert report["identical"] == (a == bytes(b))
+
+
+def test_format_chunk_ranges():
+    assert transport_common.format_chunk_ranges([1, 2, 3, 5, 9, 10]) == "1-3, 5, 9-10"
+    assert transport_common.format_chunk_ranges(list(range(0, 40, 2)), limit=2) == "0, 2, ... (18 more ranges)"
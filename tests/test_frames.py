@@ -0,0 +1,89 @@
+"""帧校验：B64F 行解析（SerialLink.parse_frame_line）和损坏帧的NAK选择性重传"""
+import base64
+import binascii
+import contextlib
+import io
+import struct
+
+import pytest
+
+import mcu_simulator
+
+
+def frame_line(seq, data, crc=None):
+    if crc is None:
+        crc = binascii.crc32(struct.pack('>I', seq) + data)
+    return memoryview(b"B64F:%d:%08x:" % (seq, crc) + base64.b64encode(data))
+
+
+def test_valid_frame(transport):
+    assert transport.SerialLink.parse_frame_line(frame_line(7, b"chunk data")) == (7, b"chunk data")
+
+
+def test_crc_error_keeps_sequence_number(transport):
+    line = frame_line(3, b"chunk data", crc=0x12345678)
+    assert transport.SerialLink.parse_frame_line(line) == (3, None)
+
+
+def test_crc_covers_sequence_number(transport):
+    # 帧内容正确但序号被改动：CRC不匹配，不能当作另一块的数据
+    good = bytes(frame_line(3, b"chunk data"))
+    assert transport.SerialLink.parse_frame_line(memoryview(good.replace(b"B64F:3:", b"B64F:4:"))) == (4, None)
+
+
+@pytest.mark.parametrize("line", [
+    b"B64F:", b"B64F:12345", b"B64F::1:aGk=", b"B64F:5::aGk=", b"B64F:-5:00:aGk=",
+    b"B64F:1_0:1:aGk=", b"B64F: 1:1:aGk=", b"B64F:5:zz:aGk=", b"B64F:5:1 :aGk=",
+    b"B64F:7:123456789:aGk=", b"B64F:99999999999:1:aGk=", b"B64F:\xff\xfe:1:x",
+])
+def test_malformed_header_is_a_corrupted_frame(transport, line):
+    assert transport.SerialLink.parse_frame_line(memoryview(line)) == (None, None)
+
+
+def test_corrupted_frames_are_retransmitted(transport, tmp_path):
+    """有比特错误时帧校验模式只重传损坏的帧，结果与仿真器的参考密文完全相同"""
+    key, nonce = bytes(range(1, 17)), bytes(range(0x40, 0x50))
+    data = bytes(range(256)) * 64
+    chunk = transport.CHUNK_SIZE
+    expected = nonce + b"".join(mcu_simulator.seal_chunk(key, nonce, b'', i, data[pos:pos + chunk])
+                                for i, pos in enumerate(range(0, len(data), chunk)))
+    (tmp_path / "in.bin").write_bytes(data)
+    processor = transport.GCM_SIV_FileProcessor(
+        "sim://pytest-frames?baud=2000000&rx_buffers=2&ber=1e-4&seed=7&rx_timeout=2",
+        frame_crc=True, show_progress=False)
+    processor.set_custom_parameters(key=key, nonce=nonce)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = processor.encrypt_file(str(tmp_path / "in.bin"), str(tmp_path / "out.bin"))
+    assert ok
+    assert (tmp_path / "out.bin").read_bytes() == expected
+    assert processor.frames_resent + processor.frames_nak_requested > 0
+
+
+@pytest.mark.parametrize("fake_seq", ["93", "4"])
+def test_corrupted_sequence_number_is_not_trusted(transport, tmp_path, monkeypatch, fake_seq):
+    """序号字段损坏的帧CRC失败：不能按损坏的序号请求重传（MCU没有发送过该帧时会中止会话），
+    由CHUNK_PROCESSED的缺帧检测请求真正缺失的帧"""
+    key, nonce = bytes(range(1, 17)), bytes(range(0x40, 0x50))
+    data = bytes(range(256)) * 64
+    chunk = transport.CHUNK_SIZE
+    expected = nonce + b"".join(mcu_simulator.seal_chunk(key, nonce, b'', i, data[pos:pos + chunk])
+                                for i, pos in enumerate(range(0, len(data), chunk)))
+    send_data_line = mcu_simulator.SimulatedBoard.send_data_line
+    corrupted = []
+
+    def corrupt_seq(board, tag, text):
+        if tag == b"B64F:" and text.startswith("3:") and not corrupted:
+            corrupted.append(text)
+            text = fake_seq + text[1:]
+        return send_data_line(board, tag, text)
+
+    monkeypatch.setattr(mcu_simulator.SimulatedBoard, "send_data_line", corrupt_seq)
+    (tmp_path / "in.bin").write_bytes(data)
+    processor = transport.GCM_SIV_FileProcessor(
+        f"sim://pytest-seq-{fake_seq}?baud=2000000&rx_buffers=2", frame_crc=True, show_progress=False)
+    processor.set_custom_parameters(key=key, nonce=nonce)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = processor.encrypt_file(str(tmp_path / "in.bin"), str(tmp_path / "out.bin"))
+    assert corrupted and ok
+    assert (tmp_path / "out.bin").read_bytes() == expected
+    assert processor.frames_nak_requested >= 1
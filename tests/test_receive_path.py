@@ -0,0 +1,60 @@
+"""接收路径：预分配缓冲区切行（RxRingBuffer）和直接从字节解码Base64（decode_b64_payload）"""
+import base64
+
+
+def pop_all(ring):
+    lines = []
+    while True:
+        line = ring.pop_line()
+        if line is None:
+            return lines
+        lines.append(bytes(line))
+
+
+def test_lines_split_across_feeds(transport):
+    ring = transport.RxRingBuffer(64)
+    ring.feed(b"READY\r\nWAIT_")
+    assert pop_all(ring) == [b"READY"]
+    ring.feed(b"CHUNK\r")
+    assert ring.pop_line() is None
+    ring.feed(b"\nB64:aGk=\n\r\n")
+    assert pop_all(ring) == [b"WAIT_CHUNK", b"B64:aGk=", b""]
+
+
+def test_wraparound_keeps_pending_data(transport):
+    ring = transport.RxRingBuffer(16)
+    received = []
+    expected = [f"LINE{i:03d}".encode() for i in range(50)]
+    stream = b"".join(line + b"\r\n" for line in expected)
+    # 每次5字节：行在缓冲区末尾被截断，之后需要把未消费部分移回开头
+    for pos in range(0, len(stream), 5):
+        ring.feed(stream[pos:pos + 5])
+        received += pop_all(ring)
+    assert received == expected
+    assert len(ring.buf) == 16
+
+
+def test_line_longer_than_buffer_grows_it(transport):
+    ring = transport.RxRingBuffer(16)
+    ring.feed(b"x" * 10)
+    ring.feed(b"y" * 30 + b"\n")
+    assert pop_all(ring) == [b"x" * 10 + b"y" * 30]
+
+
+def test_decode_fast_path(transport):
+    data = bytes(range(256))
+    encoded = base64.b64encode(data)
+    assert transport.decode_b64_payload(encoded + b"\r") == data
+    assert transport.decode_b64_payload(memoryview(b"B64:" + encoded)[4:]) == data
+
+
+def test_decode_fallback_repads(transport):
+    # 缺少填充时 a2b_base64 失败，清理后补齐再解码
+    assert transport.decode_b64_payload(b"aGVsbG8") == b"hello"
+    assert transport.decode_b64_payload(b"aGVs bG8\r") == b"hello"
+
+
+def test_decode_undecodable_returns_none(transport):
+    # 截断后剩余的数据字符数除以4余1，补齐也无法解码
+    assert transport.decode_b64_payload(b"a") is None
+    assert transport.decode_b64_payload(b"aGVsbG8x2\r") is None
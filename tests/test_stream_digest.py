@@ -0,0 +1,31 @@
+"""边传输边计算的摘要（StreamDigest）：乱序到达的块按序号累加"""
+import hashlib
+
+import pytest
+
+
+def test_out_of_order_chunks_hash_in_sequence(transport):
+    chunks = [bytes([i]) * (10 + i) for i in range(6)]
+    digest = transport.StreamDigest(b"nonce")
+    for seq in (2, 0, 1, 5, 3, 4):
+        digest.update(seq, chunks[seq])
+    assert digest.hexdigest() == hashlib.sha256(b"nonce" + b"".join(chunks)).hexdigest()
+    assert digest.length == len(b"nonce") + sum(map(len, chunks))
+
+
+def test_missing_chunk_is_reported(transport):
+    digest = transport.StreamDigest()
+    digest.update(0, b"a")
+    digest.update(2, b"c")
+    with pytest.raises(ValueError, match="before 2"):
+        digest.hexdigest()
+    digest.update(1, b"b")
+    assert digest.hexdigest() == hashlib.sha256(b"abc").hexdigest()
+
+
+def test_retransmitted_chunk_counted_once(transport):
+    digest = transport.StreamDigest()
+    digest.update(1, b"b")
+    digest.update(1, b"b")
+    digest.update(0, b"a")
+    assert digest.hexdigest() == hashlib.sha256(b"ab").hexdigest()
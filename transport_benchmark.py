@@ -0,0 +1,556 @@
+"""
+上位机传输层性能测量（基于 mcu_simulator.py，不需要开发板）
+
+对比对象：
+- baseline：archive 中的流式模式上位机（单线程，收发交替）
+- threaded：当前上位机（读写线程全双工）
+
+每个用例报告加密+解密的墙钟时间、吞吐量，以及主机每MB消耗的CPU时间
+（已扣除仿真器线程的CPU时间）。
+
+--decode 只运行接收路径的微基准：对比逐行 readline().decode().strip() +
+safe_base64_decode 与 预分配缓冲区 + binascii 直接解码 的每MB耗时。
+
+--ber 测量有比特错误时的有效吞吐量（goodput）：基本协议出错后只能整个文件
+重传（每次重试换一块仿真板，相当于复位开发板），帧校验模式（OPT_FRAME_CRC）
+只重传损坏的帧。加密结果与仿真器的参考密文逐字节比较。
+
+--flow 验证接收缓冲区有限时的流控：不等待额度直接连续发送（greedy，
+可选RTS/CTS）与基于额度的流控（credits）对比溢出字节数和结果是否正确。
+
+--keyslots 同一密钥下连续加密多个小文件：每次会话发送密钥 与 使用板上密钥槽
+（KeyHandle）对比每次会话耗时、密钥经过串口的次数和MCU装入密钥的次数。
+
+--aad 多个文件轮流使用几种较大的AAD：每次会话发送AAD 与 AAD槽缓存对比每次
+会话耗时、主机发送的字节数和缓存命中率。
+
+--cache 模拟每晚备份：同一文件（固定Nonce）先冷缓存加密一次，再修改一部分块后
+用密文块缓存重新加密，报告耗时、命中率和节省的链路时间。
+
+--update 加密一次（写出清单）后修改连续的一段数据，对比增量更新 update_file
+与重新加密整个文件的耗时，并解密验证。
+
+--records 大量短消息：每条消息一次 encrypt_file 会话 与 记录模式 encrypt_records
+（一个会话，成批发送，每条记录单独派生Nonce、带标签）对比每秒记录数，
+--sizes 为记录大小。
+
+用法：python transport_benchmark.py [--baud 921600] [--sizes 1048576,4194304] [--decode]
+      python transport_benchmark.py --ber 0,1e-6,1e-5,3e-5 [--sizes 131072]
+      python transport_benchmark.py --flow [--baud 2000000] [--sizes 131072]
+      python transport_benchmark.py --keyslots [--baud 115200] [--sizes 1024] [--sessions 20]
+      python transport_benchmark.py --aad [--baud 115200] [--sizes 1024] [--sessions 20]
+      python transport_benchmark.py --cache [--baud 115200] [--sizes 65536]
+      python transport_benchmark.py --update [--baud 921600] [--sizes 1048576]
+      python transport_benchmark.py --records [--baud 115200] [--sizes 16,64,256,512] [--count 2000]
+"""
+import argparse
+import base64
+import contextlib
+import importlib.util
+import io
+import os
+import random
+import struct
+import tempfile
+import time
+import types
+
+import mcu_simulator
+
+CLIENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Serial File Transport.py")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive",
+                             "硬件AES-GCM-SIV实现（流式模式，不需要知道总文件大小）",
+                             "Serial File Transport.py")
+
+
+def load_current_client():
+    """加载当前上位机（Serial File Transport.py，文件名有空格，不能直接import）"""
+    spec = importlib.util.spec_from_file_location("serial_file_transport", CLIENT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+current_client = load_current_client()
+
+
+def load_baseline_client():
+    """加载归档的单线程流式上位机，并让它通过仿真器打开串口"""
+    spec = importlib.util.spec_from_file_location("baseline_transport", BASELINE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.serial = types.SimpleNamespace(
+        Serial=lambda port, baudrate, **kwargs: mcu_simulator.open_simulated_port(port, baudrate, **kwargs))
+    return module
+
+
+def run_case(client_module, port, size, workdir):
+    """在一个仿真端口上运行一次加密+解密，返回测量结果"""
+    data = os.urandom(size)
+    input_file = os.path.join(workdir, "input.bin")
+    encrypted_file = os.path.join(workdir, "encrypted.bin")
+    output_file = os.path.join(workdir, "output.bin")
+    with open(input_file, 'wb') as f:
+        f.write(data)
+
+    board = mcu_simulator.get_board(port)
+    processor = client_module.GCM_SIV_FileProcessor(port)
+    cpu_start = time.process_time()
+    board_cpu_start = board.cpu_seconds
+    wall_start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = processor.encrypt_file(input_file, encrypted_file)
+        ok = ok and processor.decrypt_file(encrypted_file, output_file)
+    wall = time.perf_counter() - wall_start
+    host_cpu = (time.process_time() - cpu_start) - (board.cpu_seconds - board_cpu_start)
+
+    if ok:
+        with open(output_file, 'rb') as f:
+            ok = f.read() == data
+    megabytes = size / (1024 * 1024)
+    return {
+        "ok": ok,
+        "wall": wall,
+        "throughput": 2 * size / wall if wall > 0 else 0,  # 加密+解密的明文字节
+        "cpu_per_mb": host_cpu / (2 * megabytes) if megabytes > 0 else 0,
+    }
+
+
+BER_KEY = bytes(range(1, 17))
+BER_NONCE = bytes(range(0x40, 0x50))
+BER_MAX_ATTEMPTS = 10
+
+
+def reference_ciphertext(data):
+    """仿真器对 data 的加密结果（nonce + 各块密文），用于判断传输是否正确"""
+    chunks = [mcu_simulator.seal_chunk(BER_KEY, BER_NONCE, b'', i, data[pos:pos + current_client.CHUNK_SIZE])
+              for i, pos in enumerate(range(0, len(data), current_client.CHUNK_SIZE))]
+    return BER_NONCE + b''.join(chunks)
+
+
+def run_ber_case(ber, size, baud, frame_crc, workdir, seed=1):
+    """在给定比特错误率下加密一个文件，失败或结果错误时整个文件重试；
+    返回 (goodput 字节/秒, 尝试次数, 是否最终成功)"""
+    data = os.urandom(size)
+    expected = reference_ciphertext(data)
+    input_file = os.path.join(workdir, "ber_input.bin")
+    output_file = os.path.join(workdir, "ber_output.bin")
+    with open(input_file, 'wb') as f:
+        f.write(data)
+
+    mode = "framed" if frame_crc else "basic"
+    wall_start = time.perf_counter()
+    for attempt in range(1, BER_MAX_ATTEMPTS + 1):
+        # 每次尝试使用新的仿真板（相当于复位开发板后重新开始）
+        port = (f"sim://ber-{mode}-{ber}-{size}-{attempt}?baud={baud}&rx_buffers=2"
+                f"&ber={ber}&seed={seed * 1000 + attempt}&rx_timeout=2")
+        processor = current_client.GCM_SIV_FileProcessor(port, frame_crc=frame_crc)
+        processor.set_custom_parameters(key=BER_KEY, nonce=BER_NONCE)
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ok = processor.encrypt_file(input_file, output_file)
+        if ok and os.path.exists(output_file):
+            with open(output_file, 'rb') as f:
+                if f.read() == expected:
+                    wall = time.perf_counter() - wall_start
+                    return size / wall, attempt, True
+    wall = time.perf_counter() - wall_start
+    return 0.0, BER_MAX_ATTEMPTS, False
+
+
+def ber_benchmark(bers, sizes, baud):
+    """比较基本协议（整文件重传）与帧校验模式（选择性重传）的goodput"""
+    # 缩短超时，避免基本协议在帧头损坏后长时间等待
+    saved = current_client.STREAM_EVENT_TIMEOUT, current_client.SUMMARY_TIMEOUT
+    current_client.STREAM_EVENT_TIMEOUT, current_client.SUMMARY_TIMEOUT = 3, 1
+    try:
+        print(f"{'BER':>8} {'size':>8} {'mode':<7} {'goodput KB/s':>13} {'attempts':>9}  ok")
+        print("-" * 55)
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in sizes:
+                for ber in bers:
+                    for frame_crc in (False, True):
+                        goodput, attempts, ok = run_ber_case(ber, size, baud, frame_crc, workdir)
+                        print(f"{ber:>8g} {size:>8} {'framed' if frame_crc else 'basic':<7} "
+                              f"{goodput / 1024:>13.1f} {attempts:>9}  {'✓' if ok else '✗'}")
+    finally:
+        current_client.STREAM_EVENT_TIMEOUT, current_client.SUMMARY_TIMEOUT = saved
+
+
+def greedy_encrypt(port, data, rtscts):
+    """握手后不等待WAIT_CHUNK，一次写入所有数据块（"写了再说"），返回加密结果"""
+    processor = current_client.GCM_SIV_FileProcessor(port, credit_flow=False, rtscts=rtscts)
+    processor.set_custom_parameters(key=BER_KEY, nonce=BER_NONCE)
+    outputs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not processor.connect():
+            return None
+        try:
+            # 下面自己构造带长度头的块，不能使用声明长度模式
+            if not processor._start_stream_session(b'e', BER_KEY, BER_NONCE, b'', sized=False):
+                return None
+            chunk_size = current_client.CHUNK_SIZE
+            frames = [struct.pack('>I', len(data[pos:pos + chunk_size])) + data[pos:pos + chunk_size]
+                      for pos in range(0, len(data), chunk_size)]
+            link = current_client.SerialLink(processor.ser)
+            link.start()
+            try:
+                link.send(b''.join(frames) + struct.pack('>I', 0))
+                while True:
+                    event = link.get(3)
+                    if event is None or event[0] == 'ERROR':
+                        break
+                    kind, payload = event
+                    if kind == 'B64' and payload:
+                        outputs.append(payload)
+                    elif kind == 'LINE' and ('STREAM_COMPLETE' in payload or 'ERROR' in payload):
+                        break
+            finally:
+                link.stop()
+        finally:
+            processor.disconnect()
+    return BER_NONCE + b''.join(outputs)
+
+
+def credit_encrypt(port, data, workdir):
+    """用当前上位机（OPT_CREDITS）加密，返回加密结果"""
+    input_file = os.path.join(workdir, "flow_input.bin")
+    output_file = os.path.join(workdir, "flow_output.bin")
+    with open(input_file, 'wb') as f:
+        f.write(data)
+    processor = current_client.GCM_SIV_FileProcessor(port)
+    processor.set_custom_parameters(key=BER_KEY, nonce=BER_NONCE)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ok = processor.encrypt_file(input_file, output_file)
+    if not ok:
+        return None
+    with open(output_file, 'rb') as f:
+        return f.read()
+
+
+def flow_benchmark(sizes, baud):
+    """有限接收缓冲区下比较无流控连续发送、RTS/CTS 与基于额度的流控"""
+    modes = [
+        ("greedy", lambda port, data, workdir: greedy_encrypt(port, data, rtscts=False), ""),
+        ("greedy+rtscts", lambda port, data, workdir: greedy_encrypt(port, data, rtscts=True), "&rtscts=1"),
+        ("credits", credit_encrypt, ""),
+    ]
+    print(f"{'mode':<14} {'rx_buffers':>10} {'size':>8} {'KB/s':>8} {'overrun bytes':>14}  ok")
+    print("-" * 62)
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            data = os.urandom(size)
+            expected = reference_ciphertext(data)
+            for rx_buffers in (1, 2, 4):
+                for name, run, extra in modes:
+                    port = f"sim://flow-{name}-{rx_buffers}-{size}?baud={baud}&rx_buffers={rx_buffers}&rx_timeout=2{extra}"
+                    board = mcu_simulator.get_board(port)
+                    start = time.perf_counter()
+                    result = run(port, data, workdir)
+                    wall = time.perf_counter() - start
+                    ok = result == expected
+                    print(f"{name:<14} {rx_buffers:>10} {size:>8} {size / wall / 1024 if ok else 0:>8.1f} "
+                          f"{board.overruns:>14}  {'✓' if ok else '✗'}")
+
+
+def key_slot_benchmark(sizes, baud, sessions):
+    """同一密钥下连续 sessions 次小文件加密：原始密钥 与 KeyHandle 对比"""
+    print(f"{'key':<10} {'size':>8} {'sessions':>9} {'ms/session':>11} {'key sent':>9} {'key setups':>11}  ok")
+    print("-" * 67)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_file = os.path.join(workdir, "keyslot_input.bin")
+        output_file = os.path.join(workdir, "keyslot_output.bin")
+        for size in sizes:
+            data = os.urandom(size)
+            expected = reference_ciphertext(data)
+            with open(input_file, 'wb') as f:
+                f.write(data)
+            for name in ("raw", "slot"):
+                port = f"sim://keyslot-{name}-{size}?baud={baud}&algorithm=sw_aes"
+                board = mcu_simulator.get_board(port)
+                processor = current_client.GCM_SIV_FileProcessor(port)
+                key = current_client.KeyHandle(BER_KEY, slot=1) if name == "slot" else BER_KEY
+                processor.set_custom_parameters(key=key, nonce=BER_NONCE)
+                ok = True
+                key_sent = 0
+                start = time.perf_counter()
+                for _ in range(sessions):
+                    with contextlib.redirect_stdout(io.StringIO()) as log:
+                        ok = processor.encrypt_file(input_file, output_file) and ok
+                    key_sent += log.getvalue().count("Waiting for: KEY_SLOT") if name == "slot" else 1
+                    with open(output_file, 'rb') as f:
+                        ok = ok and f.read() == expected
+                per_session = (time.perf_counter() - start) / sessions
+                print(f"{name:<10} {size:>8} {sessions:>9} {per_session * 1000:>11.1f} {key_sent:>9} "
+                      f"{board.key_setups:>11}  {'✓' if ok else '✗'}")
+
+
+def aad_cache_benchmark(sizes, baud, sessions, aad_size=2048, distinct=(2, 6)):
+    """轮流使用 distinct 种 aad_size 字节的AAD加密小文件：不缓存 与 AAD槽缓存对比"""
+    print(f"{'aad':<8} {'distinct':>8} {'size':>8} {'ms/session':>11} {'tx bytes/session':>17} {'hit ratio':>10}  ok")
+    print("-" * 72)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_file = os.path.join(workdir, "aad_input.bin")
+        output_file = os.path.join(workdir, "aad_output.bin")
+        for size in sizes:
+            data = os.urandom(size)
+            with open(input_file, 'wb') as f:
+                f.write(data)
+            for count in distinct:
+                aads = [os.urandom(aad_size) for _ in range(count)]
+                for name in ("raw", "cached"):
+                    port = f"sim://aad-{name}-{count}-{size}?baud={baud}"
+                    board = mcu_simulator.get_board(port)
+                    processor = current_client.GCM_SIV_FileProcessor(port, aad_cache=(name == "cached"))
+                    ok = True
+                    tx_start = board.host_to_board.bytes_sent
+                    start = time.perf_counter()
+                    for i in range(sessions):
+                        aad = aads[i % count]
+                        processor.set_custom_parameters(key=BER_KEY, nonce=BER_NONCE, aad=aad)
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            ok = processor.encrypt_file(input_file, output_file) and ok
+                        expected = BER_NONCE + mcu_simulator.seal_chunk(BER_KEY, BER_NONCE, aad, 0, data)
+                        with open(output_file, 'rb') as f:
+                            ok = ok and f.read() == expected
+                    per_session = (time.perf_counter() - start) / sessions
+                    tx = (board.host_to_board.bytes_sent - tx_start) / sessions
+                    cache = processor.aad_cache
+                    hit_ratio = f"{cache.hits / (cache.hits + cache.misses):.2f}" if cache else "-"
+                    print(f"{name:<8} {count:>8} {size:>8} {per_session * 1000:>11.1f} {tx:>17.0f} "
+                          f"{hit_ratio:>10}  {'✓' if ok else '✗'}")
+
+
+def chunk_cache_benchmark(sizes, baud, change_ratios=(0.0, 0.01, 0.1, 0.5)):
+    """冷缓存加密一次后，修改 change_ratio 比例的块再加密，对比耗时与缓存命中率"""
+    print(f"{'changed':>8} {'size':>8} {'cold s':>8} {'warm s':>8} {'hit ratio':>10} {'saved link s':>13}  ok")
+    print("-" * 66)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_file = os.path.join(workdir, "cache_input.bin")
+        output_file = os.path.join(workdir, "cache_output.bin")
+        for size in sizes:
+            for ratio in change_ratios:
+                data = bytearray(os.urandom(size))
+                cache = current_client.ChunkCache(os.path.join(workdir, f"cache-{size}-{ratio}.sqlite3"))
+                port = f"sim://cache-{size}-{ratio}?baud={baud}"
+                processor = current_client.GCM_SIV_FileProcessor(port, chunk_cache=cache)
+                processor.set_custom_parameters(key=BER_KEY, nonce=BER_NONCE)
+                timings = []
+                ok = True
+                for run in range(2):
+                    if run == 1:
+                        chunk_count = (size + current_client.CHUNK_SIZE - 1) // current_client.CHUNK_SIZE
+                        for index in random.Random(size).sample(range(chunk_count), int(round(chunk_count * ratio))):
+                            data[index * current_client.CHUNK_SIZE] ^= 0xFF
+                    with open(input_file, 'wb') as f:
+                        f.write(data)
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        ok = processor.encrypt_file(input_file, output_file) and ok
+                    timings.append(time.perf_counter() - start)
+                    with open(output_file, 'rb') as f:
+                        ok = ok and f.read() == reference_ciphertext(bytes(data))
+                report = processor.cache_report
+                cache.close()
+                print(f"{ratio:>8.0%} {size:>8} {timings[0]:>8.2f} {timings[1]:>8.2f} "
+                      f"{report['hit_ratio']:>10.2f} {report['saved_link_seconds']:>13.2f}  {'✓' if ok else '✗'}")
+
+
+def update_benchmark(sizes, baud, edit_sizes=(1, 4096, 65536)):
+    """修改 edit_size 字节后：增量更新 与 整个文件重新加密 的耗时对比"""
+    print(f"{'size':>8} {'edit':>7} {'full s':>8} {'update s':>9} {'chunks sent':>12}  ok")
+    print("-" * 56)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_file = os.path.join(workdir, "update_input.bin")
+        container = os.path.join(workdir, "update.bin")
+        full_output = os.path.join(workdir, "update_full.bin")
+        output_file = os.path.join(workdir, "update_output.bin")
+        for size in sizes:
+            port = f"sim://update-{size}?baud={baud}&rx_buffers=2"
+            processor = current_client.GCM_SIV_FileProcessor(port, write_manifest=True)
+            data = bytearray(os.urandom(size))
+            with open(input_file, 'wb') as f:
+                f.write(data)
+            with contextlib.redirect_stdout(io.StringIO()):
+                processor.encrypt_file(input_file, container)
+            for edit in edit_sizes:
+                offset = size // 3
+                data[offset:offset + edit] = os.urandom(edit)
+                with open(input_file, 'wb') as f:
+                    f.write(data)
+                with contextlib.redirect_stdout(io.StringIO()) as log:
+                    start = time.perf_counter()
+                    ok = processor.encrypt_file(input_file, full_output)
+                    full = time.perf_counter() - start
+                    start = time.perf_counter()
+                    ok = processor.update_file(input_file, container) and ok
+                    update = time.perf_counter() - start
+                    ok = processor.decrypt_file(container, output_file) and ok
+                sent = [line for line in log.getvalue().splitlines() if "Chunks re-encrypted" in line]
+                with open(output_file, 'rb') as f:
+                    ok = ok and f.read() == bytes(data)
+                print(f"{size:>8} {edit:>7} {full:>8.2f} {update:>9.2f} "
+                      f"{sent[-1].split(':')[-1].strip() if sent else '-':>12}  {'✓' if ok else '✗'}")
+
+
+def record_benchmark(record_sizes, baud, count, file_sessions=10):
+    """count 条 record_size 字节的记录：每条一次 encrypt_file 会话 与 encrypt_records 对比每秒记录数"""
+    print(f"{'mode':<10} {'record':>7} {'records':>8} {'time(s)':>8} {'records/s':>10} {'B/s':>9}  ok")
+    print("-" * 62)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_file = os.path.join(workdir, "record_input.bin")
+        output_file = os.path.join(workdir, "record_output.bin")
+        for size in record_sizes:
+            records = [os.urandom(size) for _ in range(count)]
+            port = f"sim://records-{size}?baud={baud}&rx_buffers=2"
+            processor = current_client.GCM_SIV_FileProcessor(port)
+            processor.set_custom_parameters(key=BER_KEY, nonce=BER_NONCE)
+
+            # 每条记录一次会话（目前的文件接口）：会话开销很大，只测 file_sessions 条
+            ok = True
+            start = time.perf_counter()
+            for record in records[:file_sessions]:
+                with open(input_file, 'wb') as f:
+                    f.write(record)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    ok = processor.encrypt_file(input_file, output_file) and ok
+                with open(output_file, 'rb') as f:
+                    ok = ok and f.read() == reference_ciphertext(record)
+            wall = time.perf_counter() - start
+            n = min(count, file_sessions)
+            print(f"{'file':<10} {size:>7} {n:>8} {wall:>8.2f} {n / wall:>10.1f} {n * size / wall:>9.0f}  "
+                  f"{'✓' if ok else '✗'}")
+
+            # 记录模式：一个会话，成批发送，再解密验证
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                stream = processor.encrypt_records(records)
+                ciphertexts = list(stream)
+                wall = time.perf_counter() - start
+                plaintexts = list(processor.decrypt_records(ciphertexts, stream.nonce))
+            ok = plaintexts == records and all(
+                ct == mcu_simulator.seal_chunk(BER_KEY, BER_NONCE, b'', i, record)
+                for i, (record, ct) in enumerate(zip(records, ciphertexts)))
+            print(f"{'records':<10} {size:>7} {count:>8} {wall:>8.2f} {count / wall:>10.1f} "
+                  f"{count * size / wall:>9.0f}  {'✓' if ok else '✗'}")
+
+
+def decode_microbenchmark(megabytes=4, rounds=3):
+    """接收路径微基准：解码 megabytes MB 的B64行，返回 (旧路径, 新路径) 每MB秒数"""
+    payload_size = megabytes * 1024 * 1024
+    lines = []
+    for _ in range(0, payload_size, current_client.CHUNK_SIZE + 16):
+        lines.append(b"B64:" + base64.b64encode(os.urandom(current_client.CHUNK_SIZE + 16)) + b"\r\n")
+        lines.append(b"CHUNK_PROCESSED\r\n")
+    stream = b"".join(lines)
+    reads = [stream[i:i + 4096] for i in range(0, len(stream), 4096)]
+    baseline = load_baseline_client().GCM_SIV_FileProcessor("sim")
+
+    def old_path():
+        total = 0
+        source = io.BytesIO(stream)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for raw in iter(source.readline, b''):
+                line = raw.decode('utf-8', errors='ignore').strip()
+                if line.startswith('B64:'):
+                    total += len(baseline.safe_base64_decode(line[4:]))
+        return total
+
+    def new_path():
+        total = 0
+        ring = current_client.RxRingBuffer()
+        for data in reads:
+            ring.feed(data)
+            while True:
+                line = ring.pop_line()
+                if line is None:
+                    break
+                kind, value = current_client.SerialLink.parse_line(line)
+                if kind == 'B64':
+                    total += len(value)
+        return total
+
+    results = []
+    for path in (old_path, new_path):
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            decoded = path()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append(best / (decoded / (1024 * 1024)))
+    return tuple(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host transport benchmark on the MCU simulator")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--sizes", default="1048576,4194304")
+    parser.add_argument("--decode", action="store_true", help="only run the receive/decode microbenchmark")
+    parser.add_argument("--ber", help="comma separated bit error rates: measure goodput with/without frame CRC")
+    parser.add_argument("--flow", action="store_true", help="compare greedy sending, RTS/CTS and credit flow control")
+    parser.add_argument("--keyslots", action="store_true", help="repeated small sessions: raw key vs board key slot")
+    parser.add_argument("--aad", action="store_true", help="repeated large AAD: resend vs board AAD slots")
+    parser.add_argument("--cache", action="store_true", help="re-encrypt a partly changed file with the chunk cache")
+    parser.add_argument("--update", action="store_true", help="incremental update vs full re-encryption")
+    parser.add_argument("--records", action="store_true", help="many small messages: per-file sessions vs record mode")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--count", type=int, default=2000, help="number of records for --records")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    if args.records:
+        record_benchmark(sizes, args.baud, args.count)
+        return
+
+    if args.update:
+        update_benchmark(sizes, args.baud)
+        return
+
+    if args.cache:
+        chunk_cache_benchmark(sizes, args.baud)
+        return
+
+    if args.aad:
+        aad_cache_benchmark(sizes, args.baud, args.sessions)
+        return
+
+    if args.keyslots:
+        key_slot_benchmark(sizes, args.baud, args.sessions)
+        return
+
+    if args.flow:
+        flow_benchmark(sizes, args.baud)
+        return
+
+    if args.ber:
+        ber_benchmark([float(b) for b in args.ber.split(",")], sizes, args.baud)
+        return
+
+    if args.decode:
+        old, new = decode_microbenchmark()
+        print(f"readline + safe_base64_decode : {old * 1000:8.2f} ms/MB")
+        print(f"ring buffer + binascii        : {new * 1000:8.2f} ms/MB  ({old / new:.1f}x)")
+        return
+
+    baseline = load_baseline_client()
+    clients = [
+        ("baseline", baseline, 1),
+        ("threaded", current_client, 1),
+        ("threaded", current_client, 2),
+    ]
+
+    print(f"{'client':<10} {'rx_buffers':<11} {'size':>10} {'time(s)':>9} {'KB/s':>9} {'CPU s/MB':>9}  ok")
+    print("-" * 68)
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            for name, module, rx_buffers in clients:
+                port = f"sim://{name}-{rx_buffers}-{size}?baud={args.baud}&rx_buffers={rx_buffers}"
+                r = run_case(module, port, size, workdir)
+                print(f"{name:<10} {rx_buffers:<11} {size:>10} {r['wall']:>9.2f} "
+                      f"{r['throughput'] / 1024:>9.1f} {r['cpu_per_mb']:>9.3f}  {'✓' if r['ok'] else '✗'}")
+
+
+if __name__ == "__main__":
+    main()
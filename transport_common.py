@@ -0,0 +1,171 @@
+"""
+上位机共用的协议工具函数
+
+Serial File Transport.py 和 测试结果/.../benchmark.py 都从这里导入，不各自复制：
+- parse_capabilities：解析能力查询（'c' 命令）的 CAPS: 应答
+- parse_metrics / stream_metrics / format_metrics：解析数据流结束时MCU报告的
+  STREAM_STATS:、SUMMARY: 行，换算片上加解密速度和端到端吞吐量
+- compare_files / format_chunk_ranges：分块比较两个文件，把差异对应到协议块
+"""
+import contextlib
+import mmap
+import os
+
+# CAPS 中按十进制整数解析的字段
+CAPS_INT_FIELDS = ("max_chunk", "buffers", "key_slots", "aad_slots", "crypto_rate")
+
+# 文件比较：每次整块比较多少个协议块（块相同时不逐块比较）
+COMPARE_BLOCK_CHUNKS = 1024
+
+
+def parse_capabilities(line):
+    """解析 CAPS: 行为字典（options为整数位掩码，bauds为整数列表，engines为名称列表）"""
+    caps = {}
+    for field in line.split(':', 1)[1].split():
+        name, _, value = field.partition('=')
+        try:
+            if name in CAPS_INT_FIELDS:
+                value = int(value)
+            elif name == "options":
+                value = int(value, 16)
+            elif name == "bauds":
+                value = [int(b) for b in value.split(',') if b]
+            elif name == "engines":
+                value = [e for e in value.split(',') if e]
+        except ValueError:
+            continue
+        caps[name] = value
+    return caps
+
+
+def parse_metrics(line):
+    """解析 STREAM_STATS:/SUMMARY: 行的 key=value 字段为字典（整数字段转换为int）"""
+    metrics = {}
+    for field in line.split(':', 1)[1].split():
+        name, sep, value = field.partition('=')
+        if not sep:
+            continue
+        try:
+            value = int(value)
+        except ValueError:
+            pass
+        metrics[name] = value
+    return metrics
+
+
+def stream_metrics(stats, summary, elapsed):
+    """合并MCU报告的统计（STREAM_STATS、SUMMARY）和主机测得的数据阶段时间：
+    片上加解密速度（周期/字节）与链路决定的端到端吞吐量分开报告"""
+    stats, summary = stats or {}, summary or {}
+    metrics = {"stream_stats": stats, "summary": summary, "elapsed": elapsed}
+    bytes_in = stats.get("bytes_in", summary.get("bytes_in"))
+    chunks = stats.get("chunks", summary.get("chunks"))
+    if bytes_in and elapsed > 0:
+        metrics["link_bytes_per_s"] = bytes_in / elapsed
+    cycles, cpu_hz = stats.get("cycles"), stats.get("cpu_hz")
+    if bytes_in and cycles and cpu_hz:
+        crypto_time = cycles / cpu_hz
+        metrics["cycles_per_byte"] = cycles / bytes_in
+        metrics["cycles_per_chunk"] = cycles / chunks if chunks else None
+        metrics["crypto_bytes_per_s"] = bytes_in / crypto_time
+        metrics["crypto_time"] = crypto_time
+        if elapsed > 0:
+            # 片上加解密占数据阶段时间的比例：超过一半说明瓶颈在MCU，否则在链路/协议
+            metrics["crypto_share"] = crypto_time / elapsed
+            metrics["bound"] = "crypto" if crypto_time * 2 >= elapsed else "link"
+    if "buffers_hw" in stats:
+        metrics["buffers_hw"] = stats["buffers_hw"]
+    return metrics
+
+
+def format_metrics(metrics):
+    """一行文字概括 stream_metrics() 的结果"""
+    parts = []
+    if "cycles_per_byte" in metrics:
+        parts.append(f"{metrics['cycles_per_byte']:.1f} cycles/byte "
+                     f"(on-chip {metrics['crypto_bytes_per_s'] / 1024:.1f} KB/s)")
+    if "link_bytes_per_s" in metrics:
+        parts.append(f"end-to-end {metrics['link_bytes_per_s'] / 1024:.1f} KB/s")
+    if "bound" in metrics:
+        parts.append(f"{metrics['bound']}-bound ({metrics['crypto_share']:.0%} crypto)")
+    if "buffers_hw" in metrics:
+        parts.append(f"RX buffers high-water {metrics['buffers_hw']}/{metrics['stream_stats'].get('buffers', '?')}")
+    return ", ".join(parts)
+
+
+@contextlib.contextmanager
+def _mapped(path):
+    """只读映射整个文件（空文件无法映射，返回空bytes）"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield m
+
+
+def _count_diff(a, b):
+    """两段等长数据中不同字节的数量和第一个不同字节的位置（整数异或，不逐字节循环）"""
+    x = (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+    return len(x) - x.count(0), len(x) - len(x.lstrip(b'\0'))
+
+
+def compare_files(file1, file2, chunk_size, offset=0):
+    """分块比较两个文件（mmap，不把文件读入内存），并把差异对应到协议块。
+    明文文件 chunk_size=CHUNK_SIZE；加密文件的块是 CHUNK_SIZE+16 字节，前面有16字节Nonce头：
+    compare_files(a, b, CHUNK_SIZE + 16, offset=16)。
+    返回 identical、两个文件的大小、first_diff（第一个不同字节的偏移，相同时为None）、
+    differences（共同长度内不同的字节数）、chunks（有差异或缺失的块序号）、header_differs"""
+    size1, size2 = os.path.getsize(file1), os.path.getsize(file2)
+    common = min(size1, size2)
+    report = {"identical": False, "size1": size1, "size2": size2, "first_diff": None,
+              "differences": 0, "chunks": [], "header_differs": False}
+    with _mapped(file1) as m1, _mapped(file2) as m2:
+        v1, v2 = memoryview(m1), memoryview(m2)
+        try:
+            head = min(offset, common)
+            if v1[:head] != v2[:head]:
+                count, first = _count_diff(v1[:head], v2[:head])
+                report.update(header_differs=True, first_diff=first, differences=count)
+            block = chunk_size * COMPARE_BLOCK_CHUNKS
+            for pos in range(head, common, block):
+                end = min(pos + block, common)
+                if v1[pos:end] == v2[pos:end]:
+                    continue
+                for start in range(pos, end, chunk_size):
+                    stop = min(start + chunk_size, end)
+                    if v1[start:stop] != v2[start:stop]:
+                        count, first = _count_diff(v1[start:stop], v2[start:stop])
+                        if report["first_diff"] is None:
+                            report["first_diff"] = start + first
+                        report["differences"] += count
+                        report["chunks"].append((start - offset) // chunk_size)
+        finally:
+            v1.release()
+            v2.release()
+    if size1 != size2:
+        if report["first_diff"] is None:
+            report["first_diff"] = common
+        report["header_differs"] |= common < offset
+        # 较短文件缺少的块（最后一个共同块已比较过，不足部分也算有差异）
+        last = (max(size1, size2) - offset - 1) // chunk_size
+        tail = max((common - offset) // chunk_size, 0)
+        if report["chunks"] and report["chunks"][-1] == tail:
+            tail += 1
+        report["chunks"].extend(range(tail, last + 1))
+    report["identical"] = size1 == size2 and report["first_diff"] is None
+    return report
+
+
+def format_chunk_ranges(chunks, limit=10):
+    """把块序号列表写成 "3, 7-9, 12" 的形式，过长时省略"""
+    ranges = []
+    for index in chunks:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    text = ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges[:limit])
+    if len(ranges) > limit:
+        text += f", ... ({len(ranges) - limit} more ranges)"
+    return text
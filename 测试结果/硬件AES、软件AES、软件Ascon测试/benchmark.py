@@ -6,22 +6,123 @@ import struct
 import secrets
 import sys
 import json
-import random
+import shutil
 import string
 import hashlib
 import threading
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional, Any
 import statistics
+import argparse
+import re
 
 # ==================== 使用 test_serial_file_transport.py 中的通信协议 ====================
 
 BaudRate = 115200
 CHUNK_SIZE = 1024
+CAPS_TIMEOUT = 1  # 等待能力查询应答的超时（秒），旧固件不应答
+
+# 仓库根目录（mcu_simulator.py、transport_common.py 所在目录），端口名以 "sim" 开头时使用仿真器
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+from transport_common import parse_capabilities, parse_metrics, stream_metrics, compare_files, format_chunk_ranges
+
+# 往返校验：'o' 命令请求 OPT_ROUND_TRIP 后可用操作 'r'，每块前带1字节类型
+# （'e' 加密 / 'd' 解密）和4字节块序号
+OPT_ROUND_TRIP = 0x40
+OPTIONS_TIMEOUT = 2
+
+# 双模式固件的加密引擎切换（'g' 命令 + 1字节引擎号，MCU应答 ENGINE:<名称>）
+ENGINE_IDS = {"hw_aes": 0, "sw_aes": 1, "sw_ascon": 2}
+ENGINE_TIMEOUT = 1
+
+# 分阶段测试命令（CAPS options 中的能力位，不需要协商）：'x' + 4字节总长度 链路回显，
+# 'y' + 4字节块数 + 2字节块大小 只加密（板上生成数据，应答 CRYPTO_BENCH: ... cycles= cpu_hz=）
+OPT_BENCH = 0x800
+BENCH_TIMEOUT = 2
+MIN_CRYPTO_RATE = 10000  # 等待只加密结果的超时按此速度估算（字节/秒）
+
+# 无人值守时的自动恢复：MCU空闲时周期性发送READY；收不到时先发送UART break中止卡住的会话
+# （固件能力位 OPT_ABORT），再拉低DTR复位（需要开发板把DTR接到复位），都失败后等待一段时间重试
+OPT_ABORT = 0x200
+RECOVERY_TIMEOUT = 3     # 每一步之后等待READY的超时（秒）
+RECOVERY_ATTEMPTS = 3    # 恢复失败这么多次后放弃该端口
+RECOVERY_BACKOFF = 5     # 两次恢复尝试之间的等待（秒，逐次递增）
+MAX_RETRIES = 3          # 每次迭代失败后的最大重试次数
+
+# 分阶段分解的显示：阶段名 -> 条形图字符
+PHASES = (("handshake", "▒"), ("link", "█"), ("crypto", "▓"), ("protocol", "░"))
+
+# 测试数据：按 (大小, 种子, 类型) 确定，生成后缓存在磁盘上供之后的迭代重复使用
+TEST_DATA_KINDS = ("printable", "random", "zeros", "text")
+TEST_DATA_SEED = 42
+TEST_DATA_BLOCK = 1024 * 1024  # 计数器模式每块的字节数
+PRINTABLE_CHARS = (string.ascii_letters + string.digits + string.punctuation).encode()
+TEXT_WORDS = ("the", "data", "block", "stream", "cipher", "key", "nonce", "tag", "board", "serial",
+              "chunk", "buffer", "session", "encrypt", "decrypt", "verify", "status", "ok", "error",
+              "timeout", "retry", "log", "event", "user", "request", "response", "value", "index")
+
+# CAPS 中的算法 -> 测试项目
+ALGORITHM_PROJECTS = {
+    "hw_aes": "hardware_aes",
+    "sw_aes": "software_aes",
+    "sw_ascon": "software_ascon",
+}
+
+# 测试项目 -> 显示名称
+PROJECT_NAMES = {
+    "hardware_aes": "硬件AES-GCM-SIV",
+    "software_aes": "软件AES-GCM-SIV",
+    "software_ascon": "软件Ascon",
+}
+
+
+def _prng_block(seed, kind, counter, length=TEST_DATA_BLOCK):
+    """计数器模式伪随机数：第 counter 块 = SHAKE-256(类型, 种子, counter) 的前 length 字节
+    （与平台和Python版本无关；只取前缀时内容不变，小文件的数据是大文件数据的前缀）"""
+    return hashlib.shake_256(f"{kind}:{seed}:{counter}".encode()).digest(min(length, TEST_DATA_BLOCK))
+
+
+def generate_data(size, seed=TEST_DATA_SEED, kind="printable"):
+    """生成 size 字节的确定性测试数据（整块用C实现的哈希和 bytes.translate 处理，不逐字节调用Python）：
+    printable 可打印ASCII字符，random 随机字节，zeros 全零，text 由少量单词组成的可压缩文本"""
+    if kind == "zeros":
+        return bytes(size)
+    if kind not in TEST_DATA_KINDS:
+        raise ValueError(f"Unknown test data kind: {kind}")
+    pieces = []
+    produced = 0
+    counter = 0
+    if kind == "text":
+        # 第0块生成256个短句，之后每个随机字节选择一个句子：像日志一样重复度高、容易压缩
+        words = _prng_block(seed, kind, 0, 256 * 8)
+        sentences = [b" ".join(TEXT_WORDS[b % len(TEXT_WORDS)].encode() for b in words[i * 8:i * 8 + 3 + words[i * 8] % 6])
+                     + b".\n" for i in range(256)]
+        counter = 1
+    elif kind == "printable":
+        # 丢弃 >= limit 的字节后按模映射，每个字符概率相同
+        limit = 256 - 256 % len(PRINTABLE_CHARS)
+        table = bytes(PRINTABLE_CHARS[i % len(PRINTABLE_CHARS)] for i in range(256))
+        discard = bytes(range(limit, 256))
+    while produced < size:
+        remaining = size - produced
+        if kind == "text":
+            piece = b"".join(sentences[b] for b in _prng_block(seed, kind, counter, remaining // 8 + 1))
+        elif kind == "printable":
+            piece = _prng_block(seed, kind, counter, remaining * 3 // 2 + 64).translate(table, discard)
+        else:
+            piece = _prng_block(seed, kind, counter, remaining)
+        pieces.append(piece)
+        produced += len(piece)
+        counter += 1
+    return b"".join(pieces)[:size]
+
 
 class GCM_SIV_FileProcessor:
-    def __init__(self, port, verbose=False, show_progress=True):
+    def __init__(self, port, verbose=False, show_progress=True, engine=None):
         self.port = port
+        self.engine = engine  # 双模式固件中本次使用的加密引擎（None表示不切换）
         self.ser = None
         self.verbose = verbose
         self.show_progress = show_progress
@@ -32,6 +133,9 @@ class GCM_SIV_FileProcessor:
         self.custom_key = None
         self.custom_nonce = None
         self.custom_aad = b''
+        self.digests = {}  # 最近一次加密/解密边传输边算出的SHA-256（十六进制）
+        self.mcu_stats = None  # 本次数据流中收到的 STREAM_STATS（已解析）
+        self.mcu_metrics = None  # 最近一次数据流的MCU统计（stream_metrics() 的结果）
         
     def set_custom_parameters(self, key=None, nonce=None, aad=None):
         """设置用户自定义参数"""
@@ -58,8 +162,13 @@ class GCM_SIV_FileProcessor:
     def connect(self):
         """连接到串口设备"""
         try:
-            self.ser = serial.Serial(self.port, BaudRate, timeout=10, dsrdtr=False,
-                                   write_timeout=10, xonxoff=False, rtscts=False)
+            if self.port.lower().startswith('sim'):
+                # 使用MCU固件仿真器（仓库根目录的 mcu_simulator.py）
+                from mcu_simulator import open_simulated_port
+                self.ser = open_simulated_port(self.port, BaudRate, timeout=10, write_timeout=10)
+            else:
+                self.ser = serial.Serial(self.port, BaudRate, timeout=10, dsrdtr=False,
+                                       write_timeout=10, xonxoff=False, rtscts=False)
             if self.verbose:
                 print(f"Connected to {self.port}")
             return True
@@ -100,6 +209,8 @@ class GCM_SIV_FileProcessor:
                 line = self.ser.readline().decode('utf-8', errors='ignore').strip()
                 if self.verbose:
                     print(f"MCU: {line}")
+                if line.startswith('STREAM_STATS:'):
+                    self.mcu_stats = parse_metrics(line)
                 
                 # 检查是否为期望的消息
                 if expected_msg in line:
@@ -137,6 +248,291 @@ class GCM_SIV_FileProcessor:
         self.ser.flush()
         return self.wait_for_message(expected_response, timeout)
         
+    def query_capabilities(self):
+        """连接MCU并发送能力查询（'c'），返回能力字典；旧固件不应答时返回 {}"""
+        if not self.connect():
+            return {}
+        try:
+            if not self.wait_for_message('READY', 15):
+                return {}
+            reply = self.send_and_wait(b'c', 'CAPS', CAPS_TIMEOUT)
+            if reply and reply.startswith('CAPS:'):
+                return parse_capabilities(reply)
+            return {}
+        finally:
+            self.disconnect()
+
+    def recover(self):
+        """自动恢复（无人值守时代替手动复位）：依次等待READY、发送UART break、
+        拉低DTR复位，返回MCU是否回到空闲状态"""
+        if not self.connect():
+            return False
+        try:
+            self.ser.reset_input_buffer()
+            if self.wait_for_message('READY', RECOVERY_TIMEOUT):
+                return True
+            print("  MCU not ready, sending abort (UART break)")
+            self.ser.send_break(0.01)
+            if self.wait_for_message('READY', RECOVERY_TIMEOUT):
+                return True
+            print("  MCU still not ready, pulsing DTR (board reset)")
+            self.ser.dtr = False
+            time.sleep(0.1)
+            self.ser.dtr = True
+            return bool(self.wait_for_message('READY', RECOVERY_TIMEOUT))
+        except Exception as e:
+            print(f"  Recovery error: {e}")
+            return False
+        finally:
+            self.disconnect()
+
+    def select_engine(self):
+        """在双模式固件上切换加密引擎（MCU空闲时调用）"""
+        if self.engine is None:
+            return True
+        reply = self.send_and_wait(b'g' + bytes([ENGINE_IDS[self.engine]]), 'ENGINE', ENGINE_TIMEOUT)
+        if reply != f"ENGINE:{self.engine}":
+            print(f"Failed to select engine {self.engine}")
+            return False
+        return True
+
+    def roundtrip_data(self, file_data, custom_key=None, custom_nonce=None, custom_aad=b""):
+        """往返校验（单会话）：MCU加密每块后，密文立即发回解密并与原明文块比较，
+        不写临时文件。返回 (是否成功, 加密耗时, 解密耗时)，耗时按每块往返累计"""
+        if not self.connect():
+            return False, 0, 0
+            
+        try:
+            key = custom_key if custom_key is not None else bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
+            nonce = custom_nonce if custom_nonce is not None else secrets.token_bytes(16)
+            
+            if not self.wait_for_message('READY', 15):
+                print("MCU not ready")
+                return False, 0, 0
+                
+            if not self.select_engine():
+                return False, 0, 0
+                
+            # 请求往返校验选项（旧固件不应答）
+            reply = self.send_and_wait(b'o' + struct.pack('>I', OPT_ROUND_TRIP), 'OPTIONS', OPTIONS_TIMEOUT)
+            try:
+                supported = bool(reply and reply.startswith('OPTIONS:') and int(reply.split(':')[1], 16) & OPT_ROUND_TRIP)
+            except ValueError:
+                supported = False
+            if not supported:
+                print("MCU firmware does not support round-trip verification")
+                return False, 0, 0
+                
+            # 握手：与加密相同，操作码为 'r'
+            if not self.send_and_wait(b'n', 'NEW_STREAM_MODE'):
+                return False, 0, 0
+            if not self.wait_for_message('WAIT_OPERATION'):
+                return False, 0, 0
+            if not self.send_and_wait(b'r', 'ACK'):
+                return False, 0, 0
+            if not self.wait_for_message('WAIT_KEY'):
+                return False, 0, 0
+            if not self.send_and_wait(key, 'ACK'):
+                return False, 0, 0
+            if not self.wait_for_message('WAIT_NONCE'):
+                return False, 0, 0
+            if not self.send_and_wait(nonce, 'ACK'):
+                return False, 0, 0
+            if not self.wait_for_message('WAIT_AAD_LEN'):
+                return False, 0, 0
+            if not self.send_and_wait(struct.pack('>I', len(custom_aad)), 'ACK'):
+                return False, 0, 0
+            if len(custom_aad) > 0:
+                if not self.wait_for_message('WAIT_AAD'):
+                    return False, 0, 0
+                if not self.send_and_wait(custom_aad, 'ACK'):
+                    return False, 0, 0
+            if not self.wait_for_message('READY_FOR_DATA'):
+                return False, 0, 0
+                
+            time.sleep(0.3)  # 与流式加解密相同的预热时间
+            stream_start = self._start_metrics()
+            
+            encryption_time = 0
+            decryption_time = 0
+            for index, pos in enumerate(range(0, len(file_data), CHUNK_SIZE)):
+                chunk = file_data[pos:pos + CHUNK_SIZE]
+                t0 = time.time()
+                ciphertext = self._roundtrip_chunk(b'e', index, chunk)
+                t1 = time.time()
+                if ciphertext is None:
+                    print(f"✗ Round-trip encryption of chunk {index + 1} failed")
+                    return False, 0, 0
+                plaintext = self._roundtrip_chunk(b'd', index, ciphertext)
+                t2 = time.time()
+                if plaintext != chunk:
+                    print(f"✗ Round-trip mismatch in chunk {index + 1}")
+                    return False, 0, 0
+                encryption_time += t1 - t0
+                decryption_time += t2 - t1
+                
+            # 结束标记
+            self.ser.write(struct.pack('>I', 0))
+            self.ser.flush()
+            if not self.wait_for_message('STREAM_COMPLETE', 10):
+                if self.verbose:
+                    print("Warning: Stream completion not received, but assuming completion...")
+            self._finish_metrics(self.wait_for_message('SUMMARY:', 5), stream_start)
+            
+            print(f"✓ Round-trip verified: {(len(file_data) + CHUNK_SIZE - 1) // CHUNK_SIZE} chunks")
+            return True, encryption_time, decryption_time
+            
+        except Exception as e:
+            print(f"Round-trip error: {e}")
+            import traceback
+            traceback.print_exc()
+            return False, 0, 0
+        finally:
+            self.disconnect()
+            
+    def measure_handshake(self, custom_key=None, custom_nonce=None, custom_aad=b""):
+        """只测会话建立：连接并等待READY、握手到 READY_FOR_DATA，之后立即发送结束标记
+        （空数据流）。返回各部分耗时（秒）的字典，失败返回None"""
+        start = time.time()
+        if not self.connect():
+            return None
+        try:
+            key = custom_key if custom_key is not None else bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
+            nonce = custom_nonce if custom_nonce is not None else secrets.token_bytes(16)
+            if not self.wait_for_message('READY', 15):
+                print("MCU not ready")
+                return None
+            ready = time.time()
+            if not self.select_engine():
+                return None
+            steps = [(b'n', 'NEW_STREAM_MODE'), (None, 'WAIT_OPERATION'), (b'e', 'ACK'),
+                     (None, 'WAIT_KEY'), (key, 'ACK'), (None, 'WAIT_NONCE'), (nonce, 'ACK'),
+                     (None, 'WAIT_AAD_LEN'), (struct.pack('>I', len(custom_aad)), 'ACK')]
+            if custom_aad:
+                steps += [(None, 'WAIT_AAD'), (custom_aad, 'ACK')]
+            steps.append((None, 'READY_FOR_DATA'))
+            for data, expected in steps:
+                reply = self.wait_for_message(expected) if data is None else self.send_and_wait(data, expected)
+                if not reply:
+                    return None
+            opened = time.time()
+            
+            # 空数据流：收到第一个 WAIT_CHUNK 就发送结束标记
+            if not self.wait_for_message('WAIT_CHUNK', 10):
+                return None
+            self.ser.write(struct.pack('>I', 0))
+            self.ser.flush()
+            while True:
+                line = self.wait_for_message('SUMMARY:', 10)
+                if line is None:
+                    return None
+                if line.startswith('SUMMARY:'):
+                    break
+            end = time.time()
+            return {"connect": ready - start, "handshake": opened - ready,
+                    "teardown": end - opened, "total": end - start}
+        finally:
+            self.disconnect()
+
+    def measure_echo(self, size, window=1):
+        """链路回显（'x'，需要 OPT_BENCH）：发送 size 字节随机数据，MCU按块原样用 B64 行发回，
+        不加解密；未回显的块数不超过 window（MCU的接收缓冲区数）。
+        返回 (耗时, 回显是否一致)，失败返回None"""
+        if not self.connect():
+            return None
+        try:
+            if not self.wait_for_message('READY', 15):
+                print("MCU not ready")
+                return None
+            data = os.urandom(size)
+            reply = self.send_and_wait(b'x' + struct.pack('>I', size), 'ECHO', BENCH_TIMEOUT)
+            if not reply or not reply.startswith('ECHO:'):
+                print("MCU firmware does not support echo")
+                return None
+            
+            start = time.time()
+            pieces = [data[pos:pos + CHUNK_SIZE] for pos in range(0, size, CHUNK_SIZE)]
+            echoed = []
+            sent = 0
+            while len(echoed) < len(pieces):
+                while sent < len(pieces) and sent - len(echoed) < window:
+                    self.ser.write(pieces[sent])
+                    sent += 1
+                self.ser.flush()
+                line = self.ser.readline().strip()
+                if not line:
+                    print(f"Echo timeout after {len(echoed)} chunks")
+                    return None
+                if line.startswith(b'B64:'):
+                    echoed.append(base64.b64decode(line[4:]))
+                elif b'ERROR' in line:
+                    print(f"MCU error: {line.decode('utf-8', errors='ignore')}")
+                    return None
+            if not self.wait_for_message('ECHO_DONE', 10):
+                return None
+            return time.time() - start, b''.join(echoed) == data
+        finally:
+            self.disconnect()
+
+    def measure_crypto(self, chunks, chunk_size=CHUNK_SIZE):
+        """只加密（'y'，需要 OPT_BENCH）：MCU用当前引擎加密 chunks 块板上生成的数据，不经过串口。
+        返回 CRYPTO_BENCH 的统计字典（另加主机测得的 wall 秒数），失败返回None"""
+        if not self.connect():
+            return None
+        try:
+            if not self.wait_for_message('READY', 15):
+                print("MCU not ready")
+                return None
+            if not self.select_engine():
+                return None
+            start = time.time()
+            reply = self.send_and_wait(b'y' + struct.pack('>IH', chunks, chunk_size), 'CRYPTO_BENCH',
+                                       BENCH_TIMEOUT + chunks * chunk_size / MIN_CRYPTO_RATE)
+            if not reply or not reply.startswith('CRYPTO_BENCH:'):
+                print("MCU firmware does not support crypto-only benchmark")
+                return None
+            result = parse_metrics(reply)
+            result["wall"] = time.time() - start
+            return result
+        finally:
+            self.disconnect()
+
+    def _start_metrics(self):
+        """数据阶段开始：清除上一次的MCU统计，返回开始时间"""
+        self.mcu_stats = None
+        self.mcu_metrics = None
+        return time.time()
+
+    def _finish_metrics(self, summary_msg, stream_start):
+        """数据阶段结束：合并 STREAM_STATS、SUMMARY 和数据阶段耗时"""
+        summary = parse_metrics(summary_msg) if summary_msg and summary_msg.startswith('SUMMARY:') else None
+        if self.mcu_stats or summary:
+            self.mcu_metrics = stream_metrics(self.mcu_stats, summary, time.time() - stream_start)
+
+    def _roundtrip_chunk(self, kind, index, chunk):
+        """往返校验会话中发送一块（类型 + 块序号 + 数据），返回MCU的处理结果"""
+        if not self.wait_for_message('WAIT_CHUNK', 30):
+            return None
+        payload = kind + struct.pack('>I', index) + chunk
+        self.ser.write(struct.pack('>I', len(payload)) + payload)
+        self.ser.flush()
+        if not self.wait_for_message('CHUNK_RECEIVED', 30):
+            return None
+        result = None
+        start_time = time.time()
+        while time.time() - start_time < 60:
+            line = self.ser.readline().decode('utf-8', errors='ignore').strip()
+            if self.verbose and line:
+                print(f"MCU: {line}")
+            if line.startswith('B64:'):
+                result = self.safe_base64_decode(line[4:])
+            elif 'CHUNK_PROCESSED' in line:
+                return result
+            elif 'ERROR' in line:
+                print(f"MCU error: {line}")
+                return None
+        return None
+
     def safe_base64_decode(self, b64_data):
         """安全的Base64解码"""
         try:
@@ -196,11 +592,16 @@ class GCM_SIV_FileProcessor:
         total_sent = 0
         chunk_count = 0
         encrypted_data = b''
+        # 明文和密文（含文件头nonce）的摘要在传输过程中累加，结果无需重新读文件
+        plain_hash = hashlib.sha256()
+        cipher_hash = hashlib.sha256(nonce)
+        self.digests = {}
         
         # 关键：在开始前给MCU一些预热时间
         if self.verbose:
             print("Allowing MCU hardware warmup...")
         time.sleep(0.3)
+        stream_start = self._start_metrics()
         
         while total_sent < len(file_data):
             chunk_count += 1
@@ -247,6 +648,7 @@ class GCM_SIV_FileProcessor:
             chunk = file_data[total_sent:total_sent + current_chunk_size]
             if self.verbose:
                 print(f"Sending chunk {chunk_count}: {len(chunk)} bytes")
+            plain_hash.update(chunk)
             self.ser.write(chunk)
             self.ser.flush()
             total_sent += len(chunk)
@@ -272,6 +674,7 @@ class GCM_SIV_FileProcessor:
                             if decoded:
                                 received_b64_data = decoded
                                 encrypted_data += decoded
+                                cipher_hash.update(decoded)
                                 self.total_processed += len(decoded)
                                 if self.verbose:
                                     print(f"✓ Received encrypted chunk {chunk_count}: {len(decoded)} bytes")
@@ -294,6 +697,8 @@ class GCM_SIV_FileProcessor:
                     elif 'STREAM_STATS' in line:
                         if self.verbose:
                             print(f"MCU Stream Stats: {line}")
+                        if ':' in line:
+                            self.mcu_stats = parse_metrics(line)
                     
                     elif 'ERROR' in line:
                         print(f"MCU error: {line}")
@@ -349,11 +754,16 @@ class GCM_SIV_FileProcessor:
         summary_msg = self.wait_for_message('SUMMARY:', 5)
         if summary_msg and self.verbose:
             print(f"MCU Summary: {summary_msg}")
+        self._finish_metrics(summary_msg, stream_start)
         
         if encrypted_data:
             with open(output_file, 'wb') as f:
                 f.write(nonce)
                 f.write(encrypted_data)
+            self.digests = {
+                "plaintext_in": plain_hash.hexdigest(),
+                "ciphertext_out": cipher_hash.hexdigest(),
+            }
                 
             print(f"✓ Streaming encryption successful: {output_file}")
             if self.verbose:
@@ -410,6 +820,9 @@ class GCM_SIV_FileProcessor:
                 print("MCU not ready")
                 return False
                 
+            if not self.select_engine():
+                return False
+                
             # 进入流模式
             if not self.send_and_wait(b'n', 'NEW_STREAM_MODE'):
                 return False
@@ -476,10 +889,14 @@ class GCM_SIV_FileProcessor:
         total_sent = 0
         chunk_count = 0
         decrypted_data = b''
+        cipher_hash = hashlib.sha256(nonce)
+        plain_hash = hashlib.sha256()
+        self.digests = {}
         
         if self.verbose:
             print("Allowing MCU hardware warmup...")
         time.sleep(0.3)
+        stream_start = self._start_metrics()
         
         total_encrypted_size = len(encrypted_data)
         remaining = total_encrypted_size
@@ -542,6 +959,7 @@ class GCM_SIV_FileProcessor:
             chunk = encrypted_data[total_sent:total_sent + chunk_size]
             if self.verbose:
                 print(f"Sending encrypted chunk {chunk_count}: {len(chunk)} bytes")
+            cipher_hash.update(chunk)
             self.ser.write(chunk)
             self.ser.flush()
             total_sent += len(chunk)
@@ -568,6 +986,7 @@ class GCM_SIV_FileProcessor:
                         if decoded:
                             received_b64_data = decoded
                             decrypted_data += decoded
+                            plain_hash.update(decoded)
                             self.total_processed += len(decoded)
                             if self.verbose:
                                 print(f"✓ Received decrypted chunk {chunk_count}: {len(decoded)} bytes")
@@ -590,6 +1009,8 @@ class GCM_SIV_FileProcessor:
                     elif 'STREAM_STATS' in line:
                         if self.verbose:
                             print(f"MCU Stream Stats: {line}")
+                        if ':' in line:
+                            self.mcu_stats = parse_metrics(line)
                     
                     elif 'ERROR' in line:
                         print(f"MCU error: {line}")
@@ -644,10 +1065,15 @@ class GCM_SIV_FileProcessor:
         summary_msg = self.wait_for_message('SUMMARY:', 5)
         if summary_msg and self.verbose:
             print(f"MCU Summary: {summary_msg}")
+        self._finish_metrics(summary_msg, stream_start)
         
         if decrypted_data:
             with open(output_file, 'wb') as f:
                 f.write(decrypted_data)
+            self.digests = {
+                "ciphertext_in": cipher_hash.hexdigest(),
+                "plaintext_out": plain_hash.hexdigest(),
+            }
                 
             print(f"✓ Streaming decryption successful: {output_file}")
             if self.verbose:
@@ -713,6 +1139,9 @@ class GCM_SIV_FileProcessor:
                 print("MCU not ready")
                 return False
                 
+            if not self.select_engine():
+                return False
+                
             if not self.send_and_wait(b'n', 'NEW_STREAM_MODE'):
                 return False
                 
@@ -792,13 +1221,21 @@ class GCM_SIV_FileProcessor:
 # ==================== 跑分测试框架 ====================
 
 class BenchmarkRunner:
-    def __init__(self, port: str, project_name: str, output_dir: str = "benchmark_results"):
+    def __init__(self, port: str, project_name: str, output_dir: str = "benchmark_results",
+                 capabilities: Optional[Dict[str, Any]] = None,
+                 engines: Optional[List[str]] = None, inline_verify: bool = False):
         self.port = port
         self.project_name = project_name
         self.output_dir = output_dir
+        self.capabilities = capabilities or {}
+        self.engines = engines  # 双模式固件上交替测试的引擎（A/B），None表示不切换
+        self.inline_verify = inline_verify  # 单会话往返校验（不写临时文件）
         self.results = {
             "project": project_name,
             "timestamp": datetime.now().isoformat(),
+            "capabilities": self.capabilities,
+            "engines": engines,
+            "mode": "inline_verify" if inline_verify else "encrypt_decrypt",
             "test_cases": [],
             "summary": {}
         }
@@ -827,23 +1264,43 @@ class BenchmarkRunner:
             ("16MB", 16 * 1024 * 1024, 1)
         ]
         
+        # 测试数据的类型和种子（见 generate_data），生成的文件缓存在 data_cache_dir
+        self.data_kind = "printable"
+        self.data_seed = TEST_DATA_SEED
+        self.data_cache_dir = os.path.join(output_dir, "test_data_cache")
+        self.last_comparison = None  # 最近一次 verify_files_identical 的比较结果（compare_files）
+        
+        # 无人值守（测试活动）：出错时自动恢复而不是等待手动复位；deadline 之后不再开始新的迭代
+        self.unattended = False
+        self.deadline = None
+        self.max_retries = MAX_RETRIES
+        self.recoveries = 0
+        self.port_failed = False  # 自动恢复失败，跳过该端口剩下的测试
+        
         # 默认key和nonce
         self.default_key = bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
         self.default_nonce = bytes([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16])
         self.default_aad = b""  # 空AAD
         
+    def _cached_test_data(self, size: int) -> str:
+        """返回 (size, 种子, 类型) 对应的缓存文件路径，不存在时生成"""
+        os.makedirs(self.data_cache_dir, exist_ok=True)
+        path = os.path.join(self.data_cache_dir, f"{self.data_kind}_{self.data_seed}_{size}.bin")
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(generate_data(size, self.data_seed, self.data_kind))
+            os.replace(tmp_path, path)
+        return path
+    
+    def generate_test_data(self, size: int) -> bytes:
+        """测试数据（与 generate_test_file 写出的内容相同）"""
+        with open(self._cached_test_data(size), 'rb') as f:
+            return f.read()
+    
     def generate_test_file(self, size: int, filename: str) -> str:
-        """生成随机测试文件"""
-        random.seed(42)  # 固定种子确保可重复
-        chars = string.ascii_letters + string.digits + string.punctuation
-        
-        with open(filename, 'wb') as f:
-            remaining = size
-            while remaining > 0:
-                chunk_size = min(remaining, 1024)
-                chunk = ''.join(random.choice(chars) for _ in range(chunk_size)).encode('utf-8')
-                f.write(chunk[:chunk_size])
-                remaining -= chunk_size
+        """生成测试文件（从缓存复制，同样的大小、种子和类型不会重新生成）"""
+        shutil.copyfile(self._cached_test_data(size), filename)
         
         actual_size = os.path.getsize(filename)
         if actual_size != size:
@@ -852,22 +1309,20 @@ class BenchmarkRunner:
         return filename
     
     def verify_files_identical(self, file1: str, file2: str) -> bool:
-        """验证两个文件是否相同"""
+        """验证两个文件是否相同（分块比较）；比较结果保存在 last_comparison"""
         try:
-            with open(file1, 'rb') as f1, open(file2, 'rb') as f2:
-                content1 = f1.read()
-                content2 = f2.read()
-                
-                if content1 == content2:
-                    return True
-                else:
-                    min_len = min(len(content1), len(content2))
-                    differences = sum(1 for i in range(min_len) if content1[i] != content2[i])
-                    print(f"  ✗ Files differ: {differences} differences")
-                    return False
+            report = compare_files(file1, file2, CHUNK_SIZE)
         except Exception as e:
             print(f"  ✗ Error comparing files: {e}")
+            self.last_comparison = None
             return False
+        self.last_comparison = report
+        if report["identical"]:
+            return True
+        print(f"  ✗ Files differ: {report['differences']} differences, first at byte {report['first_diff']}"
+              + (f", sizes {report['size1']} vs {report['size2']}" if report["size1"] != report["size2"] else ""))
+        print(f"    Affected chunks ({len(report['chunks'])}): {format_chunk_ranges(report['chunks'])}")
+        return False
     
     def calculate_hash(self, filename: str) -> str:
         """计算文件哈希值"""
@@ -875,11 +1330,12 @@ class BenchmarkRunner:
             return hashlib.sha256(f.read()).hexdigest()
     
     def run_single_iteration(self, file_size: int, iteration: int, 
-                           is_warmup: bool = False) -> Dict[str, Any]:
+                           is_warmup: bool = False, engine: Optional[str] = None) -> Dict[str, Any]:
         """运行单次迭代：加密->解密->验证"""
         result = {
             "iteration": iteration,
             "is_warmup": is_warmup,
+            "engine": engine,
             "file_size": file_size,
             "success": False,
             "encryption_time": 0,
@@ -889,12 +1345,19 @@ class BenchmarkRunner:
             "decryption_throughput": 0,  # B/s
             "total_throughput": 0,       # B/s
             "error": None,
-            "attempts": 1
+            "attempts": 1,
+            "firmware": {k: self.capabilities.get(k) for k in ("algorithm", "version", "build")},
+            "features": []  # 本框架使用基本流式协议
         }
         
+        if self.inline_verify:
+            return self.run_inline_iteration(result, engine)
+        
         try:
             # 生成唯一文件名
             base_name = f"test_{file_size}_{iteration}_{'warmup' if is_warmup else 'main'}"
+            if engine:
+                base_name += f"_{engine}"
             input_file = os.path.join(self.output_dir, f"{base_name}_input.bin")
             encrypted_file = os.path.join(self.output_dir, f"{base_name}_encrypted.bin")
             decrypted_file = os.path.join(self.output_dir, f"{base_name}_decrypted.bin")
@@ -903,11 +1366,8 @@ class BenchmarkRunner:
             print(f"  Generating {file_size} bytes test file...")
             self.generate_test_file(file_size, input_file)
             
-            # 记录原始文件哈希
-            original_hash = self.calculate_hash(input_file)
-            
             # 创建处理器实例
-            processor = GCM_SIV_FileProcessor(self.port, verbose=False, show_progress=False)
+            processor = GCM_SIV_FileProcessor(self.port, verbose=False, show_progress=False, engine=engine)
             
             # 加密测试
             print(f"  Encrypting...")
@@ -924,6 +1384,11 @@ class BenchmarkRunner:
                 result["error"] = "Encryption failed"
                 return result
             
+            # 加密过程中算出的摘要（原始文件哈希不再单独读文件计算）
+            encrypt_digests = processor.digests
+            encrypt_metrics = processor.mcu_metrics
+            original_hash = encrypt_digests["plaintext_in"]
+            
             # 验证加密文件
             if not processor.verify_encrypted_file(encrypted_file):
                 result["error"] = "Encrypted file verification failed"
@@ -943,11 +1408,17 @@ class BenchmarkRunner:
                 result["error"] = "Decryption failed"
                 return result
             
-            # 验证解密结果
+            # 验证解密结果：比较流式摘要；不一致时才读文件找出差异
             print(f"  Verifying...")
-            verification_success = self.verify_files_identical(input_file, decrypted_file)
-            
+            decrypt_digests = processor.digests
+            result["mcu"] = {"encrypt": encrypt_metrics, "decrypt": processor.mcu_metrics}
+            verification_success = (decrypt_digests["ciphertext_in"] == encrypt_digests["ciphertext_out"] and
+                                    decrypt_digests["plaintext_out"] == original_hash)
             if not verification_success:
+                self.verify_files_identical(input_file, decrypted_file)
+                if self.last_comparison:
+                    result["mismatch"] = {k: self.last_comparison[k]
+                                          for k in ("first_diff", "differences", "chunks")}
                 result["error"] = "Verification failed"
                 return result
             
@@ -969,7 +1440,9 @@ class BenchmarkRunner:
                 "encryption_throughput": encryption_throughput,
                 "decryption_throughput": decryption_throughput,
                 "total_throughput": total_throughput,
-                "original_hash": original_hash
+                "original_hash": original_hash,
+                "ciphertext_hash": encrypt_digests["ciphertext_out"],
+                "decrypted_hash": decrypt_digests["plaintext_out"]
             })
             
             print(f"  ✓ Success: Enc={encryption_time:.3f}s ({encryption_throughput/1024:.1f} KB/s), "
@@ -987,118 +1460,344 @@ class BenchmarkRunner:
             print(f"  ✗ Exception: {e}")
             return result
     
-    def handle_exception(self, file_size: int, iteration: int, error: str):
-        """处理异常情况"""
+    def run_inline_iteration(self, result: Dict[str, Any], engine: Optional[str]) -> Dict[str, Any]:
+        """单会话往返校验：一次握手，逐块加密后立即解密并在内存中比较"""
+        file_size = result["file_size"]
+        try:
+            print(f"  Generating {file_size} bytes test data...")
+            data = self.generate_test_data(file_size)
+            
+            processor = GCM_SIV_FileProcessor(self.port, verbose=False, show_progress=False, engine=engine)
+            
+            print(f"  Round-trip (encrypt -> decrypt -> compare)...")
+            start = time.time()
+            success, encryption_time, decryption_time = processor.roundtrip_data(
+                data,
+                custom_key=self.default_key,
+                custom_nonce=self.default_nonce,
+                custom_aad=self.default_aad
+            )
+            elapsed = time.time() - start
+            
+            if not success:
+                result["error"] = "Round-trip verification failed"
+                return result
+            
+            total_time = encryption_time + decryption_time
+            result.update({
+                "success": True,
+                "encryption_time": encryption_time,
+                "decryption_time": decryption_time,
+                "total_time": total_time,
+                "session_time": elapsed,
+                "encryption_throughput": file_size / encryption_time if encryption_time > 0 else 0,
+                "decryption_throughput": file_size / decryption_time if decryption_time > 0 else 0,
+                "total_throughput": file_size / total_time if total_time > 0 else 0,
+                "original_hash": hashlib.sha256(data).hexdigest(),
+                "mcu": {"roundtrip": processor.mcu_metrics}
+            })
+            
+            print(f"  ✓ Success: Enc={encryption_time:.3f}s ({result['encryption_throughput']/1024:.1f} KB/s), "
+                  f"Dec={decryption_time:.3f}s ({result['decryption_throughput']/1024:.1f} KB/s), "
+                  f"session {elapsed:.3f}s")
+            return result
+            
+        except Exception as e:
+            result["error"] = str(e)
+            print(f"  ✗ Exception: {e}")
+            return result
+    
+    def run_phase_suite(self, test_suite: List[Tuple[str, int, int]]) -> List[Dict[str, Any]]:
+        """分阶段分解（需要固件支持 OPT_BENCH）：对每个引擎和文件大小分别测量
+        握手（空数据流的会话）、链路（回显同样字节数）、片上加密（只加密同样的块数，按MCU
+        周期数换算）和一次完整加密；完整加密时间中剩下的部分计为协议开销（逐块等待应答、
+        主机端的固定等待等）。链路和加密重叠时（多个接收缓冲区）超出部分记为 overlap"""
+        if not self.capabilities.get("options", 0) & OPT_BENCH:
+            print("MCU firmware does not support phase benchmark commands (OPT_BENCH)")
+            return []
+        window = max(1, self.capabilities.get("buffers", 1))
+        breakdown = []
+        
+        for engine in self.engines or [None]:
+            for file_name, file_size, _ in test_suite:
+                # 无人值守时上一项失败后先自动恢复（MCU可能停在未完成的会话中）
+                if breakdown and not breakdown[-1]["success"] and self.unattended and not self.port_failed:
+                    self.wait_for_reset()
+                if self.port_failed or self.out_of_time():
+                    print(f"跳过分阶段测试 {file_name}: {'port failed' if self.port_failed else 'time budget'}")
+                    continue
+                print(f"\n分阶段测试: {file_name}" + (f" / {engine}" if engine else ""))
+                processor = GCM_SIV_FileProcessor(self.port, verbose=False, show_progress=False, engine=engine)
+                entry = {"file_name": file_name, "file_size": file_size, "engine": engine, "success": False}
+                breakdown.append(entry)
+                
+                handshake = processor.measure_handshake(self.default_key, self.default_nonce, self.default_aad)
+                echo = processor.measure_echo(file_size, window) if handshake else None
+                chunks = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+                crypto = processor.measure_crypto(chunks, min(CHUNK_SIZE, file_size)) if echo else None
+                if not crypto or not crypto.get("cpu_hz"):
+                    entry["error"] = "Phase measurement failed"
+                    print(f"  ✗ {entry['error']}")
+                    continue
+                
+                # 一次完整加密作为总时间
+                input_file = os.path.join(self.output_dir, f"phase_{file_size}_input.bin")
+                encrypted_file = os.path.join(self.output_dir, f"phase_{file_size}_encrypted.bin")
+                self.generate_test_file(file_size, input_file)
+                start = time.time()
+                ok = processor.encrypt_file(input_file, encrypted_file, custom_key=self.default_key,
+                                            custom_nonce=self.default_nonce, custom_aad=self.default_aad)
+                total = time.time() - start
+                for f in (input_file, encrypted_file):
+                    if os.path.exists(f):
+                        os.remove(f)
+                if not ok:
+                    entry["error"] = "Encryption failed"
+                    print(f"  ✗ {entry['error']}")
+                    continue
+                
+                echo_time, echo_ok = echo
+                phases = {
+                    "handshake": handshake["total"],
+                    "link": echo_time,
+                    "crypto": crypto["cycles"] / crypto["cpu_hz"],
+                }
+                remainder = total - sum(phases.values())
+                phases["protocol"] = max(0.0, remainder)
+                entry.update({
+                    "success": echo_ok,
+                    "total": total,
+                    "phases": phases,
+                    "overlap": max(0.0, -remainder),
+                    "handshake_detail": handshake,
+                    "echo_ok": echo_ok,
+                    "link_bytes_per_s": file_size / echo_time if echo_time > 0 else 0,
+                    "crypto_bench": crypto,
+                    "cycles_per_byte": crypto["cycles"] / crypto["bytes"] if crypto.get("bytes") else None,
+                    "mcu": processor.mcu_metrics,
+                })
+                if not echo_ok:
+                    entry["error"] = "Echo mismatch"
+                print(f"  总 {total:.3f}s = " + " + ".join(f"{name} {phases[name]:.3f}s" for name, _ in PHASES)
+                      + (f" (重叠 {entry['overlap']:.3f}s)" if entry["overlap"] else ""))
+        
+        self.results.setdefault("phase_breakdown", []).extend(breakdown)
+        return breakdown
+    
+    def display_phase_breakdown(self, width: int = 50):
+        """按文件大小显示各阶段占完整加密时间的比例（堆叠条形图）"""
+        rows = [r for r in self.results.get("phase_breakdown", []) if r.get("phases")]
+        if not rows:
+            return
+        print(f"\n分阶段分解（完整加密时间）: " + "  ".join(f"{char} {name}" for name, char in PHASES))
+        print(f"{'文件大小':<16} {'总(s)':>9} {'握手':>7} {'链路':>7} {'加密':>7} {'协议':>7}  分解")
+        for r in rows:
+            file_name = r["file_name"] + (f"/{r['engine']}" if r.get("engine") else "")
+            span = max(r["total"], sum(r["phases"].values()))
+            shares = [r["phases"][name] / span if span > 0 else 0 for name, _ in PHASES]
+            bar = "".join(char * round(share * width) for (_, char), share in zip(PHASES, shares))
+            print(f"{file_name:<16} {r['total']:>9.3f} " + " ".join(f"{share * 100:>6.1f}%" for share in shares)
+                  + f"  {bar}")
+    
+    def run_phase_benchmark(self):
+        """只运行分阶段分解测试（全部文件大小，每个大小一次）"""
+        print(f"{'='*60}")
+        print(f"{self.project_name} 分阶段分解测试")
+        print(f"{'='*60}")
+        self.run_phase_suite(self.small_files + self.medium_files + self.large_files)
+        self.display_phase_breakdown()
+        self.save_results()
+    
+    def handle_exception(self, file_size: int, iteration: int, error: str) -> bool:
+        """处理异常情况（返回False表示无法恢复）"""
         print(f"\n⚠️ 异常发生!")
         print(f"  文件大小: {file_size} bytes")
         print(f"  迭代次数: {iteration}")
         print(f"  错误信息: {error}")
-        print("\n请手动复位MCU，然后按回车键继续...")
-        input()
+        return self.wait_for_reset()
+    
+    def wait_for_reset(self) -> bool:
+        """等待MCU回到空闲状态：交互运行时由用户手动复位，无人值守时自动恢复；
+        返回False表示放弃该端口"""
+        if not self.unattended:
+            print("\n请手动复位MCU，然后按回车键继续...")
+            input()
+            return True
+        for attempt in range(1, RECOVERY_ATTEMPTS + 1):
+            print(f"  自动恢复 ({attempt}/{RECOVERY_ATTEMPTS})...")
+            if GCM_SIV_FileProcessor(self.port, verbose=False, show_progress=False).recover():
+                self.recoveries += 1
+                print("  ✓ MCU已恢复")
+                return True
+            if attempt < RECOVERY_ATTEMPTS:
+                time.sleep(RECOVERY_BACKOFF * attempt)
+        print(f"  ✗ 自动恢复失败，跳过端口 {self.port} 剩下的测试")
+        self.port_failed = True
+        return False
+    
+    def out_of_time(self) -> bool:
+        """测试活动的时间预算是否已用完"""
+        return self.deadline is not None and time.time() >= self.deadline
 
     def run_test_suite(self, test_suite: List[Tuple[str, int, int]], 
                   needs_warmup: bool = False) -> List[Dict[str, Any]]:
-        """运行一个测试套件（修改为出错重试当前迭代）"""
+        """运行一个测试套件（修改为出错重试当前迭代）；设置了 engines 时各引擎交替运行，
+        每个引擎单独记录结果"""
         suite_results = []
+        engines = self.engines or [None]
         
         for file_name, file_size, iterations in test_suite:
+            skip_reason = "port failed" if self.port_failed else "time budget" if self.out_of_time() else None
+            if skip_reason:
+                print(f"跳过 {file_name}: {skip_reason}")
+                suite_results.extend({"file_name": file_name, "file_size": file_size, "engine": engine,
+                                      "iterations": [], "summary": {}, "skipped": skip_reason}
+                                     for engine in engines)
+                continue
+            
             print(f"\n{'='*60}")
             print(f"测试文件: {file_name} ({file_size} bytes)")
             print(f"{'='*60}")
             
-            file_results = {
-                "file_name": file_name,
-                "file_size": file_size,
-                "iterations": [],
-                "summary": {}
+            engine_results = {
+                engine: {
+                    "file_name": file_name,
+                    "file_size": file_size,
+                    "engine": engine,
+                    "iterations": [],
+                    "summary": {}
+                }
+                for engine in engines
             }
             
             for i in range(1, iterations + 1):
-                current_iteration = i
-                max_retries = 3  # 最大重试次数
-                retry_count = 0
-                iteration_completed = False
-                iteration_result = None
-                
-                while not iteration_completed and retry_count <= max_retries:
-                    # 小文件需要预热迭代
-                    if needs_warmup and i == 1 and retry_count == 0:
-                        print("  运行预热迭代...")
-                        warmup_result = self.run_single_iteration(file_size, i, is_warmup=True)
-                        
-                        if not warmup_result["success"]:
-                            print(f"  预热迭代失败: {warmup_result.get('error', 'Unknown error')}")
-                            self.handle_exception(file_size, i, warmup_result.get('error', 'Warmup failed'))
-                            retry_count += 1
-                            continue
+                if self.port_failed or self.out_of_time():
+                    print(f"  停止: {'port failed' if self.port_failed else 'time budget'}（已完成 {i - 1}/{iterations} 次迭代）")
+                    break
+                # A/B交替：奇数迭代按 A,B 顺序，偶数迭代按 B,A 顺序，抵消温漂等随时间变化的偏差
+                order = engines if i % 2 else engines[::-1]
+                for engine in order:
+                    if engine:
+                        print(f"  引擎: {engine}")
+                    iteration_result = self._run_iteration(file_size, i, iterations, needs_warmup, engine)
                     
-                    # 主测试迭代
-                    print(f"  运行迭代 {i}/{iterations}" + (f" (重试 {retry_count})" if retry_count > 0 else "") + "...")
-                    main_result = self.run_single_iteration(file_size, i, is_warmup=(needs_warmup and i == 1))
+                    # 记录迭代结果（无论成功还是失败）
+                    if iteration_result is not None:
+                        if not iteration_result["is_warmup"]:
+                            engine_results[engine]["iterations"].append(iteration_result)
+            
+            for file_results in engine_results.values():
+                # 计算该文件的统计信息
+                if file_results["iterations"]:
+                    successful_iterations = [r for r in file_results["iterations"] if r["success"]]
+                    if successful_iterations:
+                        # 吞吐量统计
+                        enc_throughputs = [r["encryption_throughput"] for r in successful_iterations]
+                        dec_throughputs = [r["decryption_throughput"] for r in successful_iterations]
+                        total_throughputs = [r["total_throughput"] for r in successful_iterations]
                     
-                    if main_result["success"]:
+                        file_results["summary"] = {
+                            "successful_iterations": len(successful_iterations),
+                            "failed_iterations": len(file_results["iterations"]) - len(successful_iterations),
+                            "total_attempts": sum(r.get('attempts', 1) for r in file_results["iterations"]),
+                            "avg_encryption_throughput": statistics.mean(enc_throughputs) if enc_throughputs else 0,
+                            "max_encryption_throughput": max(enc_throughputs) if enc_throughputs else 0,
+                            "min_encryption_throughput": min(enc_throughputs) if enc_throughputs else 0,
+                            "std_encryption_throughput": statistics.stdev(enc_throughputs) if len(enc_throughputs) > 1 else 0,
+                            "avg_decryption_throughput": statistics.mean(dec_throughputs) if dec_throughputs else 0,
+                            "max_decryption_throughput": max(dec_throughputs) if dec_throughputs else 0,
+                            "min_decryption_throughput": min(dec_throughputs) if dec_throughputs else 0,
+                            "std_decryption_throughput": statistics.stdev(dec_throughputs) if len(dec_throughputs) > 1 else 0,
+                            "avg_total_throughput": statistics.mean(total_throughputs) if total_throughputs else 0,
+                            "max_total_throughput": max(total_throughputs) if total_throughputs else 0,
+                            "min_total_throughput": min(total_throughputs) if total_throughputs else 0,
+                            "std_total_throughput": statistics.stdev(total_throughputs) if len(total_throughputs) > 1 else 0
+                        }
+                        mcu_summary = self.summarize_mcu_metrics(successful_iterations)
+                        if mcu_summary:
+                            file_results["summary"]["mcu"] = mcu_summary
+            
+                suite_results.append(file_results)
+        
+        return suite_results
+
+    @staticmethod
+    def summarize_mcu_metrics(iterations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """各操作（encrypt/decrypt/roundtrip）MCU统计的平均值：片上周期/字节与端到端吞吐量分开"""
+        summary = {}
+        operations = {op for r in iterations for op in (r.get("mcu") or {})}
+        for op in sorted(operations):
+            metrics = [r["mcu"][op] for r in iterations if (r.get("mcu") or {}).get(op)]
+            entry = {}
+            for key in ("cycles_per_byte", "crypto_bytes_per_s", "link_bytes_per_s", "crypto_share"):
+                values = [m[key] for m in metrics if m.get(key) is not None]
+                if values:
+                    entry[f"avg_{key}"] = statistics.mean(values)
+            bounds = [m["bound"] for m in metrics if "bound" in m]
+            if bounds:
+                entry["bound"] = max(set(bounds), key=bounds.count)
+            high_water = [m["buffers_hw"] for m in metrics if "buffers_hw" in m]
+            if high_water:
+                entry["max_buffers_hw"] = max(high_water)
+            if entry:
+                summary[op] = entry
+        return summary
+
+    def _run_iteration(self, file_size: int, i: int, iterations: int, needs_warmup: bool,
+                       engine: Optional[str]) -> Optional[Dict[str, Any]]:
+        """运行一次迭代（小文件第一次迭代前先预热），失败时重试"""
+        max_retries = self.max_retries
+        retry_count = 0
+        iteration_completed = False
+        iteration_result = None
+        
+        while not iteration_completed and retry_count <= max_retries:
+            # 小文件需要预热迭代
+            if needs_warmup and i == 1 and retry_count == 0:
+                print("  运行预热迭代...")
+                warmup_result = self.run_single_iteration(file_size, i, is_warmup=True, engine=engine)
+                
+                if not warmup_result["success"]:
+                    print(f"  预热迭代失败: {warmup_result.get('error', 'Unknown error')}")
+                    if not self.handle_exception(file_size, i, warmup_result.get('error', 'Warmup failed')):
+                        return dict(warmup_result, is_warmup=False)  # 无法恢复：记录为失败的迭代
+                    retry_count += 1
+                    continue
+            
+            # 主测试迭代
+            print(f"  运行迭代 {i}/{iterations}" + (f" (重试 {retry_count})" if retry_count > 0 else "") + "...")
+            main_result = self.run_single_iteration(file_size, i, is_warmup=(needs_warmup and i == 1), engine=engine)
+            
+            if main_result["success"]:
+                iteration_result = main_result
+                iteration_completed = True
+                print(f"  ✓ 迭代 {i} 成功完成")
+            else:
+                retry_count += 1
+                error_msg = main_result.get('error', 'Unknown error')
+                print(f"  ✗ 迭代 {i} 失败: {error_msg}")
+                
+                if retry_count <= max_retries:
+                    print(f"  准备重试 ({retry_count}/{max_retries})...")
+                    if not self.handle_exception_and_retry(file_size, i, error_msg, retry_count, max_retries):
                         iteration_result = main_result
                         iteration_completed = True
-                        print(f"  ✓ 迭代 {i} 成功完成")
-                    else:
-                        retry_count += 1
-                        error_msg = main_result.get('error', 'Unknown error')
-                        print(f"  ✗ 迭代 {i} 失败: {error_msg}")
-                        
-                        if retry_count <= max_retries:
-                            print(f"  准备重试 ({retry_count}/{max_retries})...")
-                            self.handle_exception_and_retry(file_size, i, error_msg, retry_count, max_retries)
-                        else:
-                            print(f"  ✗ 达到最大重试次数 ({max_retries})，放弃迭代 {i}")
-                            iteration_result = main_result  # 记录失败结果
-                            iteration_completed = True
-                
-                # 记录迭代结果（无论成功还是失败）
-                if iteration_result is not None:
-                    if not iteration_result["is_warmup"]:
-                        file_results["iterations"].append(iteration_result)
-            
-            # 计算该文件的统计信息
-            if file_results["iterations"]:
-                successful_iterations = [r for r in file_results["iterations"] if r["success"]]
-                if successful_iterations:
-                    # 吞吐量统计
-                    enc_throughputs = [r["encryption_throughput"] for r in successful_iterations]
-                    dec_throughputs = [r["decryption_throughput"] for r in successful_iterations]
-                    total_throughputs = [r["total_throughput"] for r in successful_iterations]
-                    
-                    file_results["summary"] = {
-                        "successful_iterations": len(successful_iterations),
-                        "failed_iterations": len(file_results["iterations"]) - len(successful_iterations),
-                        "total_attempts": sum(r.get('attempts', 1) for r in file_results["iterations"]),
-                        "avg_encryption_throughput": statistics.mean(enc_throughputs) if enc_throughputs else 0,
-                        "max_encryption_throughput": max(enc_throughputs) if enc_throughputs else 0,
-                        "min_encryption_throughput": min(enc_throughputs) if enc_throughputs else 0,
-                        "std_encryption_throughput": statistics.stdev(enc_throughputs) if len(enc_throughputs) > 1 else 0,
-                        "avg_decryption_throughput": statistics.mean(dec_throughputs) if dec_throughputs else 0,
-                        "max_decryption_throughput": max(dec_throughputs) if dec_throughputs else 0,
-                        "min_decryption_throughput": min(dec_throughputs) if dec_throughputs else 0,
-                        "std_decryption_throughput": statistics.stdev(dec_throughputs) if len(dec_throughputs) > 1 else 0,
-                        "avg_total_throughput": statistics.mean(total_throughputs) if total_throughputs else 0,
-                        "max_total_throughput": max(total_throughputs) if total_throughputs else 0,
-                        "min_total_throughput": min(total_throughputs) if total_throughputs else 0,
-                        "std_total_throughput": statistics.stdev(total_throughputs) if len(total_throughputs) > 1 else 0
-                    }
-            
-            suite_results.append(file_results)
+                else:
+                    print(f"  ✗ 达到最大重试次数 ({max_retries})，放弃迭代 {i}")
+                    iteration_result = main_result  # 记录失败结果
+                    iteration_completed = True
         
-        return suite_results
+        return iteration_result
 
     def handle_exception_and_retry(self, file_size: int, iteration: int, error: str, 
-                                retry_count: int, max_retries: int):
-        """处理异常并准备重试"""
+                                retry_count: int, max_retries: int) -> bool:
+        """处理异常并准备重试（返回False表示无法恢复）"""
         print(f"\n⚠️ 异常发生!")
         print(f"  文件大小: {file_size} bytes")
         print(f"  迭代次数: {iteration}")
         print(f"  错误信息: {error}")
         print(f"  重试次数: {retry_count}/{max_retries}")
-        print("\n请手动复位MCU，然后按回车键继续重试...")
-        input()
+        return self.wait_for_reset()
     
     def calculate_overall_summary(self):
         """计算总体统计信息"""
@@ -1140,6 +1839,31 @@ class BenchmarkRunner:
                 "overall_min_total_throughput": min(all_total_throughputs),
                 "overall_std_total_throughput": statistics.stdev(all_total_throughputs) if len(all_total_throughputs) > 1 else 0
             }
+        else:
+            self.results["summary"] = {
+                "total_test_cases": len(self.results["test_cases"]),
+                "total_successful_iterations": 0,
+                "total_failed_iterations": sum(1 for tc in self.results["test_cases"]
+                                               for r in tc["iterations"] if not r["success"]),
+                "success_rate": 0
+            }
+        
+        if self.engines:
+            self.results["summary"]["engines"] = self.compare_engines()
+    
+    def compare_engines(self) -> Dict[str, Any]:
+        """A/B对比：每个文件大小下各引擎的平均吞吐量（B/s）"""
+        comparison = {}
+        for test_case in self.results["test_cases"]:
+            summary = test_case.get("summary", {})
+            if "avg_encryption_throughput" not in summary:
+                continue
+            comparison.setdefault(test_case["file_name"], {})[test_case.get("engine")] = {
+                "avg_encryption_throughput": summary["avg_encryption_throughput"],
+                "avg_decryption_throughput": summary["avg_decryption_throughput"],
+                "avg_total_throughput": summary["avg_total_throughput"]
+            }
+        return comparison
     
     def display_results_table(self):
         """在终端显示结果表格（包含重试信息）"""
@@ -1148,7 +1872,7 @@ class BenchmarkRunner:
         print("="*100)
         
         # 总体统计
-        if "summary" in self.results:
+        if "overall_avg_encryption_throughput" in self.results["summary"]:
             summary = self.results["summary"]
             print(f"\n总体统计:")
             print(f"  成功迭代: {summary['total_successful_iterations']}")
@@ -1167,6 +1891,8 @@ class BenchmarkRunner:
         
         for test_case in self.results["test_cases"]:
             file_name = test_case["file_name"]
+            if test_case.get("engine"):
+                file_name = f"{file_name}/{test_case['engine']}"
             
             if test_case["iterations"]:
                 for i, iteration in enumerate(test_case["iterations"]):
@@ -1183,13 +1909,43 @@ class BenchmarkRunner:
                     
                     print(f"{file_name:<12} {i+1:<6} {status:<10} {attempts:<6} "
                         f"{enc_tp:<12.1f} {dec_tp:<12.1f} {total_tp:<12.1f}")
+            elif test_case.get("skipped"):
+                print(f"{file_name:<12} {'-':<6} {'- 跳过':<10} {test_case['skipped']}")
         
         print("-"*110)
+        
+        # MCU报告的统计：片上加解密速度与链路决定的端到端吞吐量
+        mcu_rows = [(tc, op, m) for tc in self.results["test_cases"]
+                    for op, m in tc.get("summary", {}).get("mcu", {}).items()]
+        if mcu_rows:
+            print(f"\nMCU统计（片上 vs 端到端）:")
+            print(f"{'文件大小':<16} {'操作':<10} {'周期/字节':<10} {'片上(KB/s)':<12} {'端到端(KB/s)':<14} {'加解密占比':<10} {'瓶颈':<8}")
+            for test_case, op, m in mcu_rows:
+                file_name = test_case["file_name"]
+                if test_case.get("engine"):
+                    file_name = f"{file_name}/{test_case['engine']}"
+                cpb = f"{m['avg_cycles_per_byte']:.1f}" if "avg_cycles_per_byte" in m else "-"
+                crypto = f"{m['avg_crypto_bytes_per_s'] / 1024:.1f}" if "avg_crypto_bytes_per_s" in m else "-"
+                link = f"{m['avg_link_bytes_per_s'] / 1024:.1f}" if "avg_link_bytes_per_s" in m else "-"
+                share = f"{m['avg_crypto_share'] * 100:.0f}%" if "avg_crypto_share" in m else "-"
+                print(f"{file_name:<16} {op:<10} {cpb:<10} {crypto:<12} {link:<14} {share:<10} {m.get('bound', '-'):<8}")
+        
+        # A/B对比（同一块开发板上交替运行）
+        comparison = self.results.get("summary", {}).get("engines")
+        if comparison and len(self.engines) == 2:
+            a, b = self.engines
+            print(f"\n引擎对比 ({a} / {b}，总吞吐量):")
+            for file_name, by_engine in comparison.items():
+                if a in by_engine and b in by_engine and by_engine[b]["avg_total_throughput"] > 0:
+                    ta = by_engine[a]["avg_total_throughput"]
+                    tb = by_engine[b]["avg_total_throughput"]
+                    print(f"  {file_name:<10} {ta/1024:>8.1f} KB/s {tb/1024:>8.1f} KB/s  x{ta/tb:.2f}")
     
     def save_results(self):
         """保存结果到JSON文件"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = os.path.join(self.output_dir, f"benchmark_{self.project_name}_{timestamp}.json")
+        self.results["test_data"] = {"kind": self.data_kind, "seed": self.data_seed}
         
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(self.results, f, indent=2, ensure_ascii=False)
@@ -1198,37 +1954,34 @@ class BenchmarkRunner:
         return filename
     
     def run_full_benchmark(self):
-        """运行完整的跑分测试"""
+        """运行完整的跑分测试（small_files / medium_files / large_files 三个阶段），返回结果文件名"""
         print(f"{'='*60}")
         print(f"开始 {self.project_name} 跑分测试")
         print(f"串口: {self.port}")
         print(f"时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"{'='*60}")
         
-        print("\n等待用户确认...")
-        print("请确保已烧录正确的程序到MCU，然后按回车键开始测试")
-        input()
-        
-        # 测试小文件（需要预热）
-        print(f"\n{'#'*60}")
-        print(f"第一阶段: 测试小文件 (需要预热迭代)")
-        print(f"{'#'*60}")
-        small_results = self.run_test_suite(self.small_files, needs_warmup=True)
-        self.results["test_cases"].extend(small_results)
-        
-        # 测试中等文件
-        print(f"\n{'#'*60}")
-        print(f"第二阶段: 测试中等文件")
-        print(f"{'#'*60}")
-        medium_results = self.run_test_suite(self.medium_files, needs_warmup=False)
-        self.results["test_cases"].extend(medium_results)
-        
-        # 测试大文件
-        print(f"\n{'#'*60}")
-        print(f"第三阶段: 测试大文件")
-        print(f"{'#'*60}")
-        large_results = self.run_test_suite(self.large_files, needs_warmup=False)
-        self.results["test_cases"].extend(large_results)
+        if self.engines:
+            print(f"引擎: {' / '.join(self.engines)} (交替运行)")
+        print(f"{'='*60}")
+        
+        if not self.unattended:
+            print("\n等待用户确认...")
+            print("请确保已烧录正确的程序到MCU，然后按回车键开始测试")
+            input()
+        
+        stages = [
+            ("第一阶段: 测试小文件 (需要预热迭代)", self.small_files, True),
+            ("第二阶段: 测试中等文件", self.medium_files, False),
+            ("第三阶段: 测试大文件", self.large_files, False),
+        ]
+        for title, test_suite, needs_warmup in stages:
+            if not test_suite:
+                continue
+            print(f"\n{'#'*60}")
+            print(title)
+            print(f"{'#'*60}")
+            self.results["test_cases"].extend(self.run_test_suite(test_suite, needs_warmup=needs_warmup))
         
         # 计算总体统计
         self.calculate_overall_summary()
@@ -1237,56 +1990,251 @@ class BenchmarkRunner:
         self.display_results_table()
         
         # 保存结果
-        self.save_results()
+        filename = self.save_results()
         
         print(f"\n{'='*60}")
         print(f"{self.project_name} 跑分测试完成!")
         print(f"{'='*60}")
+        return filename
+
+def load_campaign(path: str) -> Dict[str, Any]:
+    """读取测试活动配置（JSON）并补全默认值，例如：
+    {
+      "ports": ["COM3", {"port": "COM4", "algorithm": "sw_ascon"}, "sim://a?baud=921600"],
+      "algorithms": ["hw_aes", "sw_aes"],      // 只测这些算法（双模式固件上交替运行），空表示全部
+      "sizes": ["256B", "16KB", "1MB", 3000],  // BenchmarkRunner 中的名称或字节数，空表示全部
+      "iterations": 2,                         // 每个大小记录的迭代次数，null 使用默认值
+      "time_budget": 7200,                     // 整个活动的时间预算（秒），null 不限制
+      "output_dir": "campaign_results",
+      "inline_verify": false, "phase": false, "max_retries": 3,
+      "data_kind": "printable", "data_seed": 42
+    }
+    端口项中的 algorithm 只在固件不支持能力查询时使用"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if not config.get("ports"):
+        raise ValueError("Campaign config needs at least one port")
+    config["ports"] = [p if isinstance(p, dict) else {"port": p} for p in config["ports"]]
+    defaults = {"algorithms": [], "sizes": [], "iterations": None, "time_budget": None,
+                "output_dir": "campaign_results", "inline_verify": False, "phase": False,
+                "max_retries": MAX_RETRIES, "data_kind": "printable", "data_seed": TEST_DATA_SEED}
+    for key, value in defaults.items():
+        config.setdefault(key, value)
+    unknown = [a for a in config["algorithms"] if a not in ALGORITHM_PROJECTS]
+    if unknown:
+        raise ValueError(f"Unknown algorithms: {unknown}")
+    if config["data_kind"] not in TEST_DATA_KINDS:
+        raise ValueError(f"Unknown test data kind: {config['data_kind']}")
+    return config
+
+
+def _select_sizes(runner: BenchmarkRunner, sizes: List[Any], iterations: Optional[int]):
+    """按配置筛选 runner 的三个阶段的文件大小并设置迭代次数；不在表中的字节数按大小
+    归入小文件或大文件阶段"""
+    stages = [runner.small_files, runner.medium_files, runner.large_files]
+    if sizes:
+        by_name = {name: (name, size, its) for stage in stages for name, size, its in stage}
+        by_size = {size: (name, size, its) for stage in stages for name, size, its in stage}
+        selected = []
+        for spec in sizes:
+            entry = by_name.get(spec) or by_size.get(spec)
+            if entry is None:
+                if not isinstance(spec, int) or spec <= 0:
+                    raise ValueError(f"Unknown size: {spec}")
+                # 归入小文件阶段时第1次迭代只作预热，多运行一次才有记录的迭代
+                entry = (f"{spec}B", spec, 1 + (spec < runner.medium_files[0][1]))
+            selected.append(entry)
+        def stage_of(entry):
+            for n, stage in enumerate(stages):
+                if entry in stage:
+                    return n
+            return 0 if entry[1] < runner.medium_files[0][1] else 2
+        stages = [[e for e in selected if stage_of(e) == n] for n in range(len(stages))]
+    if iterations:
+        # 小文件阶段的第1次迭代只作预热、不记录（与交互运行的结果一致），多运行一次
+        stages = [[(name, size, iterations + (n == 0)) for name, size, _ in stage] for n, stage in enumerate(stages)]
+    runner.small_files, runner.medium_files, runner.large_files = stages
+
+
+def run_campaign(config_path: str) -> int:
+    """无人值守的测试活动：按配置依次测试每个端口（开发板或 mcu_simulator 仿真板），
+    出错时自动恢复，超出时间预算后不再开始新的迭代；每个端口保存一个结果JSON，
+    另存一个活动汇总。返回进程退出码（有失败的迭代或端口时为1）"""
+    config = load_campaign(config_path)
+    started = time.time()
+    deadline = started + config["time_budget"] if config["time_budget"] else None
+    os.makedirs(config["output_dir"], exist_ok=True)
+    
+    print("=" * 60)
+    print(f"测试活动: {config_path}")
+    print(f"端口: {', '.join(p['port'] for p in config['ports'])}")
+    if deadline:
+        print(f"时间预算: {config['time_budget']} s")
+    print("=" * 60)
+    
+    entries = []
+    for index, target in enumerate(config["ports"]):
+        port = target["port"]
+        entry = {"port": port, "status": "ok"}
+        entries.append(entry)
+        if deadline and time.time() >= deadline:
+            entry["status"] = "skipped (time budget)"
+            continue
+        port_start = time.time()
+        
+        # 识别固件；没有应答时先尝试自动恢复（MCU可能停在上一次未完成的会话中）
+        capabilities = GCM_SIV_FileProcessor(port).query_capabilities()
+        if not capabilities and GCM_SIV_FileProcessor(port, verbose=False).recover():
+            capabilities = GCM_SIV_FileProcessor(port).query_capabilities()
+        algorithm = capabilities.get("algorithm") or target.get("algorithm")
+        if algorithm not in ALGORITHM_PROJECTS:
+            print(f"✗ {port}: 无法识别固件（不支持能力查询时请在端口项中指定 algorithm）")
+            entry["status"] = "failed (no firmware reply)"
+            continue
+        available = capabilities.get("engines") or [algorithm]
+        selected = [a for a in available if not config["algorithms"] or a in config["algorithms"]]
+        if not selected:
+            print(f"- {port}: 固件算法 {', '.join(available)} 不在本次测试范围内，跳过")
+            entry["status"] = "skipped (algorithm)"
+            continue
+        engines = selected if len(available) > 1 else None
+        project_name = " vs ".join(PROJECT_NAMES[ALGORITHM_PROJECTS[a]] for a in selected)
+        
+        # 每个端口单独的输出目录（结果文件名只精确到秒），测试数据缓存共用
+        port_dir = os.path.join(config["output_dir"], f"{index}_{re.sub(r'[^0-9A-Za-z_.-]+', '_', port).strip('_')}")
+        runner = BenchmarkRunner(port, project_name, port_dir, capabilities=capabilities,
+                                 engines=engines, inline_verify=config["inline_verify"])
+        runner.unattended = True
+        runner.deadline = deadline
+        runner.max_retries = config["max_retries"]
+        runner.data_kind = config["data_kind"]
+        runner.data_seed = config["data_seed"]
+        runner.data_cache_dir = os.path.join(config["output_dir"], "test_data_cache")
+        runner.results["campaign"] = {"config": os.path.abspath(config_path), "port": port}
+        _select_sizes(runner, config["sizes"], config["iterations"])
+        
+        try:
+            if config["phase"] and capabilities.get("options", 0) & OPT_BENCH:
+                runner.run_phase_suite(runner.small_files + runner.medium_files + runner.large_files)
+                runner.display_phase_breakdown()
+            entry["results_file"] = runner.run_full_benchmark()
+        except Exception as e:
+            print(f"\n✗ {port}: 测试发生错误: {e}")
+            entry["status"] = f"failed ({e})"
+            entry["results_file"] = runner.save_results()
+        
+        summary = runner.results.get("summary", {})
+        skipped = [tc["file_name"] for tc in runner.results["test_cases"] if tc.get("skipped")]
+        # 没有跳过但也没有记录任何迭代的大小（例如只运行了预热迭代）不算通过
+        unrecorded = [tc["file_name"] for tc in runner.results["test_cases"]
+                      if not tc.get("skipped") and not tc["iterations"]]
+        entry.update({
+            "project": project_name,
+            "algorithms": selected,
+            "successful_iterations": summary.get("total_successful_iterations", 0),
+            "failed_iterations": summary.get("total_failed_iterations", 0),
+            "skipped_sizes": skipped,
+            "unrecorded_sizes": unrecorded,
+            "recoveries": runner.recoveries,
+            "elapsed": time.time() - port_start,
+        })
+        if runner.port_failed:
+            entry["status"] = "failed (recovery)"
+        elif entry["status"] == "ok" and entry["failed_iterations"]:
+            entry["status"] = "failed (iterations)"
+        elif entry["status"] == "ok" and unrecorded and not runner.out_of_time():
+            entry["status"] = "failed (no recorded iterations)"
+        elif entry["status"] == "ok" and (skipped or unrecorded):
+            entry["status"] = "partial (time budget)"
+    
+    report = {
+        "config": config,
+        "started": datetime.fromtimestamp(started).isoformat(),
+        "elapsed": time.time() - started,
+        "ports": entries,
+    }
+    filename = os.path.join(config["output_dir"], f"campaign_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    
+    print("\n" + "=" * 60)
+    print(f"测试活动完成 ({report['elapsed']:.0f} s)")
+    print("=" * 60)
+    for entry in entries:
+        detail = ""
+        if "successful_iterations" in entry:
+            detail = (f"  成功 {entry['successful_iterations']} / 失败 {entry['failed_iterations']}"
+                      f"  恢复 {entry['recoveries']} 次  {entry['elapsed']:.0f} s")
+        print(f"  {entry['port']:<40} {entry['status']}{detail}")
+    print(f"\n活动汇总已保存到: {filename}")
+    return 0 if all(e["status"] == "ok" or e["status"].startswith(("skipped", "partial")) for e in entries) else 1
 
 # 主函数 - 修改为交互式菜单
 def main():
     print("=" * 60)
     print("GCM-SIV算法跑分测试框架")
     print("=" * 60)
-    print("\n请选择测试项目:")
-    print("1. 硬件AES-GCM-SIV (hardware_aes)")
-    print("2. 软件AES-GCM-SIV (software_aes)")
-    print("3. 软件Ascon (software_ascon)")
-    print("\n0. 退出")
     
-    choice = input("\n请选择 (0-3): ").strip()
+    # 获取串口端口
+    port = input(f"请输入串口端口 (默认: COM3): ").strip()
+    if not port:
+        port = "COM3"
     
-    project_map = {
-        "1": "hardware_aes",
-        "2": "software_aes",
-        "3": "software_ascon"
-    }
+    # 查询固件能力，自动识别烧录的算法
+    print("正在查询MCU固件能力...")
+    capabilities = GCM_SIV_FileProcessor(port).query_capabilities()
+    project_code = ALGORITHM_PROJECTS.get(capabilities.get("algorithm"))
     
-    if choice == "0":
-        print("退出程序")
-        return
+    if project_code:
+        print(f"检测到固件: {capabilities['algorithm']} v{capabilities.get('version', '?')} "
+              f"(build {capabilities.get('build', '?')})")
+    else:
+        # 旧固件不支持能力查询，由用户选择
+        print("固件不支持能力查询，请手动选择")
+        print("\n请选择测试项目:")
+        print("1. 硬件AES-GCM-SIV (hardware_aes)")
+        print("2. 软件AES-GCM-SIV (software_aes)")
+        print("3. 软件Ascon (software_ascon)")
+        print("\n0. 退出")
+        
+        choice = input("\n请选择 (0-3): ").strip()
+        
+        project_map = {
+            "1": "hardware_aes",
+            "2": "software_aes",
+            "3": "software_ascon"
+        }
+        
+        if choice == "0":
+            print("退出程序")
+            return
+        
+        if choice not in project_map:
+            print("无效选择")
+            return
+        
+        project_code = project_map[choice]
     
-    if choice not in project_map:
-        print("无效选择")
-        return
+    project_name = PROJECT_NAMES.get(project_code, project_code)
     
-    project_code = project_map[choice]
+    # 双模式固件：可以在同一块开发板上交替测试各引擎，无需重新烧录
+    engines = None
+    if len(capabilities.get("engines", [])) > 1:
+        print(f"固件包含多个加密引擎: {', '.join(capabilities['engines'])}")
+        if input("交替运行A/B对比测试? (y/N): ").strip().lower() == 'y':
+            engines = capabilities["engines"]
+            project_name = " vs ".join(
+                PROJECT_NAMES.get(ALGORITHM_PROJECTS.get(e), e) for e in engines)
     
-    # 项目名称映射
-    project_names = {
-        "hardware_aes": "硬件AES-GCM-SIV",
-        "software_aes": "软件AES-GCM-SIV", 
-        "software_ascon": "软件Ascon"
-    }
+    # 单会话往返校验：不写临时文件，只握手一次（需要固件支持）
+    inline_verify = input("使用单会话往返校验模式? (y/N): ").strip().lower() == 'y'
     
-    project_name = project_names.get(project_code, project_code)
+    # 分阶段分解：握手、链路、片上加密、协议开销分别测量（需要固件支持）
+    phase_only = False
+    if capabilities.get("options", 0) & OPT_BENCH:
+        phase_only = input("只运行分阶段分解测试（握手/链路/加密/协议）? (y/N): ").strip().lower() == 'y'
     
-    # 获取串口端口
     print("\n" + "-" * 60)
-    port = input(f"请输入串口端口 (默认: COM3): ").strip()
-    if not port:
-        port = "COM3"
-    
     # 获取输出目录
     output_dir = input(f"请输入输出目录 (默认: benchmark_results): ").strip()
     if not output_dir:
@@ -1308,11 +2256,17 @@ def main():
     runner = BenchmarkRunner(
         port=port,
         project_name=project_name,
-        output_dir=output_dir
+        output_dir=output_dir,
+        capabilities=capabilities,
+        engines=engines,
+        inline_verify=inline_verify
     )
     
     try:
-        runner.run_full_benchmark()
+        if phase_only:
+            runner.run_phase_benchmark()
+        else:
+            runner.run_full_benchmark()
     except KeyboardInterrupt:
         print("\n\n测试被用户中断")
     except Exception as e:
@@ -1321,4 +2275,10 @@ def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GCM-SIV benchmark (interactive menu without arguments)")
+    parser.add_argument("--campaign", metavar="CONFIG",
+                        help="run an unattended campaign from a JSON config (see load_campaign)")
+    args = parser.parse_args()
+    if args.campaign:
+        sys.exit(run_campaign(args.campaign))
     main()
\ No newline at end of file